@@ -1,262 +1,564 @@
-from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO
-from datetime import datetime, time as dt_time
-from utils.encryption import EncryptionManager
+from flask import Flask, request, jsonify
+from flask_socketio import SocketIO, emit
+from utils.change import ChangeFilter
+from utils.connection import ConnectionManager
+from utils.emitter import EmitAggregator
+from utils.metrics import MetricsRegistry
+from utils.motion import MotionAggregator, parse_summary
+from utils.outbox import Outbox
+from utils.payload import (FLAG_ALARM, KIND_MOTION, KIND_TEMPERATURE, Record, decode_envelope, decode_reading,
+                           encode_envelope, encode_reading, is_envelope)
+from utils.publisher import SensorPublisher, load_sensors
+from utils.settings import ConfigStore
+from utils.startup import Startup
+from utils.state import StateCache
+from utils.timeseries import TimeSeriesStore
+from utils.topics import load_topics, matches, parse_sensor_topic, sensor_topic, topic_filter
+from utils.web import create_blueprint
+import asyncio
 import json
-import paho.mqtt.client as mqtt
+import sys
 import threading
-import time
-import random
+
+# NumPy (utils.rules), cryptography (utils.encryption) and paho are only imported by init_components()
+# and connect_mqtt(), once the web server is already answering; /ready reports when they are done
+startup = Startup()
 
 # Load configuration
-def load_config():
-    with open('config.json', 'r') as f:
+def load_config(path='config.json'):
+    with open(path, 'r') as f:
         return json.load(f)
 
-# Initialize config
-config_data = load_config()
+# Set by create_app()
+config_file = 'config.json'  # create_app()'s config_path, watched for edits when config_reload is enabled
+config_data = None
+app = None
+socketio = None
+emitter = None  # Temperature and motion events are batched and flushed to browsers at a fixed frame rate
+metrics_settings = {}
+embed_timestamps = True  # Appends the reading time to temperature payloads, for Client2's end-to-end latency
+settings = None  # Runtime settings (threshold, alarm hours): read settings.snapshot, change them with settings.update()
+state = None  # Latest values sent to dashboards as one snapshot on connect and via /state
+temperature_filter = None
+binary_payloads = False
+max_batch = 200
+topics = None  # Per-topic QoS and retain flags from mqtt.topics
+motion_topic = temperature_topic = cooling_topic = config_topic = None
+
+# Set by init_components()
+encryption_manager = None
+history = None  # None when history is disabled
+outbox = None  # None when the outbox is disabled
+alarm_rules = None
+motion_aggregator = None  # None when every motion detection is sent on its own
 
-# Global variables
-app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")  # Allow all origins for development
 mqtt_client = None
 publish_thread = None
-mqtt_thread = None
-encryption_manager = EncryptionManager()
-
-# Global configuration
-config = config_data['default_settings']
-
-# MQTT Settings
-primary_broker = config_data['mqtt']['primary_broker']
-fallback_broker = config_data['mqtt']['fallback_broker']
-port = config_data['mqtt']['port']
-motion_topic = config_data['mqtt']['topics']['motion']
-temperature_topic = config_data['mqtt']['topics']['temperature']
-cooling_topic = config_data['mqtt']['topics']['cooling']
-config_topic = config_data['mqtt']['topics']['config']
-
-# Time configuration
-def is_time_between(current_time, start_time_str, end_time_str):
-    # Convert string times to datetime.time objects
-    start_time = dt_time.fromisoformat(start_time_str)
-    end_time = dt_time.fromisoformat(end_time_str)
-    current = current_time.time()  # Get time component of datetime
-    
-    if start_time <= end_time:
-        # Simple case: start time is before end time (e.g., 09:00 to 17:00)
-        return start_time <= current <= end_time
-    else:
-        # Overnight case: start time is after end time (e.g., 22:00 to 06:00)
-        return current >= start_time or current <= end_time
+sensor_publisher = None
+
+# Prometheus-style metrics served at /metrics. Hot paths only increment counters; component stats
+# (connection, publisher, emitter, history) are read when /metrics is scraped
+metrics = MetricsRegistry()
+mqtt_messages = metrics.counter('mqtt_messages_total', 'MQTT messages by direction and base topic', ('direction', 'topic'))
+errors = metrics.counter('errors_total', 'Errors by where they were caught', ('source',))
+suppressed_messages = metrics.counter('mqtt_suppressed_total', 'Messages not published because nothing changed', ('topic',))
+connected_clients = metrics.gauge('socketio_connected_clients', 'Dashboards currently connected')
+connected_clients.set(0)
+metrics.collector('connection', lambda: mqtt_client.stats() if mqtt_client else None)
+metrics.collector('publisher', lambda: {
+    'published': sensor_publisher.published,
+    'errors': sensor_publisher.errors,
+    'skipped_deadlines': sensor_publisher.skipped_deadlines,
+    'sensors': len(sensor_publisher.sensors),
+} if sensor_publisher else None)
+
+MOTION_MESSAGE = "Motion detected!"
+ALARM_SUFFIX = " [ALARM HOURS - Alert triggered!]"
+
+# Registered on the app by create_app(); the routes shared with Client2 come from utils.web
+# The settings form loads /config and /alarm-config once on page load, and settings exists as soon
+# as create_app() has run, so their GETs are answered during startup
+routes = create_blueprint('client1', sys.modules[__name__], 'client1.html', startup_endpoints=('update_config', 'alarm_config'))
+
+def create_app(config_path='config.json'):
+    """
+    Application factory: reads the configuration and builds the Flask app, the socket.io server and
+    the in-memory components. Nothing here imports NumPy or cryptography or reads files other than
+    the configuration, so the web server can start straight away; init_components() builds the rest.
+    Returns the Flask app.
+    """
+    global config_file, config_data, app, socketio, emitter, metrics_settings, embed_timestamps, settings, state
+    global temperature_filter, binary_payloads, max_batch, topics, motion_topic, temperature_topic, cooling_topic, config_topic
+    config_file = config_path
+    config_data = load_config(config_path)
+    app = Flask(__name__)
+    app.register_blueprint(routes)
+    socketio = SocketIO(app, cors_allowed_origins="*")  # Allow all origins for development
+    socketio.on_event('connect', handle_connect)
+    socketio.on_event('disconnect', handle_disconnect)
+    emitter = EmitAggregator.from_config(socketio, config_data)
+    metrics.collector('emitter', emitter.stats)
+
+    metrics_settings = config_data.get('metrics', {})
+    if metrics_settings.get('enabled', True):
+        emitter.event_counter = metrics.counter('socketio_events_total', 'Events sent to dashboards by event name', ('event',))
+    embed_timestamps = metrics_settings.get('embed_timestamps', True)
+
+    settings = ConfigStore(config_data['default_settings'], 'user1')
+    state = StateCache(config=dict(settings.snapshot))
+
+    # With mqtt.publish.on_change, a sensor's temperature is only published when it moves by more than the
+    # deadband (or on heartbeat); the local dashboard and history still get every reading
+    temperature_filter = ChangeFilter.from_config(config_data, 'temperature_deadband')
+
+    # Sensor readings go out as text (one per message) or as binary envelopes of up to max_batch readings per room
+    payload_settings = config_data['mqtt'].get('payload', {})
+    binary_payloads = payload_settings.get('format', 'text') == 'binary'
+    max_batch = max(1, int(payload_settings.get('max_batch', 200)))
+
+    topics = load_topics(config_data)
+    motion_topic = topics['motion'].topic
+    temperature_topic = topics['temperature'].topic
+    cooling_topic = topics['cooling'].topic
+    config_topic = topics['config'].topic
+    startup.mark('app')
+    return app
+
+def init_components():
+    """
+    Builds the components with slow imports or disk I/O: the encryption manager (key files),
+    history (SQLite), the outbox (segment recovery), the alarm rules (NumPy) and the motion
+    aggregator. Called once after create_app(), by start_services() or run_async().
+    """
+    global encryption_manager, history, outbox, alarm_rules, motion_aggregator
+    from utils.encryption import EncryptionManager
+    encryption_manager = EncryptionManager.from_config(config_data)
+    if metrics_settings.get('enabled', True):
+        encryption_manager.timings = metrics.histogram('encryption_seconds', 'Encrypt and decrypt latency per message', ('operation',))
+    startup.mark('encryption')
+
+    history = TimeSeriesStore.from_config(config_data, 'user1')
+    if history:
+        metrics.collector('history', lambda: {'written': history.written})
+    # Readings produced while the broker is unreachable are kept on disk and drained once connected
+    outbox = Outbox.from_config(config_data)
+    if outbox:
+        metrics.collector('outbox', outbox.stats)
+    startup.mark('storage')
+
+    # Alarm hours compiled once per configuration change and evaluated per batch of motion readings
+    from utils.rules import AlarmRules
+    alarm_rules = AlarmRules.from_config(config_data, settings.snapshot)
+    # With rules.motion.window, each sensor's detections are merged into one summary per window and
+    # alerts are debounced per room; see publish_motion_summaries
+    motion_aggregator = MotionAggregator.from_config(config_data, publish_motion_summaries)
+    if motion_aggregator:
+        metrics.collector('motion', motion_aggregator.stats)
+    startup.mark('rules')
+    settings.subscribe(on_config_change)
+
+def summary_message(summary):
+    """Log line for a motion window summary."""
+    message = f"Motion detected {summary['count']} times over {summary['last'] - summary['first']:.0f}s"
+    if summary['alarms']:
+        message += f" [ALARM HOURS - {summary['alarms']} during alarm hours]"
+    return message
+
+def on_config_change(snapshot, changed, source):
+    """
+    The one path every settings change takes, whether it came from a route, config.json or MQTT:
+    recompile the alarm rules, update dashboards, and broadcast local changes to Client2.
+    """
+    alarm_rules.configure(snapshot['alarm_enabled'], snapshot['alarm_start'], snapshot['alarm_end'])
+    state.set('config', dict(snapshot))
+    emitter.emit_now('config_update', {'data': dict(snapshot)})
+    if source != 'mqtt' and mqtt_client:
+        # Retained (by default), so a client that starts later gets the current settings
+        mqtt_client.publish(config_topic, encryption_manager.encrypt(settings.message()), topics['config'].qos, topics['config'].retain)
+        mqtt_messages.inc('published', 'config')
 
 # MQTT callbacks
 def on_connect(client, userdata, flags, rc):
     print(f"Connected with result code {rc}")
     if rc == 0:
         print("Successfully connected to MQTT broker")
-        client.subscribe([(cooling_topic, 0), (temperature_topic, 0), (motion_topic, 0)])
-        socketio.emit('mqtt_status', {'status': 'connected'})
+        startup.mark('mqtt_connected')
+        client.subscribe([(topic_filter(cooling_topic), topics['cooling'].qos), (topic_filter(temperature_topic), topics['temperature'].qos),
+                          (topic_filter(motion_topic), topics['motion'].qos), (config_topic, topics['config'].qos)])
+        emitter.emit_now('mqtt_status', {'status': 'connected'})
     else:
         print(f"Failed to connect to MQTT broker with code {rc}")
-        socketio.emit('mqtt_status', {'status': 'disconnected'})
+        emitter.emit_now('mqtt_status', {'status': 'disconnected'})
 
 def on_disconnect(client, userdata, rc):
     print(f"Disconnected from MQTT broker with code {rc}")
-    socketio.emit('mqtt_status', {'status': 'disconnected'})
+    emitter.emit_now('mqtt_status', {'status': 'disconnected'})
 
 def on_message(client, userdata, msg):
     try:
-        if msg.topic == cooling_topic:
+        if not msg.payload:
+            return  # A cleared retained message
+        if matches(cooling_topic, msg.topic):
             decrypted_message = encryption_manager.decrypt(msg.payload)
-            socketio.emit('cooling_command', {'data': decrypted_message})
-        elif msg.topic == temperature_topic:
-            temperature = float(encryption_manager.decrypt(msg.payload))
-            socketio.emit('temperature', {'data': temperature})
-        elif msg.topic == motion_topic:
-            motion_message = encryption_manager.decrypt(msg.payload)
-            socketio.emit('motion', {'data': motion_message})
+            room, _ = parse_sensor_topic(cooling_topic, msg.topic)
+            mqtt_messages.inc('received', 'cooling')
+            state.set_room('cooling_command', room, {'data': decrypted_message, 'room': room})
+            emitter.emit('cooling_command', {'data': decrypted_message, 'room': room}, key=msg.topic)
+        elif matches(temperature_topic, msg.topic):
+            plaintext = encryption_manager.decrypt_bytes(msg.payload)
+            mqtt_messages.inc('received', 'temperature')
+            room, sensor_id = parse_sensor_topic(temperature_topic, msg.topic)
+            if is_envelope(plaintext):
+                readings = [(record.sensor_id, record.value, record.timestamp) for record in decode_envelope(plaintext)]
+            else:
+                value, sent_at = decode_reading(plaintext.decode())
+                readings = [(sensor_id, float(value), sent_at)]
+            for sensor_id, temperature, sent_at in readings:
+                state.set_room('temperature', room, {'data': temperature, 'room': room, 'sensor': sensor_id})
+                key = sensor_topic(temperature_topic, room, sensor_id) if sensor_id and room else msg.topic
+                emitter.emit('temperature', {'data': temperature, 'ts': sent_at}, key=key)
+        elif matches(motion_topic, msg.topic):
+            plaintext = encryption_manager.decrypt_bytes(msg.payload)
+            mqtt_messages.inc('received', 'motion')
+            if is_envelope(plaintext):
+                motion_messages = [MOTION_MESSAGE + (ALARM_SUFFIX if record.flags & FLAG_ALARM else "")
+                                   for record in decode_envelope(plaintext)]
+            else:
+                text = plaintext.decode()
+                summary = parse_summary(text)
+                if summary is not None:
+                    emitter.emit('motion', {'data': MOTION_MESSAGE, 'log_message': summary_message(summary),
+                                            'room': summary['room'], 'sensor': summary['sensor'],
+                                            'ts': summary['last'], 'summary': True})
+                    return
+                # Motion replayed from the outbox carries its reading time like a temperature
+                motion_messages = [decode_reading(text)[0]]
+            for motion_message in motion_messages:
+                emitter.emit('motion', {'data': motion_message})
         elif msg.topic == config_topic:
-            config_updates = json.loads(encryption_manager.decrypt(msg.payload))
-            for key, value in config_updates.items():
-                if key in config:
-                    config[key] = value
-            socketio.emit('config_update', {'data': config})
+            # Versioned; our own updates and stale re-deliveries are ignored
+            mqtt_messages.inc('received', 'config')
+            settings.apply_remote(encryption_manager.decrypt(msg.payload))
     except Exception as e:
+        errors.inc('on_message')
         print(f"Error processing message: {e}")
 
 # MQTT client setup
 def connect_mqtt():
+    """
+    Builds the connection manager for the primary/fallback brokers in config.json.
+    The broker connection itself is made by start() (threaded) or AsyncMQTTHelper (asyncio),
+    with health checks, backoff, failback and offline publish buffering.
+    """
+    import paho.mqtt.client as mqtt
     print("Setting up MQTT client...")
-    mqtt_client = mqtt.Client()
-    
-    # Try primary broker first
-    try:
-        print(f"Attempting to connect to primary broker at {primary_broker}:{port}")
-        mqtt_client.username_pw_set("102779797", "102779797")
-        mqtt_client.on_connect = on_connect
-        mqtt_client.on_disconnect = on_disconnect
-        mqtt_client.on_message = on_message
-        mqtt_client.connect(primary_broker, port, 60)
-        return mqtt_client
-    except Exception as e:
-        print(f"Failed to connect to primary broker: {e}")
-        
-        # Try fallback broker
-        try:
-            print(f"Attempting to connect to fallback broker at {fallback_broker}:{port}")
-            mqtt_client = mqtt.Client()  # Create new client instance
-            mqtt_client.on_connect = on_connect
-            mqtt_client.on_disconnect = on_disconnect
-            mqtt_client.on_message = on_message
-            mqtt_client.connect(fallback_broker, port, 60)
-            return mqtt_client
-        except Exception as e:
-            print(f"Failed to connect to fallback broker: {e}")
-            raise
-
-# MQTT initialization
-def init_mqtt():
-    global mqtt_client, mqtt_thread, publish_thread
+    connection = ConnectionManager.from_config(config_data, lambda: mqtt.Client())
+    connection.on_connect = on_connect
+    connection.on_disconnect = on_disconnect
+    connection.on_message = on_message
+    return connection
+
+# Hot reload of default_settings when config.json is edited
+def watch_config():
+    reload_settings = config_data.get('config_reload', {})
+    if reload_settings.get('enabled', False):
+        settings.watch(config_file, reload_settings.get('interval', 2.0))
+
+# Threaded runtime: runs on the startup thread while Flask-SocketIO is already serving
+def start_services():
+    global mqtt_client, publish_thread
     
     if mqtt_client is not None:
         return  # Already initialized
-        
-    try:
-        mqtt_client = connect_mqtt()
-        
-        # Start MQTT loop in a separate thread
-        mqtt_thread = threading.Thread(target=mqtt_client.loop_forever)
-        mqtt_thread.daemon = True
-        mqtt_thread.start()
-
-        # Start publishing in a separate thread
-        publish_thread = threading.Thread(target=generate_and_publish)
-        publish_thread.daemon = True
-        publish_thread.start()
-        
-    except Exception as e:
-        print(f"Error initializing MQTT: {e}")
-        mqtt_client = None
+
+    init_components()
+    emitter.start()
+    watch_config()
+    if history:
+        history.start()
+    if motion_aggregator:
+        motion_aggregator.start()
+
+    # Connect and run the MQTT loop on the connection manager's thread
+    mqtt_client = connect_mqtt()
+    mqtt_client.start()
+    if outbox:
+        outbox.start(publish_backlog, mqtt_client.is_connected)
+
+    # Start publishing in a separate thread
+    publish_thread = threading.Thread(target=generate_and_publish)
+    publish_thread.daemon = True
+    publish_thread.start()
 
 # Cleanup function to stop MQTT client and threads
 def cleanup():
-    global mqtt_client, mqtt_thread, publish_thread
+    global mqtt_client, publish_thread
+    # Let a startup still in progress finish, so nothing it starts is left running
+    startup.wait(10)
+    if sensor_publisher:
+        sensor_publisher.stop()
+    if motion_aggregator:
+        motion_aggregator.stop()  # Publishes the windows still open
+    if outbox:
+        outbox.stop()
+    if emitter:
+        emitter.stop()
+    if settings:
+        settings.stop()
+    if history:
+        history.stop()
     if mqtt_client:
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
+        mqtt_client.stop()
         mqtt_client = None
     
     # The threads are daemon threads, so they will be terminated automatically
 
-def generate_and_publish():
+def publish_readings(readings):
     """
-    Continuously generates simulated temperature and motion data, encrypts the messages, and publishes them to MQTT topics.
+    Encrypts and publishes one batch of readings from the sensor publisher.
     Also emits real-time updates and alerts to connected SocketIO clients.
-    - Generates a random temperature value between 20°C and 30°C every 5 seconds.
-    - Publishes the encrypted temperature to the configured MQTT topic.
-    - Emits the temperature value to SocketIO clients.
-    - Randomly simulates motion detection; if motion is detected:
-        - Emits a motion message and log to SocketIO clients.
-        - If the alarm is enabled and the current time is within the configured alarm hours, triggers an alert and emits it.
-        - Publishes the encrypted motion message to the MQTT topic.
-    - Handles and logs exceptions, emitting an error status to SocketIO clients if any occur.
-    - Runs indefinitely, sleeping 5 seconds between each iteration.
+    - Temperature readings are published to their sensor topic and emitted to SocketIO clients;
+      with publish-on-change, readings within the deadband of the last published value are not published.
+    - Motion readings are emitted as a motion message and log; if the alarm is enabled and the
+      reading falls within its room's alarm hours, an alert is emitted as well.
+    - Alarm hours for all motion readings in the batch are evaluated in one alarm_rules call.
+    - With the motion aggregator, a detection only opens or extends its sensor's window: the
+      dashboard hears about the first one straight away, alerts go through the room's debounce and
+      cooldown, and the window is published as one summary when it closes.
+    - With the binary payload format, readings are packed into one envelope per room and type
+      (up to max_batch readings each) and published to the room-level topic.
+    - The whole batch is encrypted with one encrypt_many call before publishing.
+    - While the broker is unreachable, the encrypted messages go to the disk outbox instead, with
+      timestamps embedded so they keep the time they were read. Messages paho refuses mid-batch go
+      to the outbox as well (see publish_message).
     """
-    while True:
-        try:
-            # Get the current time
-            current_time = datetime.now()
-            
-            # Generate temperature data
-            temperature = round(random.uniform(20, 30), 2)
-            
-            # Publish to MQTT
-            if mqtt_client:
-                # Encrypt and publish temperature
-                temp_msg = f"{temperature}"
-                encrypted_temp = encryption_manager.encrypt(temp_msg)
-                mqtt_client.publish(temperature_topic, encrypted_temp)
-                socketio.emit('temperature', {'data': temperature})
-                print(f"[{current_time.strftime('%Y-%m-%d %H:%M:%S')}] Published temperature: {temp_msg}°C")
-                
-                # Generate motion detection
-                motion = random.choice([True, False])
-                if motion:
-                    # Create the base motion message
-                    motion_message = "Motion detected!"
-                    log_message = motion_message
-                    
-                    # Check if motion alert should be triggered
-                    if config['alarm_enabled']:
-                        # Check if current time is within alarm hours
-                        is_alarm_time = is_time_between(
-                            current_time,
-                            config['alarm_start'],
-                            config['alarm_end']
-                        )
-                        if is_alarm_time:
-                            log_message += " [ALARM HOURS - Alert triggered!]"
-                            print(f"Alarm triggered! Time: {current_time.strftime('%H:%M:%S')}, Start: {config['alarm_start']}, End: {config['alarm_end']}")
-                            socketio.emit('alert', {'data': "Motion detected during alarm hours!"})
-                    
-                    # Emit both messages - one for display, one for log
-                    socketio.emit('motion', {'data': motion_message, 'log_message': log_message})
-                    
-                    # Encrypt and publish motion message
-                    encrypted_motion = encryption_manager.encrypt(log_message)
-                    mqtt_client.publish(motion_topic, encrypted_motion)
-                    print(f"[{current_time.strftime('%Y-%m-%d %H:%M:%S')}] Published motion: {log_message}")
-            
-        except Exception as e:
-            print(f"Error in generate_and_publish: {e}")
-            socketio.emit('mqtt_status', {'status': 'error'})
-        
-        # Sleep for exactly 5 seconds between iterations
-        time.sleep(5)
-
-@app.route('/')
-def index():
-    return render_template('client1.html')
-
-@app.route('/config', methods=['GET', 'POST'])
+    offline = mqtt_client is None or not mqtt_client.is_connected()
+    if mqtt_client is None and outbox is None:
+        return
+    to_outbox = offline and outbox is not None
+    stamp = embed_timestamps or to_outbox
+    try:
+        motion = [reading for reading in readings if reading.sensor.type == 'motion']
+        alarms = iter(alarm_rules.evaluate([r.sensor.room for r in motion], [r.timestamp for r in motion]))
+        outgoing = []  # (type, topic, plaintext) in reading order
+        envelopes = {}  # binary format: (type, room topic) -> [Record]
+        for reading in readings:
+            sensor = reading.sensor
+            if sensor.type == 'temperature':
+                if temperature_filter is not None and not temperature_filter.check(sensor.topic, float(reading.value)):
+                    suppressed_messages.inc('temperature')
+                elif binary_payloads:
+                    envelopes.setdefault(('temperature', f"{temperature_topic}/{sensor.room}"), []).append(
+                        Record(sensor.sensor_id, KIND_TEMPERATURE, float(reading.value), reading.timestamp, 0))
+                else:
+                    outgoing.append(('temperature', sensor.topic, encode_reading(reading.value, reading.timestamp if stamp else None)))
+                if history:
+                    history.record(f"temperature/{sensor.room}/{sensor.sensor_id}", reading.timestamp, reading.value)
+                event = {'data': reading.value, 'room': sensor.room, 'sensor': sensor.sensor_id, 'ts': reading.timestamp}
+                state.set_room('temperature', sensor.room, event)
+                emitter.emit('temperature', event, key=sensor.topic)
+            elif sensor.type == 'motion' and motion_aggregator:
+                alarm = next(alarms)
+                opened, alert = motion_aggregator.add(sensor.room, sensor.sensor_id, sensor.topic, reading.timestamp, alarm)
+                if alert:
+                    message = "Motion detected during alarm hours!"
+                    if alert > 1:
+                        message += f" ({alert} detections)"
+                    emitter.emit_now('alert', {'data': message, 'room': sensor.room})
+                if opened:
+                    event = {'data': MOTION_MESSAGE, 'log_message': MOTION_MESSAGE + (ALARM_SUFFIX if alarm else ""),
+                             'room': sensor.room, 'sensor': sensor.sensor_id, 'ts': reading.timestamp}
+                    state.add_event('motion', event)
+                    emitter.emit('motion', event)
+            elif sensor.type == 'motion':
+                # Create the base motion message
+                motion_message = MOTION_MESSAGE
+                log_message = motion_message
+
+                # Check if motion alert should be triggered
+                alarm = next(alarms)
+                if alarm:
+                    log_message += ALARM_SUFFIX
+                    emitter.emit_now('alert', {'data': "Motion detected during alarm hours!", 'room': sensor.room})
+
+                # Emit both messages - one for display, one for log
+                event = {'data': motion_message, 'log_message': log_message, 'room': sensor.room,
+                         'sensor': sensor.sensor_id, 'ts': reading.timestamp}
+                state.add_event('motion', event)
+                emitter.emit('motion', event)
+
+                if binary_payloads:
+                    envelopes.setdefault(('motion', f"{motion_topic}/{sensor.room}"), []).append(
+                        Record(sensor.sensor_id, KIND_MOTION, 1.0, reading.timestamp, FLAG_ALARM if alarm else 0))
+                else:
+                    outgoing.append(('motion', sensor.topic, encode_reading(log_message, reading.timestamp) if to_outbox else log_message))
+                if history:
+                    history.record(f"motion/{sensor.room}/{sensor.sensor_id}", reading.timestamp, 1.0, log_message)
+
+        for (kind, topic), records in envelopes.items():
+            for i in range(0, len(records), max_batch):
+                outgoing.append((kind, topic, encode_envelope(records[i:i + max_batch])))
+
+        # Encrypt and publish the batch
+        encrypted = encryption_manager.encrypt_many([message for _, _, message in outgoing])
+        for (kind, topic, _), payload in zip(outgoing, encrypted):
+            publish_message(kind, topic, payload, to_outbox)
+    except Exception as e:
+        errors.inc('publish_readings')
+        print(f"Error in publish_readings: {e}")
+        emitter.emit_now('mqtt_status', {'status': 'error'})
+
+def publish_motion_summaries(windows):
+    """
+    Publishes the motion windows the aggregator closed: one JSON summary per sensor to its topic
+    (or the outbox while offline), plus a dashboard log entry and a history event.
+    """
+    offline = mqtt_client is None or not mqtt_client.is_connected()
+    outgoing = []
+    for window in windows:
+        summary = window.summary()
+        event = {'data': MOTION_MESSAGE, 'log_message': summary_message(summary), 'room': window.room,
+                 'sensor': window.sensor_id, 'ts': window.last, 'summary': True}
+        state.add_event('motion', event)
+        emitter.emit('motion', event)
+        if history:
+            # The window's detection count, so motion buckets' sum counts detections (see TimeSeriesStore)
+            history.record(f"motion/{window.room}/{window.sensor_id}", window.first, float(window.count), event['log_message'])
+        outgoing.append((window.topic, window.to_json()))
+    if offline and outbox is None:
+        return
+    encrypted = encryption_manager.encrypt_many([text for _, text in outgoing])
+    for (topic, _), payload in zip(outgoing, encrypted):
+        publish_message('motion', topic, payload, offline)
+
+def publish_message(kind, topic, payload, to_outbox):
+    """
+    Publishes an encrypted message with its type's QoS and retain flag. With the outbox enabled, a
+    message paho doesn't take (e.g. the link dropped mid-batch) goes to the outbox instead of the
+    in-memory buffer, as do all messages when to_outbox is set.
+    """
+    if not to_outbox:
+        info = mqtt_client.publish(topic, payload, topics[kind].qos, topics[kind].retain, buffer=outbox is None)
+        if outbox is None or (info is not None and info.rc == 0):
+            mqtt_messages.inc('published', kind)
+            return
+    outbox.append(topic, payload)
+    mqtt_messages.inc('outboxed', kind)
+
+def publish_backlog(topic, payload):
+    """
+    Publishes a message drained from the outbox with its topic's QoS and retain flag. Returns False
+    if paho didn't take it (e.g. the link dropped mid-batch), so the outbox keeps it; it is never
+    put in the capped in-memory buffer, which could lose it.
+    """
+    options = topics['motion'] if matches(motion_topic, topic) else topics['temperature']
+    info = mqtt_client.publish(topic, payload, options.qos, options.retain, buffer=False)
+    return info is not None and info.rc == 0
+
+def create_publisher():
+    global sensor_publisher
+    sensors = load_sensors(config_data)
+    sensor_publisher = SensorPublisher(
+        sensors,
+        publish_readings,
+        batch_size=config_data.get('sensors', {}).get('batch_size', 500)
+    )
+    print(f"Publishing {len(sensors)} sensors")
+    return sensor_publisher
+
+def generate_and_publish():
+    """
+    Runs the sensor publisher over the inventory in config.json until cleanup() stops it.
+    Readings are produced on per-sensor deadlines and handed to publish_readings in batches.
+    """
+    create_publisher().run()
+
+@routes.route('/config', methods=['GET', 'POST'])
 def update_config():
     if request.method == 'POST':
         data = request.get_json()
-        if 'temp_threshold' in data:
-            config['temp_threshold'] = float(data['temp_threshold'])
-            # Encrypt and publish the new threshold to MQTT
-            if mqtt_client:
-                encrypted_config = encryption_manager.encrypt(json.dumps({'temp_threshold': config['temp_threshold']}))
-                mqtt_client.publish(config_topic, encrypted_config)
-        if 'alert_enabled' in data:
-            config['alert_enabled'] = bool(data['alert_enabled'])
-        return jsonify({'status': 'success'})
-    return jsonify(config)
-
-@app.route('/alarm-config', methods=['GET', 'POST'])
+        changes = {key: data[key] for key in ('temp_threshold', 'alert_enabled') if key in data}
+        # The store validates the values; on_config_change publishes the new settings to MQTT
+        try:
+            settings.update(changes)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'error': str(e)}), 400
+        return jsonify({'status': 'success', 'version': settings.version})
+    return jsonify(dict(settings.snapshot))
+
+@routes.route('/alarm-config', methods=['GET', 'POST'])
 def alarm_config():
     if request.method == 'POST':
         data = request.get_json()
-        if 'alarm_start' in data:
-            config['alarm_start'] = data['alarm_start']
-        if 'alarm_end' in data:
-            config['alarm_end'] = data['alarm_end']
-        if 'alarm_enabled' in data:
-            config['alarm_enabled'] = bool(data['alarm_enabled'])
-        return jsonify({'status': 'success'})
+        changes = {key: data[key] for key in ('alarm_start', 'alarm_end', 'alarm_enabled') if key in data}
+        try:
+            settings.update(changes)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'error': str(e)}), 400
+        return jsonify({'status': 'success', 'version': settings.version})
+    snapshot = settings.snapshot
     return jsonify({
-        'alarm_start': config['alarm_start'],
-        'alarm_end': config['alarm_end'],
-        'alarm_enabled': config['alarm_enabled']
+        'alarm_start': snapshot['alarm_start'],
+        'alarm_end': snapshot['alarm_end'],
+        'alarm_enabled': snapshot['alarm_enabled']
     })
 
+# socket.io handlers, registered by create_app()
+def handle_connect():
+    # Send the latest state straight away instead of waiting for the next MQTT message
+    connected_clients.inc()
+    emit('snapshot', state.snapshot())
+
+def handle_disconnect(*args):
+    connected_clients.dec()
+
+async def run_async(port):
+    """
+    asyncio runtime: the MQTT socket, sensor publisher and socket.io fan-out share one event loop.
+    The server starts listening straight away; the components are built on an executor thread
+    meanwhile, and the MQTT connection and publisher start once they are ready.
+    """
+    from utils import aio
+    mqtt_io = None
+
+    def start(loop, tasks):
+        global mqtt_client
+        nonlocal mqtt_io
+        if history:
+            history.start()
+        watch_config()
+        mqtt_client = connect_mqtt()
+        mqtt_io = aio.AsyncMQTTHelper(mqtt_client, loop)
+        mqtt_io.start()
+        tasks.append(loop.create_task(create_publisher().run_async()))
+        if outbox:
+            tasks.append(loop.create_task(outbox.run_async(publish_backlog, mqtt_client.is_connected)))
+        if motion_aggregator:
+            tasks.append(loop.create_task(motion_aggregator.run_async()))
+
+    def stop():
+        if motion_aggregator:
+            motion_aggregator.stop()
+        if outbox:
+            outbox.stop()
+        if mqtt_io:
+            mqtt_io.stop()
+
+    await aio.run_client(sys.modules[__name__], port, start, stop)
+
 if __name__ == '__main__':
+    create_app()
+    # Several instances on one host each need their own port: python Client1_web.py 5010
+    web_port = int(sys.argv[1]) if len(sys.argv) > 1 else config_data.get('ports', {}).get('user1', 5000)
     try:
-        print("Initializing MQTT...")
-        init_mqtt()
-        print("Starting Flask-SocketIO server...")
-        socketio.run(app, debug=False, port=5000, host='0.0.0.0')
+        if config_data.get('runtime') == 'asyncio':
+            print("Starting asyncio runtime...")
+            asyncio.run(run_async(web_port))
+        else:
+            # Components and the broker connection start in the background; /ready reports when they are up
+            startup.run(start_services, web_port)
+            print("Starting Flask-SocketIO server...")
+            socketio.run(app, debug=False, port=web_port, host='0.0.0.0')
     except Exception as e:
         print(f"Error starting server: {e}")
     finally:
@@ -1,192 +1,552 @@
-from flask import Flask, render_template
-from flask_socketio import SocketIO
-from utils.encryption import EncryptionManager
+from flask import Flask, jsonify
+from flask_socketio import SocketIO, emit
+from utils.change import ChangeFilter
+from utils.cluster import Cluster
+from utils.connection import ConnectionManager
+from utils.emitter import EmitAggregator
+from utils.metrics import MetricsRegistry
+from utils.payload import KIND_TEMPERATURE, decode_envelope, decode_reading, is_envelope
+from utils.pipeline import MessagePipeline
+from utils.settings import ConfigStore
+from utils.startup import Startup
+from utils.state import StateCache
+from utils.timeseries import TimeSeriesStore
+from utils.topics import load_topics, matches, parse_sensor_topic, sensor_topic, topic_filter
+from utils.web import create_blueprint
+import asyncio
 import json
-import paho.mqtt.client as mqtt
-import threading
+import sys
+import time
+
+# NumPy (utils.rules), cryptography (utils.encryption) and paho are only imported by init_components()
+# and connect_mqtt(), once the web server is already answering; /ready reports when they are done
+startup = Startup()
 
 # Load configuration
-def load_config():
-    with open('config.json', 'r') as f:
+def load_config(path='config.json'):
+    with open(path, 'r') as f:
         return json.load(f)
 
-# Initialize config
-config_data = load_config()
-
-app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")  # Allow all origins
+# Set by create_app()
+config_file = 'config.json'  # create_app()'s config_path, watched for edits when config_reload is enabled
+config_data = None
+app = None
+socketio = None
+emitter = None  # Temperature and cooling events are batched and flushed to browsers at a fixed frame rate
+metrics_settings = {}
+topics = None  # Per-topic QoS and retain flags from mqtt.topics
+temperature_topic = cooling_topic = config_topic = None
+# With cluster.enabled, several Client2 processes share the temperature stream and each room is
+# decided by exactly one of them; None runs a single controller that owns every room
+cluster = None
+settings = None  # Runtime settings, updated from User1 over the config topic or by editing config.json
+state = None  # Latest values sent to dashboards as one snapshot on connect and via /state
+cooling_filter = None
+pipeline = None  # Decrypt/decide/publish runs on a bounded worker pool fed by on_message
 
-# MQTT Settings
-primary_broker = config_data['mqtt']['primary_broker']
-fallback_broker = config_data['mqtt']['fallback_broker']
-port = config_data['mqtt']['port']
-temperature_topic = config_data['mqtt']['topics']['temperature']
-cooling_topic = config_data['mqtt']['topics']['cooling']
-config_topic = config_data['mqtt']['topics']['config']
+# Set by init_components()
+encryption_manager = None
+history = None  # None when history is disabled
+cooling_rules = None
+decision_batcher = None
 
 # Global variables
 mqtt_client = None
-mqtt_thread = None
-temp_threshold = config_data['default_settings']['temp_threshold']  # Default threshold, will be updated from User1
 manual_override = False  # Manual override state
 manual_cooling = False  # Manual cooling state
-last_temperature = None  # Store the last received temperature
-encryption_manager = EncryptionManager()
+last_temperatures = {}  # Last received (sensor id, temperature) per room
+newest_readings = {}  # Client1 timestamp of the newest reading decided per room
+
+# Prometheus-style metrics served at /metrics. Hot paths only increment counters; component stats
+# (connection, pipeline, emitter, history) are read when /metrics is scraped
+metrics = MetricsRegistry()
+mqtt_messages = metrics.counter('mqtt_messages_total', 'MQTT messages by direction and base topic', ('direction', 'topic'))
+errors = metrics.counter('errors_total', 'Errors by where they were caught', ('source',))
+connected_clients = metrics.gauge('socketio_connected_clients', 'Dashboards currently connected')
+connected_clients.set(0)
+suppressed_messages = metrics.counter('mqtt_suppressed_total', 'Messages not published because nothing changed', ('topic',))
+# Client1 reading time to cooling command published, from the timestamp embedded in the reading
+end_to_end_latency = metrics.histogram('end_to_end_latency_seconds', 'Reading published by Client1 to cooling decision published')
+metrics.collector('connection', lambda: mqtt_client.stats() if mqtt_client else None)
+
+# Registered on the app by create_app(); the routes shared with Client1 come from utils.web
+routes = create_blueprint('client2', sys.modules[__name__], 'client2.html')
+
+def create_app(config_path='config.json'):
+    """
+    Application factory: reads the configuration and builds the Flask app, the socket.io server and
+    the in-memory components. Nothing here imports NumPy or cryptography or reads files other than
+    the configuration, so the web server can start straight away; init_components() builds the rest.
+    Returns the Flask app.
+    """
+    global config_file, config_data, app, socketio, emitter, metrics_settings, topics, temperature_topic, cooling_topic, config_topic
+    global cluster, settings, state, cooling_filter, pipeline
+    config_file = config_path
+    config_data = load_config(config_path)
+    app = Flask(__name__)
+    app.register_blueprint(routes)
+    socketio = SocketIO(app, cors_allowed_origins="*")  # Allow all origins
+    socketio.on_event('manual_override', handle_manual_override)
+    socketio.on_event('connect', handle_connect)
+    socketio.on_event('disconnect', handle_disconnect)
+    emitter = EmitAggregator.from_config(socketio, config_data)
+    metrics.collector('emitter', emitter.stats)
+
+    metrics_settings = config_data.get('metrics', {})
+    if metrics_settings.get('enabled', True):
+        emitter.event_counter = metrics.counter('socketio_events_total', 'Events sent to dashboards by event name', ('event',))
+
+    topics = load_topics(config_data)
+    temperature_topic = topics['temperature'].topic
+    cooling_topic = topics['cooling'].topic
+    config_topic = topics['config'].topic
+    cluster = Cluster.from_config(config_data)
+    if cluster:
+        cluster.on_rebalance = on_rebalance
+        metrics.collector('cluster', cluster.stats)
+
+    settings = ConfigStore(config_data['default_settings'], 'user2')
+    state = StateCache(threshold=settings.get('temp_threshold'), override={'manual_override': False, 'manual_cooling': False})
+    # With mqtt.publish.on_change, a room's cooling command is only published when it changes (or on heartbeat)
+    cooling_filter = ChangeFilter.from_config(config_data)
+
+    pipeline_settings = config_data.get('pipeline', {})
+    pipeline = MessagePipeline(
+        process_message,
+        workers=pipeline_settings.get('workers', 4),
+        max_queue=pipeline_settings.get('max_queue', 10000),
+        policy=pipeline_settings.get('policy', 'drop_oldest'),
+        key=message_partition
+    )
+    metrics.collector('pipeline', pipeline.stats)
+    startup.mark('app')
+    return app
+
+def init_components():
+    """
+    Builds the components with slow imports or disk I/O: the encryption manager (key files),
+    history (SQLite), the cooling rules (NumPy) and the decision batcher. Called once after
+    create_app(), by start_services() or run_async().
+    """
+    global encryption_manager, history, cooling_rules, decision_batcher
+    from utils.encryption import EncryptionManager
+    encryption_manager = EncryptionManager.from_config(config_data)
+    if metrics_settings.get('enabled', True):
+        encryption_manager.timings = metrics.histogram('encryption_seconds', 'Encrypt and decrypt latency per message', ('operation',))
+    startup.mark('encryption')
+
+    history = TimeSeriesStore.from_config(config_data, 'user2')
+    if history:
+        metrics.collector('history', lambda: {'written': history.written})
+    startup.mark('storage')
+
+    # Cooling rules (threshold, hysteresis, schedules, rate-of-change, moving average) compiled from config.json
+    from utils.rules import CoolingRules, DecisionBatcher
+    cooling_rules = CoolingRules.from_config(config_data)
+    # With rules.decision_interval set, readings are decided together once per interval instead of one
+    # at a time, trading up to one interval of latency for a single vectorized evaluation per tick
+    rules_settings = config_data.get('rules', {})
+    decision_batcher = (DecisionBatcher(decide_cooling, rules_settings['decision_interval'])
+                        if rules_settings.get('decision_interval') else None)
+    startup.mark('rules')
+    settings.subscribe(on_config_change)
+
+def on_config_change(snapshot, changed, source):
+    """
+    The one path every settings change takes: recompile the cooling rules, update dashboards, and
+    broadcast changes made here (config.json edits) to Client1.
+    """
+    if 'temp_threshold' in changed:
+        threshold = float(snapshot['temp_threshold'])
+        cooling_rules.configure(threshold=threshold)
+        print(f"Temperature threshold updated: {threshold}°C (version {settings.version})")
+        state.set('threshold', threshold)
+        emitter.emit_now('threshold_update', {'threshold': threshold})
+    if source != 'mqtt' and mqtt_client:
+        mqtt_client.publish(config_topic, encryption_manager.encrypt(settings.message()), topics['config'].qos, topics['config'].retain)
+        mqtt_messages.inc('published', 'config')
+
+# Hot reload of default_settings when config.json is edited
+def watch_config():
+    reload_settings = config_data.get('config_reload', {})
+    if reload_settings.get('enabled', False):
+        settings.watch(config_file, reload_settings.get('interval', 2.0))
+
+# Cooling commands go to <cooling topic>/<room>; readings without a room use the base topic
+def room_cooling_topic(room):
+    return f"{cooling_topic}/{room}" if room else cooling_topic
 
 # MQTT callbacks
 def on_connect(client, userdata, flags, rc, properties=None):
     print(f"Connected with result code {rc}")
-    client.subscribe([(temperature_topic, 0), (config_topic, 0), (cooling_topic, 0)])
-    socketio.emit('mqtt_status', {'status': 'connected'})
+    startup.mark('mqtt_connected')
+    if cluster:
+        # The broker hands each reading to one node of the group; cooling commands and config
+        # still go to every node so each dashboard sees all of them
+        client.subscribe([(cluster.shared(topic_filter(temperature_topic)), topics['temperature'].qos),
+                          (config_topic, topics['config'].qos), (topic_filter(cooling_topic), topics['cooling'].qos),
+                          (cluster.members_filter, 0), (cluster.inbox_filter, topics['temperature'].qos),
+                          (cluster.override_topic, 1)])
+        cluster.send_heartbeat()
+    else:
+        # A retained config message, if any, arrives straight away with the latest settings
+        client.subscribe([(topic_filter(temperature_topic), topics['temperature'].qos), (config_topic, topics['config'].qos),
+                          (topic_filter(cooling_topic), topics['cooling'].qos)])
+    emitter.emit_now('mqtt_status', {'status': 'connected'})
 
-# Callback for incoming messages
+# Callback for incoming messages: only hand the raw message to the processing pipeline
+# so decryption and publishing never stall the MQTT network loop
 def on_message(client, userdata, msg):
-    global temp_threshold, last_temperature
+    pipeline.submit(msg.topic, msg.payload)
+
+def message_partition(topic):
+    """
+    Pipeline partition of a topic: temperature readings, sent or forwarded, are partitioned by
+    room, so one worker at a time decides a room whichever of its sensors the readings came from.
+    """
+    original = cluster.forwarded_topic(topic) if cluster else None
+    if original is not None:
+        topic = original
+    if matches(temperature_topic, topic):
+        return ('temperature', parse_sensor_topic(temperature_topic, topic)[0])
+    return topic
+
+def handle_temperatures(room, readings, topic):
+    """
+    Records, emits and decides cooling for one room's readings, given as (sensor id, temperature,
+    Client1 timestamp or None) from a text payload or a binary envelope.
+    """
+    now = time.time()
+    live = []
+    for reading in readings:
+        sensor_id, temperature, sent_at = reading
+        if history:
+            history.record(f"temperature/{room}/{sensor_id}", sent_at or now, temperature)
+        # Readings older than one already decided for the room (replayed from Client1's outbox
+        # after an outage) only go to history, so they can't switch cooling back to a past state.
+        # The pipeline partitions by room, so no other worker updates the room meanwhile
+        if sent_at is not None:
+            if sent_at < newest_readings.get(room, 0):
+                continue
+            newest_readings[room] = sent_at
+        live.append(reading)
+    readings = live
+
+    for sensor_id, temperature, sent_at in readings:
+        last_temperatures[room] = (sensor_id, temperature)
+
+        # Emit temperature to all connected clients
+        state.set_room('temperature', room, {'data': temperature, 'room': room, 'sensor': sensor_id})
+        key = sensor_topic(temperature_topic, room, sensor_id) if sensor_id and room else topic
+        emitter.emit('temperature', {'data': temperature, 'room': room}, key=key)
+
+    # Only control cooling if manual override is not enabled
+    if readings and not manual_override:
+        reading_times = [sent_at if sent_at is not None else now for _, _, sent_at in readings]
+        if decision_batcher:
+            for (sensor_id, temperature, sent_at), reading_time in zip(readings, reading_times):
+                decision_batcher.submit(room, temperature, reading_time, sent_at, sensor_id)
+        else:
+            # An envelope's readings are decided together in one rules evaluation
+            decide_cooling([room] * len(readings), [temperature for _, temperature, _ in readings],
+                           reading_times, [sent_at for _, _, sent_at in readings], [sensor_id for sensor_id, _, _ in readings])
+
+# Runs on a pipeline worker thread
+def process_message(topic, payload):
     try:
-        if msg.topic == temperature_topic:
-            # Decrypt temperature message
-            decrypted_temp = encryption_manager.decrypt(msg.payload)
-            temperature = float(decrypted_temp)
-            last_temperature = temperature
-            print(f"Received temperature: {temperature}°C")
-            
-            # Emit temperature to all connected clients
-            socketio.emit('temperature', {'data': temperature})
-            
-            # Only control cooling if manual override is not enabled
-            if not manual_override:
-                # Generate cooling command based on temperature and current threshold
-                if temperature > temp_threshold:
-                    cooling_command = "ON"
-                else:
-                    cooling_command = "OFF"
-                
-                # Encrypt and publish cooling command    
-                encrypted_command = encryption_manager.encrypt(cooling_command)
-                mqtt_client.publish(cooling_topic, encrypted_command)
-                print(f"Generated cooling command: {cooling_command} (current threshold: {temp_threshold}°C)")
-                socketio.emit('cooling_command', {'data': cooling_command})
-            
-        elif msg.topic == cooling_topic:
+        forwarded = False
+        if cluster:
+            node = cluster.member_of(topic)
+            if node is not None:
+                # Heartbeats carry the node's own name, encrypted; an empty payload means it left
+                if not payload:
+                    cluster.on_heartbeat(node, False)
+                elif encryption_manager.decrypt(payload) == node:
+                    cluster.on_heartbeat(node, True)
+                return
+            original = cluster.forwarded_topic(topic)
+            if original is not None:
+                topic, forwarded = original, True
+        if not payload:
+            return  # A cleared retained message
+
+        if matches(temperature_topic, topic):
+            room, sensor_id = parse_sensor_topic(temperature_topic, topic)
+            if cluster and not forwarded and not cluster.owns(room):
+                # Hand the reading, still encrypted, to the room's owner before spending time on it
+                mqtt_client.publish(cluster.forward_topic(cluster.owner(room), topic), payload, topics['temperature'].qos)
+                cluster.forwarded += 1
+                mqtt_messages.inc('published', 'forward')
+                return
+            # Decrypt temperature message: a binary envelope of readings or a single text reading
+            plaintext = encryption_manager.decrypt_bytes(payload)
+            mqtt_messages.inc('received', 'temperature')
+            if is_envelope(plaintext):
+                readings = [(record.sensor_id, record.value, record.timestamp)
+                            for record in decode_envelope(plaintext) if record.kind == KIND_TEMPERATURE]
+            else:
+                decrypted_temp, sent_at = decode_reading(plaintext.decode())
+                readings = [(sensor_id, float(decrypted_temp), sent_at)]
+            handle_temperatures(room, readings, topic)
+
+        elif matches(cooling_topic, topic):
             # Decrypt and handle cooling command
-            decrypted_message = encryption_manager.decrypt(msg.payload)
-            print(f"Received cooling command: {decrypted_message}")
-            socketio.emit('cooling_command', {'data': decrypted_message})
+            decrypted_message = encryption_manager.decrypt(payload)
+            room, _ = parse_sensor_topic(cooling_topic, topic)
+            mqtt_messages.inc('received', 'cooling')
+            state.set_room('cooling_command', room, {'data': decrypted_message, 'room': room})
+            emitter.emit('cooling_command', {'data': decrypted_message, 'room': room}, key=topic)
             
-        elif msg.topic == config_topic:
-            # Decrypt and handle configuration updates
-            decrypted_config = encryption_manager.decrypt(msg.payload)
-            config_data = json.loads(decrypted_config)
-            if 'temp_threshold' in config_data:
-                old_threshold = temp_threshold
-                temp_threshold = float(config_data['temp_threshold'])
-                print(f"Temperature threshold updated: {old_threshold}°C -> {temp_threshold}°C")
-                socketio.emit('threshold_update', {'threshold': temp_threshold})
-                print(f"Emitted threshold update to connected clients")
+        elif topic == config_topic:
+            # Decrypt and apply versioned configuration updates; stale ones are ignored
+            decrypted_config = encryption_manager.decrypt(payload)
+            mqtt_messages.inc('received', 'config')
+            if not settings.apply_remote(decrypted_config):
+                print(f"Configuration update ignored: stale or unchanged (at version {settings.version})")
+
+        elif cluster and topic == cluster.override_topic:
+            # Manual override set on another node's dashboard applies to the whole cluster
+            override = json.loads(encryption_manager.decrypt(payload))
+            if override['node'] != cluster.node_id:
+                set_manual_override(override['enabled'], override['cooling'], publish_manual=False)
 
     # Handle errors in message processing
     except ValueError as e:
+        errors.inc('process_message')
         print(f"Error processing message: {e}")
     except json.JSONDecodeError as e:
+        errors.inc('process_message')
         print(f"Error decoding JSON message: {e}")
     except Exception as e:
+        errors.inc('process_message')
         print(f"Unexpected error: {e}")
 
+def decide_cooling(rooms, temperatures, timestamps, sent_ats, sensors=None):
+    """
+    Evaluates the cooling rules for a batch of readings and publishes one command per reading, or
+    with publish-on-change only the commands that differ from what the room was last sent.
+    sent_ats holds Client1's reading timestamps (or None) for end-to-end latency, and sensors the
+    sensor ids the per-sensor rate of change and moving average are kept for.
+    """
+    decisions = cooling_rules.evaluate(rooms, temperatures, timestamps, sensors)
+    outgoing = []  # (room, command) actually published
+    for room, on in zip(rooms, decisions):
+        cooling_command = "ON" if on else "OFF"
+        if cooling_filter is None or cooling_filter.check(room, cooling_command):
+            outgoing.append((room, cooling_command))
+        else:
+            suppressed_messages.inc('cooling')
+    # A suppressed command is still a decision, so latency covers every reading
+    now = time.time()
+    for sent_at in sent_ats:
+        if sent_at is not None:
+            end_to_end_latency.observe(max(0.0, now - sent_at))
+
+    encrypted_commands = encryption_manager.encrypt_many([command for _, command in outgoing])
+    for (room, cooling_command), encrypted_command in zip(outgoing, encrypted_commands):
+        mqtt_client.publish(room_cooling_topic(room), encrypted_command, topics['cooling'].qos, topics['cooling'].retain)
+        mqtt_messages.inc('published', 'cooling')
+        if history:
+            history.record(f"cooling/{room}", now, 1.0 if cooling_command == "ON" else 0.0, cooling_command)
+        state.set_room('cooling_command', room, {'data': cooling_command, 'room': room})
+        emitter.emit('cooling_command', {'data': cooling_command, 'room': room}, key=room_cooling_topic(room))
+
 # MQTT client setup
 def connect_mqtt():
+    """
+    Builds the connection manager for the primary/fallback brokers in config.json.
+    The broker connection itself is made by start() (threaded) or AsyncMQTTHelper (asyncio),
+    with health checks, backoff, failback and offline publish buffering.
+    """
+    import paho.mqtt.client as mqtt
     print("Setting up MQTT client...")
-    mqtt_client = mqtt.Client(protocol=mqtt.MQTTv5)  # Use MQTT v5 protocol
-    
-    # Try primary broker first
-    try:
-        print(f"Attempting to connect to primary broker at {primary_broker}:{port}")
-        mqtt_client.username_pw_set("102779797", "102779797")
-        mqtt_client.on_connect = on_connect
-        mqtt_client.on_message = on_message
-        mqtt_client.connect(primary_broker, port, 60)
-        return mqtt_client
-    except Exception as e:
-        print(f"Failed to connect to primary broker: {e}")
-        
-        # Try fallback broker
-        try:
-            print(f"Attempting to connect to fallback broker at {fallback_broker}:{port}")
-            mqtt_client = mqtt.Client(protocol=mqtt.MQTTv5)  # Create new client instance with MQTT v5
-            mqtt_client.on_connect = on_connect
-            mqtt_client.on_message = on_message
-            mqtt_client.connect(fallback_broker, port, 60)
-            return mqtt_client
-        except Exception as e:
-            print(f"Failed to connect to fallback broker: {e}")
-            raise
-
-# Initialize MQTT client and start loop in a separate thread
-def init_mqtt():
-    global mqtt_client, mqtt_thread
+    connection = ConnectionManager.from_config(config_data, lambda: mqtt.Client(protocol=mqtt.MQTTv5))
+    connection.on_connect = on_connect
+    connection.on_message = on_message
+    if cluster:
+        # The broker clears this node's heartbeat if it disappears without leaving
+        connection.client.will_set(cluster.member_topic(), b'', retain=True)
+    return connection
+
+def send_cluster_message(topic, text):
+    if mqtt_client and mqtt_client.is_connected():
+        mqtt_client.publish(topic, encryption_manager.encrypt(text) if text else b'', 1, retain=True)
+
+def on_rebalance(members):
+    # Rooms moved between nodes: send every owned room its command again on the next reading,
+    # since the node that owned it before may have sent something else
+    if cooling_filter:
+        cooling_filter.forget()
+
+# Threaded runtime: runs on the startup thread while Flask-SocketIO is already serving
+def start_services():
+    global mqtt_client
     
     if mqtt_client is not None:
         return  # Already initialized
-        
-    try:
-        mqtt_client = connect_mqtt()
-        
-        # Start MQTT loop in a separate thread
-        mqtt_thread = threading.Thread(target=mqtt_client.loop_forever)
-        mqtt_thread.daemon = True
-        mqtt_thread.start()
-        
-    except Exception as e:
-        print(f"Error initializing MQTT: {e}")
-        mqtt_client = None
+
+    init_components()
+    mqtt_client = connect_mqtt()
+    emitter.start()
+    watch_config()
+    if history:
+        history.start()
+    if decision_batcher:
+        decision_batcher.start()
+    pipeline.start()
+    if cluster:
+        cluster.start(send_cluster_message)
+
+    # Connect and run the MQTT loop on the connection manager's thread
+    mqtt_client.start()
 
 def cleanup():
-    global mqtt_client, mqtt_thread
+    global mqtt_client
+    # Let a startup still in progress finish, so nothing it starts is left running
+    startup.wait(10)
+    if cluster:
+        cluster.stop()
+    if pipeline:
+        pipeline.stop()
+    if decision_batcher:
+        decision_batcher.stop()
+    if settings:
+        settings.stop()
+    if emitter:
+        emitter.stop()
+    if history:
+        history.stop()
     if mqtt_client:
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
+        mqtt_client.stop()
         mqtt_client = None
 
-@app.route('/')
-def index():
-    return render_template('client2.html')
+@routes.route('/pipeline')
+def pipeline_stats():
+    return jsonify(pipeline.stats())
 
-@socketio.on('manual_override')
-def handle_manual_override(data):
-    global manual_override, manual_cooling, last_temperature
+@routes.route('/cluster')
+def cluster_stats():
+    if cluster is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, 'members': list(cluster.members), **cluster.stats()})
+
+def set_manual_override(enabled, cooling=False, publish_manual=True):
+    """
+    Switches between manual and automatic control. In a cluster, only the node whose dashboard
+    was used publishes the manual command, and on release each node re-sends its own rooms.
+    """
+    global manual_override, manual_cooling
     try:
-        manual_override = data['enabled']
+        manual_override = enabled
         if manual_override:
-            manual_cooling = data.get('cooling', False)
+            manual_cooling = cooling
             cooling_command = "ON" if manual_cooling else "OFF"
-            # Encrypt and publish cooling command
-            encrypted_command = encryption_manager.encrypt(cooling_command)
-            mqtt_client.publish(cooling_topic, encrypted_command)
+            if publish_manual:
+                # Encrypt and publish cooling command
+                encrypted_command = encryption_manager.encrypt(cooling_command)
+                mqtt_client.publish(cooling_topic, encrypted_command, topics['cooling'].qos, topics['cooling'].retain)
+                mqtt_messages.inc('published', 'cooling')
             print(f"Manual override: Cooling set to {cooling_command}")
         else:
-            # Return to automatic control based on last temperature
-            if last_temperature is not None:
-                if last_temperature > temp_threshold:
-                    cooling_command = "ON"
-                else:
-                    cooling_command = "OFF"
+            # Return to automatic control based on the last temperature of each room; every room is
+            # sent its command, since the manual one replaced whatever it had before
+            if cooling_filter:
+                cooling_filter.forget()
+            if topics['cooling'].retain:
+                # Clear the retained manual command so late subscribers only get the rooms' own commands
+                mqtt_client.publish(cooling_topic, b'', topics['cooling'].qos, True)
+            rooms = [room for room in last_temperatures if cluster is None or cluster.owns(room)]
+            last = [last_temperatures[room] for room in rooms]
+            decisions = cooling_rules.evaluate(rooms, [temperature for _, temperature in last], [time.time()] * len(rooms),
+                                               [sensor_id for sensor_id, _ in last])
+            for room, on in zip(rooms, decisions):
+                cooling_command = "ON" if on else "OFF"
                 # Encrypt and publish cooling command
                 encrypted_command = encryption_manager.encrypt(cooling_command)
-                mqtt_client.publish(cooling_topic, encrypted_command)
-                print(f"Manual override disabled: Returning to automatic control")
+                mqtt_client.publish(room_cooling_topic(room), encrypted_command, topics['cooling'].qos, topics['cooling'].retain)
+                mqtt_messages.inc('published', 'cooling')
+                if cooling_filter:
+                    cooling_filter.mark(room, cooling_command)
+            print(f"Manual override disabled: Returning to automatic control")
         
-        socketio.emit('override_status', {
+        state.set('override', {'manual_override': manual_override, 'manual_cooling': manual_cooling})
+        emitter.emit_now('override_status', {
             'manual_override': manual_override,
             'manual_cooling': manual_cooling
         })
     except Exception as e:
+        errors.inc('manual_override')
+        print(f"Error in manual override: {e}")
+
+# socket.io handlers, registered by create_app()
+def handle_manual_override(data):
+    try:
+        set_manual_override(data['enabled'], data.get('cooling', False))
+        if cluster:
+            # Retained, so a node that joins later starts in the same mode
+            override = {'node': cluster.node_id, 'enabled': manual_override, 'cooling': manual_cooling}
+            send_cluster_message(cluster.override_topic, json.dumps(override))
+    except Exception as e:
+        errors.inc('manual_override')
         print(f"Error in manual override: {e}")
 
+def handle_connect():
+    # Send the latest state straight away instead of waiting for the next MQTT message
+    connected_clients.inc()
+    emit('snapshot', state.snapshot())
+
+def handle_disconnect(*args):
+    connected_clients.dec()
+
+async def run_async(port):
+    """
+    asyncio runtime: the MQTT socket and socket.io fan-out share one event loop.
+    With pipeline.workers set to 0, messages are also processed on the loop, so globals such as
+    manual_override are only ever touched from one thread.
+    The server starts listening straight away; the components are built on an executor thread
+    meanwhile, and the MQTT connection and pipeline start once they are ready.
+    """
+    from utils import aio
+    mqtt_io = None
+
+    def start(loop, tasks):
+        global mqtt_client
+        nonlocal mqtt_io
+        if decision_batcher:
+            tasks.append(loop.create_task(decision_batcher.run_async()))
+        if cluster:
+            tasks.append(loop.create_task(cluster.run_async(send_cluster_message)))
+        mqtt_client = connect_mqtt()
+        mqtt_io = aio.AsyncMQTTHelper(mqtt_client, loop)
+        mqtt_io.start()
+        pipeline.start()
+        if history:
+            history.start()
+        watch_config()
+
+    def stop():
+        if cluster:
+            cluster.stop()
+        if mqtt_io:
+            mqtt_io.stop()
+        if decision_batcher:
+            decision_batcher.stop()
+
+    await aio.run_client(sys.modules[__name__], port, start, stop, {'manual_override': handle_manual_override})
+
 if __name__ == '__main__':
+    create_app()
+    # Cluster nodes on one host each need their own port: python Client2_web.py 5002
+    web_port = int(sys.argv[1]) if len(sys.argv) > 1 else config_data.get('ports', {}).get('user2', 5001)
     try:
-        print("Initializing MQTT...")
-        init_mqtt()
-        print("Starting Flask-SocketIO server...")
-        socketio.run(app, debug=False, port=5001, host='0.0.0.0')  # Set debug=False to prevent reloading
+        if config_data.get('runtime') == 'asyncio':
+            print("Starting asyncio runtime...")
+            asyncio.run(run_async(web_port))
+        else:
+            # Components and the broker connection start in the background; /ready reports when they are up
+            startup.run(start_services, web_port)
+            print("Starting Flask-SocketIO server...")
+            socketio.run(app, debug=False, port=web_port, host='0.0.0.0')  # Set debug=False to prevent reloading
     except Exception as e:
         print(f"Error starting server: {e}")
     finally:
@@ -0,0 +1,69 @@
+"""
+Payload format benchmark: text readings (one per message) versus binary envelopes.
+
+Usage:
+    python -m benchmarks.payload_bench [--readings 20000] [--batch 1,10,100,500] [--mode fernet]
+
+For each format it reports encrypted bytes per reading on the wire (MQTT topic and headers
+excluded), and readings/second to encode+encrypt and to decrypt+parse, as the clients do.
+Keys are generated in a temporary directory so the repository's encryption.key is never touched.
+"""
+from utils.encryption import EncryptionManager, MODES
+from utils.payload import KIND_TEMPERATURE, Record, decode_envelope, decode_reading, encode_envelope, encode_reading
+import argparse
+import random
+import tempfile
+import time
+
+def rate(count, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    return (count / elapsed if elapsed else float('inf')), result
+
+def bench_text(manager, records):
+    n = len(records)
+    encode_rate, tokens = rate(n, lambda: manager.encrypt_many(
+        [encode_reading(record.value, record.timestamp) for record in records]))
+
+    def parse():
+        return [float(decode_reading(manager.decrypt(token))[0]) for token in tokens]
+    parse_rate, _ = rate(n, parse)
+    return sum(len(t) for t in tokens) / n, encode_rate, parse_rate
+
+def bench_binary(manager, records, batch):
+    n = len(records)
+    chunks = [records[i:i + batch] for i in range(0, n, batch)]
+    encode_rate, tokens = rate(n, lambda: manager.encrypt_many([encode_envelope(chunk) for chunk in chunks]))
+
+    def parse():
+        return [record.value for token in tokens for record in decode_envelope(manager.decrypt_bytes(token))]
+    parse_rate, _ = rate(n, parse)
+    return sum(len(t) for t in tokens) / n, encode_rate, parse_rate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, default=20000)
+    parser.add_argument('--batch', default="1,10,100,500", help="comma-separated envelope sizes to try")
+    parser.add_argument('--mode', choices=MODES, default='fernet')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = time.time()
+    records = [
+        Record(f"temp-{i % 100 + 1}", KIND_TEMPERATURE, round(rng.uniform(20, 30), 2), now + i * 0.001, 0)
+        for i in range(args.readings)
+    ]
+    print(f"{args.readings} temperature readings, {args.mode}")
+    print(f"{'format':<16}{'bytes/reading':>16}{'encode/s':>16}{'parse/s':>16}")
+    with tempfile.TemporaryDirectory() as key_dir:
+        manager = EncryptionManager(mode=args.mode, key_dir=key_dir)
+        size, encode_rate, parse_rate = bench_text(manager, records)
+        print(f"{'text':<16}{size:>16.1f}{encode_rate:>16,.0f}{parse_rate:>16,.0f}")
+        for batch in (int(b) for b in args.batch.split(',')):
+            size, encode_rate, parse_rate = bench_binary(manager, records, batch)
+            print(f"{f'binary x{batch}':<16}{size:>16.1f}{encode_rate:>16,.0f}{parse_rate:>16,.0f}")
+
+if __name__ == '__main__':
+    main()
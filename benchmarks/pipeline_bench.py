@@ -0,0 +1,396 @@
+"""
+End-to-end load benchmark: Client1 -> broker -> Client2 -> cooling decision, in one process.
+
+Usage:
+    python -m benchmarks.pipeline_bench [--rate 5000] [--duration 10] [--rooms 10]
+        [--sensors-per-room 10] [--listeners 50] [--size 5] [--mode fernet] [--workers 4]
+        [--output result.json] [--compare baseline.json]
+
+Both clients are imported and wired to LocalBroker, an in-process stand-in for the MQTT broker,
+so readings go through the real publish_readings, on_message / process_message handlers,
+MessagePipeline and EncryptionManager. socket.io is replaced by a fan-out that serializes each
+emit for N simulated listeners. Latency is Client2's end-to-end measurement (reading produced in
+Client1 to cooling command published), so it includes broker queueing.
+
+Runs are seeded and reported with their parameters, including the config.json settings that
+change the result (BENCH_SETTINGS); --output saves the result as JSON and --compare prints the
+change against a saved result, so regressions show up between commits. The clients are built from
+a copy of config.json whose keys, history databases and outbox live in a temporary directory.
+"""
+from collections import namedtuple
+from utils.encryption import MODES
+from utils.pipeline import MessagePipeline
+from utils.publisher import Reading, Sensor
+from utils.rules import DecisionBatcher
+from utils.topics import sensor_topic
+import argparse
+import json
+import os
+import platform
+import queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+Message = namedtuple('Message', ['topic', 'payload'])
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# config.json sections the result depends on, recorded in params so --compare notices when they change
+BENCH_SETTINGS = (('mqtt', 'publish'), ('rules',), ('socketio',), ('encryption',), ('metrics',))
+
+# Headline numbers compared by --compare, and whether a higher value is better
+COMPARED = {
+    'throughput': True,
+    'latency_p50_ms': False,
+    'latency_p99_ms': False,
+    'cpu_percent': False,
+    'rss_mb': False,
+    'dropped': False,
+    'broker_messages': False,
+}
+
+def filter_matches(topic_filter, topic):
+    if topic_filter.startswith('$share/'):
+        # One subscriber per group here, so a shared subscription behaves like a plain one
+        topic_filter = topic_filter.split('/', 2)[2]
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+class LocalBroker:
+    """Routes publishes to subscribed LocalClients by topic filter, like a broker on localhost."""
+    def __init__(self):
+        self.clients = []
+        self.routed = 0
+
+    def route(self, topic, payload):
+        message = Message(topic, payload)
+        for client in self.clients:
+            if client.subscribed(topic):
+                client.inbox.put(message)
+                self.routed += 1
+
+# What LocalClient.publish() returns: the MQTTMessageInfo fields callers check
+PUBLISHED = namedtuple('MessageInfo', 'rc mid')(0, 0)
+
+class LocalClient:
+    """
+    Stands in for a ConnectionManager: publish() goes to the LocalBroker, and incoming messages
+    are delivered to on_message from the client's own thread, as paho's network loop would.
+    """
+    def __init__(self, broker, on_message):
+        self.broker = broker
+        self.on_message = on_message
+        self.filters = []
+        self.inbox = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        broker.clients.append(self)
+
+    def subscribed(self, topic):
+        return any(filter_matches(f, topic) for f in self.filters)
+
+    def subscribe(self, topic, qos=0, **kwargs):
+        topics = topic if isinstance(topic, list) else [(topic, qos)]
+        self.filters.extend(t for t, _ in topics)
+
+    def publish(self, topic, payload=None, qos=0, retain=False, buffer=True):
+        self.broker.route(topic, payload)
+        return PUBLISHED
+
+    def is_connected(self):
+        return True
+
+    def stats(self):
+        return {'connected': True, 'inbox': self.inbox.qsize()}
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.inbox.put(None)
+        self._thread.join(2)
+
+    def _loop(self):
+        while True:
+            message = self.inbox.get()
+            if message is None:
+                return
+            self.on_message(self, None, message)
+
+class ListenerFanout:
+    """
+    Replaces Flask-SocketIO for an EmitAggregator: each emit is serialized once and 'sent' to every
+    simulated listener, which is where per-dashboard cost comes from in the real server.
+    """
+    def __init__(self, listeners):
+        self.listeners = listeners
+        self.emits = 0
+        self.bytes_sent = 0
+
+    def emit(self, event, data=None, to=None):
+        packet = json.dumps([event, data])
+        self.emits += 1
+        for _ in range(self.listeners):
+            self.bytes_sent += len(packet)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def start_background_task(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+class LatencyRecorder:
+    """Takes the place of Client2's end_to_end_latency histogram and keeps every sample."""
+    def __init__(self):
+        self.samples = []
+
+    def observe(self, value, *labels, count=1):
+        self.samples.append(value)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def cpu_seconds():
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return None
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if platform.system() == 'Darwin' else peak / 2 ** 10
+
+def build_sensors(base_topic, rooms, per_room):
+    return [
+        Sensor(f"temp-{n + 1}", f"bench-room-{r + 1}", 'temperature', 1.0,
+               sensor_topic(base_topic, f"bench-room-{r + 1}", f"temp-{n + 1}"))
+        for r in range(rooms)
+        for n in range(per_room)
+    ]
+
+def reading_value(rng, size):
+    # Zero-padded decimals make the plaintext 'size' characters long while still parsing as a float
+    value = f"{rng.uniform(20, 30):.2f}"
+    return value.ljust(size, '0') if size > len(value) else float(value)
+
+def drive(client1, sensors, args, rng):
+    """Offers readings at args.rate per second (0 = as fast as possible) for args.duration seconds."""
+    tick = 0.01
+    per_tick = args.rate * tick
+    owed = 0.0
+    offered = 0
+    cursor = 0
+    start = time.monotonic()
+    next_tick = start
+    while time.monotonic() - start < args.duration:
+        count = args.batch if not args.rate else int(owed + per_tick)
+        owed = owed + per_tick - count if args.rate else 0.0
+        batch = []
+        now = time.time()
+        for _ in range(count):
+            sensor = sensors[cursor]
+            cursor = (cursor + 1) % len(sensors)
+            batch.append(Reading(sensor, reading_value(rng, args.size), now))
+        for i in range(0, len(batch), args.batch):
+            client1.publish_readings(batch[i:i + args.batch])
+        offered += count
+        if args.rate:
+            next_tick += tick
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+    return offered, time.monotonic() - start
+
+def wait_drained(clients, pipeline, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(c.inbox.empty() for c in clients) and pipeline.stats()['depth'] == 0:
+            return True
+        time.sleep(0.01)
+    return False
+
+def prepare(work_dir, args):
+    """Writes the benchmark's copy of config.json to work_dir and returns it."""
+    with open(os.path.join(ROOT, 'config.json')) as f:
+        config = json.load(f)
+    config['encryption'] = dict(config.get('encryption', {}), mode=args.mode, key_dir=work_dir)
+    history = config.setdefault('history', {})
+    history['enabled'] = args.history
+    history['paths'] = {user: os.path.join(work_dir, f"{user}_history.db") for user in ('user1', 'user2')}
+    config.setdefault('outbox', {})['directory'] = os.path.join(work_dir, 'outbox')
+    config.setdefault('config_reload', {})['enabled'] = False
+    config['mqtt'].setdefault('payload', {})['format'] = args.format
+    with open(os.path.join(work_dir, 'config.json'), 'w') as f:
+        json.dump(config, f, indent=4)
+    return config
+
+def bench_settings(config):
+    settings = {}
+    for path in BENCH_SETTINGS:
+        value = config
+        for key in path:
+            value = value.get(key, {}) if isinstance(value, dict) else {}
+        if path == ('encryption',):
+            value = {key: v for key, v in value.items() if key != 'key_dir'}
+        settings['.'.join(path)] = value
+    return settings
+
+def run(args):
+    import Client1_web as client1
+    import Client2_web as client2
+    work_dir = tempfile.mkdtemp(prefix='pipeline-bench-')
+    config = prepare(work_dir, args)
+    for client in (client1, client2):
+        client.create_app(os.path.join(work_dir, 'config.json'))
+        client.init_components()
+        client.emitter.socketio = ListenerFanout(args.listeners)
+
+    rng = random.Random(args.seed)
+    broker = LocalBroker()
+    latency = client2.end_to_end_latency = LatencyRecorder()
+    client2.pipeline = MessagePipeline(client2.process_message, workers=args.workers,
+                                       max_queue=args.max_queue, policy=args.policy, key=client2.message_partition)
+    client2.decision_batcher = (DecisionBatcher(client2.decide_cooling, args.decision_interval)
+                                if args.decision_interval else None)
+
+    local1 = client1.mqtt_client = LocalClient(broker, client1.on_message)
+    local2 = client2.mqtt_client = LocalClient(broker, client2.on_message)
+    sensors = build_sensors(client1.temperature_topic, args.rooms, args.sensors_per_room)
+
+    client1.on_connect(local1, None, {}, 0)
+    client2.on_connect(local2, None, {}, 0)
+    for client in (client1, client2):
+        client.emitter.start()
+        if client.history:
+            client.history.start()
+    client2.pipeline.start()
+    if client2.decision_batcher:
+        client2.decision_batcher.start()
+    local1.start()
+    local2.start()
+
+    cpu_start = cpu_seconds()
+    start = time.monotonic()
+    offered, driven = drive(client1, sensors, args, rng)
+    drained = wait_drained((local1, local2), client2.pipeline, args.drain_timeout)
+    if client2.decision_batcher:
+        client2.decision_batcher.stop()
+    # Throughput and CPU cover draining the backlog too, so an overloaded run can't look fast
+    elapsed = time.monotonic() - start
+    cpu = cpu_seconds() - cpu_start
+
+    local1.stop()
+    local2.stop()
+    client2.pipeline.stop()
+    for client in (client1, client2):
+        client.emitter.stop()
+        if client.history:
+            client.history.stop()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    samples = sorted(latency.samples)
+    rss = rss_mb()
+    pipeline_stats = client2.pipeline.stats()
+    fanout = [client1.emitter.socketio, client2.emitter.socketio]
+    return {
+        'params': dict({key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+                       config=bench_settings(config)),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'offered': offered,
+        'decisions': len(samples),
+        'dropped': pipeline_stats['dropped'],
+        'drained': drained,
+        'seconds': round(elapsed, 3),
+        'offered_rate': round(offered / driven, 1) if driven else None,
+        'throughput': round(len(samples) / elapsed, 1) if elapsed else None,
+        'latency_p50_ms': round(percentile(samples, 0.50) * 1000, 3) if samples else None,
+        'latency_p99_ms': round(percentile(samples, 0.99) * 1000, 3) if samples else None,
+        'latency_max_ms': round(samples[-1] * 1000, 3) if samples else None,
+        'cpu_percent': round(100 * cpu / elapsed, 1) if elapsed else None,
+        'rss_mb': round(rss, 1) if rss is not None else None,
+        'broker_messages': broker.routed,
+        'suppressed': sum(f.suppressed for f in (client1.temperature_filter, client2.cooling_filter) if f),
+        'socketio_emits': sum(f.emits for f in fanout),
+        'socketio_mb_sent': round(sum(f.bytes_sent for f in fanout) / 2 ** 20, 2),
+    }
+
+def compare(result, baseline):
+    print(f"\n{'vs baseline':<16}{'baseline':>14}{'current':>14}{'change':>10}")
+    for key, higher_is_better in COMPARED.items():
+        old, new = baseline.get(key), result.get(key)
+        if old is None or new is None:
+            continue
+        if not old:
+            change = "n/a" if new else "0.0%"
+            worse = new > 0 and not higher_is_better
+        else:
+            delta = (new - old) / old * 100
+            change = f"{delta:.1f}%"
+            worse = abs(delta) >= 5 and (delta < 0 if higher_is_better else delta > 0)
+        print(f"{key:<16}{old:>14,.2f}{new:>14,.2f}{change:>10}{'  worse' if worse else ''}")
+    if baseline.get('params') != result.get('params'):
+        print("Note: baseline was run with different parameters")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=5000, help="readings offered per second; 0 = as fast as possible")
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--sensors-per-room', type=int, default=10)
+    parser.add_argument('--listeners', type=int, default=50, help="simulated socket.io clients per dashboard")
+    parser.add_argument('--size', type=int, default=5, help="plaintext length of each temperature value")
+    parser.add_argument('--batch', type=int, default=500, help="readings per publish_readings call")
+    parser.add_argument('--mode', choices=MODES, default='fernet')
+    parser.add_argument('--format', choices=('text', 'binary'), default='text', help="payload format (mqtt.payload.format)")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-queue', type=int, default=10000)
+    parser.add_argument('--policy', default='drop_oldest')
+    parser.add_argument('--decision-interval', type=float, default=0,
+                        help="batch cooling decisions every N seconds (rules.decision_interval)")
+    parser.add_argument('--history', action='store_true', help="also record history to SQLite")
+    parser.add_argument('--drain-timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the result as JSON")
+    parser.add_argument('--compare', help="JSON result of an earlier run to compare against")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"{result['offered']:,} readings offered at {result['offered_rate']:,.0f}/s "
+          f"({args.rooms} rooms x {args.sensors_per_room} sensors, {args.listeners} listeners, {args.mode}, {args.format})")
+    for key in ('decisions', 'dropped', 'drained', 'seconds', 'throughput', 'latency_p50_ms', 'latency_p99_ms',
+                'latency_max_ms', 'cpu_percent', 'rss_mb', 'broker_messages', 'suppressed', 'socketio_emits', 'socketio_mb_sent'):
+        print(f"{key:<18}{result[key]}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+if __name__ == '__main__':
+    main()
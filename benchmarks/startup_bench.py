@@ -0,0 +1,208 @@
+"""
+Startup benchmark: how soon a freshly started client serves HTTP, finishes initializing and stops.
+
+Usage:
+    python -m benchmarks.startup_bench [--runs 5] [--clients client1 client2] [--runtime asyncio]
+        [--broker localhost:1883] [--ready-timeout 5] [--output result.json] [--compare baseline.json]
+
+Each run starts Client1_web.py / Client2_web.py as a real process on a free port, in a temporary
+working directory with a copy of config.json (so keys, history databases and the outbox are created
+there, never in the repository), and polls it:
+    import_ms       importing the module in a fresh interpreter, without starting anything
+    http_ms         process start to the first 200 from /
+    initialized_ms  process start to /ready reporting initialized (components built)
+    ready_ms        process start to /ready answering 200 (broker connected); empty when no broker
+                    answered within --ready-timeout
+    shutdown_ms     SIGINT to process exit
+Medians over the runs are reported. --output saves the result as JSON and --compare prints the
+change against a saved result, as with benchmarks.pipeline_bench.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = {'client1': 'Client1_web.py', 'client2': 'Client2_web.py'}
+METRICS = ('import_ms', 'http_ms', 'initialized_ms', 'ready_ms', 'shutdown_ms')
+
+def free_port():
+    # Below the usual ephemeral range, so the client's own outgoing connections can't take it first
+    while True:
+        port = random.randint(20000, 30000)
+        with socket.socket() as s:
+            try:
+                s.bind(('0.0.0.0', port))
+            except OSError:
+                continue
+            return port
+
+def get(port, path):
+    """Returns (status, JSON body or None), or (None, None) while nothing is listening."""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+            status, body = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    except OSError:
+        return None, None
+    try:
+        return status, json.loads(body)
+    except ValueError:
+        return status, None
+
+def import_time(script):
+    code = ("import sys, time; sys.path.insert(0, sys.argv[1]); start = time.perf_counter(); "
+            f"import {script[:-3]}; print(time.perf_counter() - start)")
+    output = subprocess.run([sys.executable, '-c', code, ROOT], capture_output=True, text=True, check=True)
+    return float(output.stdout.split()[-1]) * 1000
+
+def ms(start, end):
+    return round((end - start) * 1000, 1) if end is not None else None
+
+def run_once(script, work_dir, args):
+    port = free_port()
+    log_path = os.path.join(work_dir, f"{script}.log")
+    with open(log_path, 'w') as log:
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, script), str(port)], cwd=work_dir,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    served = initialized = ready = None
+    try:
+        deadline = start + args.timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                with open(log_path) as f:
+                    raise RuntimeError(f"{script} exited with {process.returncode}:\n{f.read()[-2000:]}")
+            now = time.monotonic()
+            if served is None:
+                if get(port, '/')[0] == 200:
+                    served = now
+            else:
+                status, body = get(port, '/ready')
+                if body and body.get('error'):
+                    raise RuntimeError(f"{script} failed to start: {body['error']}")
+                if body and body.get('initialized') and initialized is None:
+                    initialized = now
+                if status == 200:
+                    ready = now
+                    break
+                if initialized is not None and now - initialized > args.ready_timeout:
+                    break
+            time.sleep(0.002)
+    finally:
+        stopping = time.monotonic()
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(args.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        stopped = time.monotonic()
+    return {
+        'http_ms': ms(start, served),
+        'initialized_ms': ms(start, initialized),
+        'ready_ms': ms(start, ready),
+        'shutdown_ms': ms(stopping, stopped),
+    }
+
+def prepare(work_dir, args):
+    with open(os.path.join(ROOT, 'config.json')) as f:
+        config = json.load(f)
+    if args.runtime:
+        config['runtime'] = args.runtime
+    if args.broker:
+        host, _, port = args.broker.partition(':')
+        config['mqtt']['primary_broker'] = host
+        config['mqtt']['fallback_broker'] = None
+        if port:
+            config['mqtt']['port'] = int(port)
+    config.setdefault('config_reload', {})['enabled'] = False
+    config.setdefault('encryption', {})['key_dir'] = work_dir
+    with open(os.path.join(work_dir, 'config.json'), 'w') as f:
+        json.dump(config, f, indent=4)
+    return config
+
+def median(values):
+    values = [value for value in values if value is not None]
+    return round(statistics.median(values), 1) if values else None
+
+def run(args):
+    result = {
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+    }
+    for client in args.clients:
+        script = SCRIPTS[client]
+        samples = {metric: [] for metric in METRICS}
+        for _ in range(args.runs):
+            samples['import_ms'].append(round(import_time(script), 1))
+            work_dir = tempfile.mkdtemp(prefix='startup-bench-')
+            try:
+                prepare(work_dir, args)
+                for metric, value in run_once(script, work_dir, args).items():
+                    samples[metric].append(value)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        for metric in METRICS:
+            result[f"{client}_{metric}"] = median(samples[metric])
+    return result
+
+def compare(result, baseline):
+    print(f"\n{'vs baseline':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for key, new in result.items():
+        old = baseline.get(key)
+        if not isinstance(new, (int, float)) or not isinstance(old, (int, float)):
+            continue
+        if not old:
+            change, worse = "n/a", new > 0
+        else:
+            delta = (new - old) / old * 100
+            change, worse = f"{delta:.1f}%", delta >= 10
+        print(f"{key:<28}{old:>12,.1f}{new:>12,.1f}{change:>10}{'  worse' if worse else ''}")
+    if baseline.get('params') != result.get('params'):
+        print("Note: baseline was run with different parameters")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--clients', nargs='+', choices=sorted(SCRIPTS), default=sorted(SCRIPTS))
+    parser.add_argument('--runtime', choices=('threading', 'asyncio'), help="overrides runtime in config.json")
+    parser.add_argument('--broker', help="host[:port] to use as the only broker instead of the configured ones")
+    parser.add_argument('--ready-timeout', type=float, default=5,
+                        help="seconds to wait for a broker connection once initialized")
+    parser.add_argument('--timeout', type=float, default=30, help="seconds before a run is abandoned")
+    parser.add_argument('--output', help="write the result as JSON")
+    parser.add_argument('--compare', help="JSON result of an earlier run to compare against")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"{args.runs} runs per client, median milliseconds")
+    print(f"{'client':<10}" + "".join(f"{metric:>16}" for metric in METRICS))
+    for client in args.clients:
+        values = [result[f"{client}_{metric}"] for metric in METRICS]
+        print(f"{client:<10}" + "".join(f"{'-' if value is None else f'{value:,.1f}':>16}" for value in values))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import socket
+import threading
+import time
+import unittest
+
+import paho.mqtt.client as mqtt
+
+from utils.connection import ConnectionManager
+
+CONNACK = b'\x20\x02\x00\x00'
+
+def read_packet(sock):
+    """Reads one MQTT packet; returns (packet type, body), or None when the peer closed the socket."""
+    header = sock.recv(1)
+    if not header:
+        return None
+    length, shift = 0, 0
+    while True:
+        byte = sock.recv(1)[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    body = b''
+    while len(body) < length:
+        chunk = sock.recv(length - len(body))
+        if not chunk:
+            return None
+        body += chunk
+    return header[0] >> 4, body
+
+class FakeBroker:
+    """
+    Accepts MQTT connections on a local port. The first client gets a CONNACK and is then dropped;
+    later clients wait for allow_reconnect before their CONNACK and have their PUBLISH topics recorded.
+    Health checks (connections closed without a packet) are ignored.
+    """
+    def __init__(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        self.allow_reconnect = threading.Event()
+        self.published = []
+        self.sessions = 0
+        self._sockets = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            self._sockets.append(sock)
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        try:
+            if read_packet(sock) is None:
+                return
+            self.sessions += 1
+            if self.sessions == 1:
+                sock.sendall(CONNACK)
+                time.sleep(0.1)
+                return
+            self.allow_reconnect.wait(5)
+            sock.sendall(CONNACK)
+            while (packet := read_packet(sock)) is not None:
+                kind, body = packet
+                if kind == 3:  # PUBLISH
+                    self.published.append(body[2:2 + int.from_bytes(body[:2], 'big')].decode())
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    def close(self):
+        self.server.close()
+        for sock in self._sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class ConnectionManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.broker = FakeBroker()
+        self.manager = ConnectionManager(['127.0.0.1'], self.broker.port, mqtt.Client, backoff_initial=0.05)
+
+    def tearDown(self):
+        self.broker.allow_reconnect.set()
+        self.manager.stop()
+        self.broker.close()
+
+    def test_reconnects_after_broker_drops_link(self):
+        self.manager.start()
+        self.assertTrue(wait_for(lambda: self.manager.connects == 1))
+        self.assertTrue(wait_for(lambda: self.manager.disconnects == 1))
+        self.assertFalse(self.manager.is_connected())
+        self.assertFalse(self.manager.stats()['connected'])
+
+        # Dropped and not yet re-acknowledged: publishes go to the offline buffer
+        self.assertIsNone(self.manager.publish('sensors/a', b'1'))
+        self.assertIsNone(self.manager.publish('sensors/b', b'2'))
+        self.assertEqual(self.manager.stats()['buffer_depth'], 2)
+
+        self.broker.allow_reconnect.set()
+        self.assertTrue(wait_for(lambda: self.manager.connects == 2))
+        self.assertTrue(self.manager.is_connected())
+        self.assertTrue(wait_for(lambda: self.broker.published == ['sensors/a', 'sensors/b']))
+        self.assertEqual(self.manager.stats()['buffer_depth'], 0)
+
+        info = self.manager.publish('sensors/c', b'3')
+        self.assertEqual(info.rc, 0)
+        self.assertTrue(wait_for(lambda: self.broker.published[-1:] == ['sensors/c']))
+
+class UnreachableClient(mqtt.Client):
+    """A paho client whose link has dropped before on_disconnect ran: publish() answers MQTT_ERR_NO_CONN."""
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        info = mqtt.MQTTMessageInfo(1)
+        info.rc = mqtt.MQTT_ERR_NO_CONN
+        return info
+
+class PublishWithoutConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = ConnectionManager(['127.0.0.1'], 1883, UnreachableClient)
+        self.manager._on_connect(self.manager.client, None, {}, 0)
+
+    def test_qos0_is_buffered(self):
+        self.assertIsNone(self.manager.publish('sensors/a', b'1'))
+        stats = self.manager.stats()
+        self.assertEqual((stats['buffer_depth'], stats['publish_errors']), (1, 0))
+
+    def test_unbuffered_publish_reports_failure(self):
+        info = self.manager.publish('sensors/a', b'1', buffer=False)
+        self.assertEqual(info.rc, mqtt.MQTT_ERR_NO_CONN)
+        self.assertEqual(self.manager.stats()['buffer_depth'], 0)
+
+    def test_qos1_is_left_to_paho(self):
+        # paho queues QoS 1/2 messages and re-sends them on reconnect, so buffering would duplicate them
+        info = self.manager.publish('sensors/a', b'1', qos=1)
+        self.assertEqual(info.rc, mqtt.MQTT_ERR_NO_CONN)
+        stats = self.manager.stats()
+        self.assertEqual((stats['buffer_depth'], stats['inflight'], stats['publish_errors']), (0, 1, 0))
+
+if __name__ == '__main__':
+    unittest.main()
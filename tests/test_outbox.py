@@ -0,0 +1,128 @@
+import os
+import tempfile
+import unittest
+
+from utils.outbox import RECORD, Outbox, _segment_name
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.directory = self._dir.name
+        self.outboxes = []
+
+    def tearDown(self):
+        for outbox in self.outboxes:
+            outbox.stop()
+        self._dir.cleanup()
+
+    def open(self, **kwargs):
+        outbox = Outbox(self.directory, **kwargs)
+        self.outboxes.append(outbox)
+        return outbox
+
+    def reopen(self, outbox, **kwargs):
+        outbox.stop()
+        self.outboxes.remove(outbox)
+        return self.open(**kwargs)
+
+    def drain_all(self, outbox):
+        sent = []
+        while outbox.drain(lambda topic, payload: sent.append((topic, payload)) or True):
+            pass
+        return sent
+
+    def test_drains_in_order(self):
+        outbox = self.open(segment_size=4096)
+        messages = [(f"temp/room/{i % 3}", f"payload {i}".encode()) for i in range(250)]
+        for topic, payload in messages:
+            outbox.append(topic, payload)
+        self.assertEqual(outbox.pending, 250)
+        self.assertEqual(self.drain_all(outbox), messages)
+        self.assertEqual(outbox.stats()['pending'], 0)
+        self.assertEqual(outbox.drained, 250)
+
+    def test_cursor_survives_restart(self):
+        outbox = self.open(segment_size=4096, drain_batch=10)
+        for i in range(25):
+            outbox.append('t', str(i).encode())
+        outbox.drain(lambda topic, payload: True)
+        outbox = self.reopen(outbox, segment_size=4096, drain_batch=10)
+        self.assertEqual(outbox.pending, 15)
+        self.assertEqual([payload for _, payload in self.drain_all(outbox)], [str(i).encode() for i in range(10, 25)])
+
+    def test_refused_message_stays_in_the_outbox(self):
+        outbox = self.open(drain_batch=10)
+        for i in range(10):
+            outbox.append('t', str(i).encode())
+        accepted = iter([True, True, True, False])
+        self.assertEqual(outbox.drain(lambda topic, payload: next(accepted)), 3)
+        self.assertEqual(outbox.pending, 7)
+        self.assertEqual(outbox.drain(lambda topic, payload: False), 0)
+        outbox = self.reopen(outbox, drain_batch=10)
+        self.assertEqual([payload for _, payload in self.drain_all(outbox)], [str(i).encode() for i in range(3, 10)])
+
+    def test_torn_record_ends_recovery(self):
+        outbox = self.open(segment_size=4096)
+        for i in range(5):
+            outbox.append('t', b'x' * 10)
+        # Simulate a crash while writing the fifth record: its body is incomplete
+        segment = next(iter(outbox._segments.values()))
+        record_size = RECORD.size + 1 + 10
+        segment.map[4 * record_size + RECORD.size:5 * record_size] = b'\0' * (record_size - RECORD.size)
+        outbox = self.reopen(outbox, segment_size=4096)
+        self.assertEqual(outbox.pending, 4)
+        # Appends continue after the last intact record
+        outbox.append('t', b'after')
+        self.assertEqual([payload for _, payload in self.drain_all(outbox)], [b'x' * 10] * 4 + [b'after'])
+
+    def test_crc_mismatch_ends_recovery(self):
+        outbox = self.open(segment_size=4096)
+        for i in range(3):
+            outbox.append('t', b'y' * 10)
+        outbox.stop()
+        record_size = RECORD.size + 1 + 10
+        with open(os.path.join(self.directory, _segment_name(1)), 'r+b') as f:
+            f.seek(record_size + RECORD.size + 3)
+            f.write(b'Z')
+        outbox = self.reopen(outbox, segment_size=4096)
+        self.assertEqual(outbox.pending, 1)
+
+    def test_rotation_and_drop_accounting(self):
+        # 64-byte segments hold two 30-byte records; the budget keeps two segments
+        outbox = self.open(segment_size=64, max_bytes=128)
+        for i in range(10):
+            outbox.append('t', b'%018d' % i)
+        self.assertEqual(outbox.stats()['segments'], 2)
+        self.assertEqual(outbox.dropped, 6)
+        self.assertEqual(outbox.pending, 4)
+        self.assertEqual(outbox.appended, outbox.pending + outbox.dropped)
+        self.assertEqual([payload for _, payload in self.drain_all(outbox)], [b'%018d' % i for i in range(6, 10)])
+        self.assertEqual(outbox.pending, 0)
+
+    def test_drop_after_partial_drain(self):
+        outbox = self.open(segment_size=64, max_bytes=128, drain_batch=1)
+        for i in range(4):
+            outbox.append('t', b'%018d' % i)
+        outbox.drain(lambda topic, payload: True)  # Message 0
+        for i in range(4, 6):
+            outbox.append('t', b'%018d' % i)  # Rotation discards the segment holding message 1
+        self.assertEqual(outbox.dropped, 1)
+        self.assertEqual(outbox.pending, 4)
+        outbox = self.reopen(outbox, segment_size=64, max_bytes=128)
+        self.assertEqual([payload for _, payload in self.drain_all(outbox)], [b'%018d' % i for i in range(2, 6)])
+
+    def test_drained_segments_are_deleted(self):
+        outbox = self.open(segment_size=64)
+        for i in range(6):
+            outbox.append('t', b'%018d' % i)
+        self.drain_all(outbox)
+        segments = [name for name in os.listdir(self.directory) if name.startswith('segment-')]
+        self.assertEqual(segments, [_segment_name(3)])
+
+    def test_oversized_message_is_rejected(self):
+        outbox = self.open(segment_size=64)
+        with self.assertRaises(ValueError):
+            outbox.append('t', b'x' * 64)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+from utils.payload import (FLAG_ALARM, HEADER, KIND_MOTION, KIND_TEMPERATURE, MAGIC, RECORD, VERSION, Record,
+                           decode_envelope, decode_reading, encode_envelope, encode_reading, is_envelope)
+
+def envelope(names, records, base=1700000000.0):
+    """Builds an envelope by hand, so malformed ones can be made on purpose."""
+    parts = [HEADER.pack(MAGIC, VERSION, base, len(names))]
+    for name in names:
+        parts.append(bytes((len(name),)) + name)
+    parts.extend(RECORD.pack(*record) for record in records)
+    return b''.join(parts)
+
+class TextReadingTest(unittest.TestCase):
+    def test_round_trip_with_timestamp(self):
+        value, timestamp = decode_reading(encode_reading(24.53, 1700000000.123456))
+        self.assertEqual(value, "24.53")
+        self.assertAlmostEqual(timestamp, 1700000000.123456, places=6)
+
+    def test_without_timestamp(self):
+        self.assertEqual(decode_reading(encode_reading(24.53)), ("24.53", None))
+        self.assertFalse(is_envelope(encode_reading(24.53).encode()))
+
+class EnvelopeRoundTripTest(unittest.TestCase):
+    def test_round_trip(self):
+        records = [
+            Record('temp-1', KIND_TEMPERATURE, 24.53, 1700000000.0, 0),
+            Record('motion-1', KIND_MOTION, 1.0, 1700000000.25, FLAG_ALARM),
+            Record('temp-1', KIND_TEMPERATURE, 25.1, 1700000001.5, 0),
+            Record('capteur-é', KIND_TEMPERATURE, -3.5, 1700000002.0, 0),
+        ]
+        data = encode_envelope(records)
+        self.assertTrue(is_envelope(data))
+        decoded = decode_envelope(data)
+        self.assertEqual(len(decoded), len(records))
+        for got, sent in zip(decoded, records):
+            self.assertEqual((got.sensor_id, got.kind, got.value, got.flags),
+                             (sent.sensor_id, sent.kind, sent.value, sent.flags))
+            self.assertAlmostEqual(got.timestamp, sent.timestamp, places=3)
+
+    def test_names_are_sent_once(self):
+        one = encode_envelope([Record('temp-1', KIND_TEMPERATURE, 20.0, 1.0, 0)])
+        two = encode_envelope([Record('temp-1', KIND_TEMPERATURE, 20.0, 1.0, 0)] * 2)
+        self.assertEqual(len(two) - len(one), RECORD.size)
+
+    def test_long_sensor_id_is_rejected(self):
+        with self.assertRaises(ValueError):
+            encode_envelope([Record('x' * 256, KIND_TEMPERATURE, 20.0, 1.0, 0)])
+
+class EnvelopeCorruptionTest(unittest.TestCase):
+    def valid(self):
+        return encode_envelope([Record('temp-1', KIND_TEMPERATURE, 24.5, 1700000000.0, 0),
+                                Record('temp-2', KIND_TEMPERATURE, 25.5, 1700000000.0, 0)])
+
+    def test_truncated_header(self):
+        with self.assertRaises(ValueError):
+            decode_envelope(self.valid()[:HEADER.size - 1])
+
+    def test_wrong_version(self):
+        data = bytearray(self.valid())
+        data[1] = VERSION + 1
+        with self.assertRaises(ValueError):
+            decode_envelope(bytes(data))
+
+    def test_every_truncation_raises_value_error(self):
+        data = self.valid()
+        for end in range(len(data)):
+            with self.subTest(end=end):
+                try:
+                    decode_envelope(data[:end])
+                except ValueError:
+                    pass
+                else:
+                    # Cutting exactly between records leaves a shorter but valid envelope
+                    self.assertEqual((end - (len(data) - 2 * RECORD.size)) % RECORD.size, 0)
+
+    def test_name_length_past_the_end(self):
+        data = envelope([b'temp-1'], [])
+        # Claim a longer name than the payload holds
+        data = data[:HEADER.size] + bytes((200,)) + data[HEADER.size + 1:]
+        with self.assertRaises(ValueError):
+            decode_envelope(data)
+
+    def test_invalid_utf8_name(self):
+        with self.assertRaises(ValueError):
+            decode_envelope(envelope([b'\xff\xfe'], [(0, 0, 20.0, KIND_TEMPERATURE)]))
+
+    def test_sensor_index_out_of_range(self):
+        with self.assertRaises(ValueError):
+            decode_envelope(envelope([b'temp-1'], [(1, 0, 20.0, KIND_TEMPERATURE)]))
+
+    def test_unicode_split_by_short_length(self):
+        # A length that cuts a multi-byte character in half
+        name = 'é'.encode()
+        data = HEADER.pack(MAGIC, VERSION, 0.0, 1) + bytes((1,)) + name + RECORD.pack(0, 0, 1.0, 0)
+        with self.assertRaises(ValueError):
+            decode_envelope(data)
+
+if __name__ == '__main__':
+    unittest.main()
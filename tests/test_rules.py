@@ -0,0 +1,54 @@
+from random import Random
+import unittest
+
+from utils.rules import CoolingRules
+
+class CoolingRulesTest(unittest.TestCase):
+    def decide_all(self, rules, readings):
+        return [rules.decide(room, value, timestamp, sensor) for timestamp, (room, sensor, value) in enumerate(readings)]
+
+    def test_room_follows_its_warmest_sensor(self):
+        rules = CoolingRules(28.0)
+        readings = [('lab', 'a', 35.0), ('lab', 'b', 22.0), ('lab', 'a', 35.0), ('lab', 'b', 22.0), ('lab', 'a', 22.0)]
+        self.assertEqual(self.decide_all(rules, readings), [True, True, True, True, False])
+
+    def test_batch_matches_single_readings(self):
+        readings = [('lab', 'a', 35.0), ('hall', 'c', 29.0), ('lab', 'b', 22.0), ('hall', 'c', 27.5), ('lab', 'a', 27.5)]
+        single = self.decide_all(CoolingRules(28.0, hysteresis=1.0), readings)
+        batch = CoolingRules(28.0, hysteresis=1.0).evaluate(
+            [room for room, _, _ in readings], [value for _, _, value in readings], range(len(readings)),
+            [sensor for _, sensor, _ in readings])
+        self.assertEqual(single, batch.tolist())
+        self.assertEqual(single, [True, True, True, True, True])
+
+    def test_single_readings_match_batches(self):
+        # decide() takes the scalar path; evaluate() of a batch the vectorized one
+        random = Random(7)
+        settings = dict(hysteresis=0.5, rate_per_minute=2.0, moving_average=3, rooms={'lab': {'threshold': 26.0}},
+                        schedules=[{'start': '22:00', 'end': '06:00', 'threshold': 30.0, 'rooms': ['hall']}])
+        readings = [(random.choice(['lab', 'hall', 'store']), random.choice('abc'), random.uniform(20.0, 34.0), i * 700.0)
+                    for i in range(300)]
+        single_rules, batch_rules = CoolingRules(28.0, **settings), CoolingRules(28.0, **settings)
+        single = [single_rules.decide(room, value, timestamp, sensor) for room, sensor, value, timestamp in readings]
+        batch = []
+        for i in range(0, len(readings), 7):
+            chunk = readings[i:i + 7]
+            batch += batch_rules.evaluate([r[0] for r in chunk], [r[2] for r in chunk], [r[3] for r in chunk],
+                                          [r[1] for r in chunk]).tolist()
+        self.assertEqual(single, batch)
+
+    def test_rising_sensor_keeps_room_on(self):
+        rules = CoolingRules(28.0, rate_per_minute=1.0)
+        readings = [('lab', 'a', 20.0, 0.0), ('lab', 'a', 22.0, 60.0), ('lab', 'b', 20.0, 61.0)]
+        decisions = [rules.decide(room, value, timestamp, sensor) for room, sensor, value, timestamp in readings]
+        self.assertEqual(decisions, [False, True, True])
+
+    def test_invalid_configure_keeps_rules(self):
+        rules = CoolingRules(28.0)
+        with self.assertRaises(ValueError):
+            rules.configure(threshold=25.0, schedules=[{'start': '25:00', 'end': '06:00', 'threshold': 20.0}])
+        self.assertEqual(rules.threshold, 28.0)
+        self.assertFalse(rules.decide('lab', 27.0, 0.0))
+
+if __name__ == '__main__':
+    unittest.main()
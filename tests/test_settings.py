@@ -0,0 +1,48 @@
+import json
+import unittest
+
+from utils.settings import ConfigStore
+
+DEFAULTS = {'temp_threshold': 28.0, 'alert_enabled': True, 'alarm_start': '18:00', 'alarm_end': '09:00', 'alarm_enabled': True}
+
+class ConfigStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = ConfigStore(DEFAULTS, 'user1')
+        self.notified = []
+        self.store.subscribe(lambda snapshot, changed, source: self.notified.append((changed, source)))
+
+    def test_coerces_valid_values(self):
+        self.assertEqual(self.store.update({'temp_threshold': '26.5', 'alarm_start': '20:30'}), ['temp_threshold', 'alarm_start'])
+        self.assertEqual(self.store.snapshot['temp_threshold'], 26.5)
+        self.assertEqual(self.store.version, 1)
+
+    def test_invalid_change_is_rejected_whole(self):
+        invalid = [
+            {'alarm_start': '25:00'},
+            {'alarm_end': 900},
+            {'temp_threshold': 'warm'},
+            {'temp_threshold': float('nan')},
+            {'alarm_enabled': 'false'},
+            {'temp_threshold': 20.0, 'alert_enabled': 1},
+        ]
+        for changes in invalid:
+            with self.subTest(changes=changes), self.assertRaises(ValueError):
+                self.store.update(changes)
+        self.assertEqual(dict(self.store.snapshot), DEFAULTS)
+        self.assertEqual((self.store.version, self.notified), (0, []))
+
+    def test_invalid_remote_update_is_rejected(self):
+        message = {'version': 5, 'origin': 'user2', 'settings': {'alarm_start': 'soon'}, 'stamps': {'alarm_start': [5, 'user2']}}
+        with self.assertRaises(ValueError):
+            self.store.apply_remote(json.dumps(message))
+        self.assertEqual(self.store.snapshot['alarm_start'], '18:00')
+        # The rejected stamp isn't recorded, so a later valid update with the same stamp still applies
+        message['settings']['alarm_start'] = '19:00'
+        self.assertEqual(self.store.apply_remote(json.dumps(message)), ['alarm_start'])
+
+    def test_invalid_defaults_are_rejected(self):
+        with self.assertRaises(ValueError):
+            ConfigStore(dict(DEFAULTS, alarm_end='later'), 'user1')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+asyncio runtime support, selected with "runtime": "asyncio" in config.json.
+
+In this mode the MQTT socket, the sensor publisher, the socket.io flush task and the socket.io
+server all run on one event loop: paho is driven through add_reader/add_writer instead of
+loop_forever on a thread, and socket.io is served by python-socketio's AsyncServer under an ASGI
+server, with the Flask routes mounted behind it. Needs the optional uvicorn and asgiref packages.
+"""
+import asyncio
+import paho.mqtt.client as mqtt
+
+class AsyncMQTTHelper:
+    """
+    Drives a ConnectionManager's paho client from an asyncio event loop.
+    Attributes:
+        connection (ConnectionManager): Chooses brokers, backs off and fails back.
+        loop (asyncio.AbstractEventLoop): The loop that owns the MQTT socket.
+    Connects, reconnects and failback go through the manager on an executor thread. paho can open, close
+    or want to write to the socket from any thread (e.g. publishing from pipeline workers), so
+    reader/writer registration from other threads is handed to the loop with call_soon_threadsafe.
+    """
+    def __init__(self, connection, loop):
+        self.connection = connection
+        self.client = connection.client
+        self.loop = loop
+        self._misc_task = None
+        self._sock = None
+
+    def _call(self, fn, *args):
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _add_reader(self, fd):
+        self.loop.add_reader(fd, self.client.loop_read)
+
+    def _remove(self, fd):
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+
+    # File descriptors rather than sockets are passed on, since paho closes the socket right
+    # after on_socket_close returns
+    def _on_socket_open(self, client, userdata, sock):
+        self._sock = sock.fileno()
+        self._call(self._add_reader, self._sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._sock = None
+        self._call(self._remove, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock.fileno(), client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock.fileno())
+
+    def start(self):
+        client = self.client
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        self._misc_task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        await self.loop.run_in_executor(None, self.connection.connect)
+        # Keepalive pings and retry timers; paho expects this roughly once per second
+        while True:
+            await asyncio.sleep(1)
+            try:
+                if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                    self.connection.broker = None
+                    await self.loop.run_in_executor(None, self.connection.connect)
+                else:
+                    await self.loop.run_in_executor(None, self.connection.check_failback)
+            except Exception as e:
+                print(f"MQTT reconnect failed: {e}")
+
+    def stop(self):
+        self.connection.stop()
+        client = self.client
+        client.on_socket_open = client.on_socket_close = None
+        client.on_socket_register_write = client.on_socket_unregister_write = None
+        if self._misc_task:
+            self._misc_task.cancel()
+            self._misc_task = None
+        if self._sock is not None:
+            fd, self._sock = self._sock, None
+            self._remove(fd)
+
+class AsyncSocketBridge:
+    """
+    Gives an AsyncServer the synchronous emit() used by EmitAggregator and the MQTT callbacks.
+    Emits are scheduled on the event loop, so it is safe to call from worker threads too.
+    """
+    def __init__(self, sio, loop):
+        self.sio = sio
+        self.loop = loop
+
+    def emit(self, event, data=None, to=None):
+        self.loop.call_soon_threadsafe(self.loop.create_task, self.sio.emit(event, data, to=to))
+
+def create_server():
+    import socketio
+    return socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*")
+
+async def serve(flask_app, sio, host, port):
+    """Serves socket.io and the Flask routes on the running loop until cancelled."""
+    try:
+        import socketio
+        import uvicorn
+        from asgiref.wsgi import WsgiToAsgi
+    except ImportError as e:
+        raise RuntimeError("The asyncio runtime needs 'uvicorn' and 'asgiref' installed") from e
+    asgi_app = socketio.ASGIApp(sio, other_asgi_app=WsgiToAsgi(flask_app))
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host=host, port=port, log_level="warning"))
+    await server.serve()
+
+async def run_client(client, port, start, stop, handlers=None):
+    """
+    asyncio runtime of a client: serves its Flask app and socket.io on the running loop, sends each
+    new dashboard the state snapshot, and builds the components on an executor thread while the
+    server is already listening. Once they are ready, start(loop, tasks) starts the client's own
+    services (appending its asyncio tasks to tasks); on exit the tasks are cancelled and stop() is
+    called. handlers maps further socket.io events to client functions called with the event data.
+    """
+    loop = asyncio.get_running_loop()
+    sio = create_server()
+    client.emitter.socketio = AsyncSocketBridge(sio, loop)
+
+    @sio.on('connect')
+    async def handle_async_connect(sid, environ):
+        client.connected_clients.inc()
+        await sio.emit('snapshot', client.state.snapshot(), to=sid)
+
+    @sio.on('disconnect')
+    async def handle_async_disconnect(sid, *args):
+        client.connected_clients.dec()
+
+    for event, handler in (handlers or {}).items():
+        async def handle_async_event(sid, data, handler=handler):
+            handler(data)
+        sio.on(event, handle_async_event)
+
+    tasks = [loop.create_task(client.emitter.run_async())]
+
+    async def begin():
+        await loop.run_in_executor(None, client.startup.call, client.init_components, port)
+        if client.startup.initialized:
+            start(loop, tasks)
+
+    tasks.append(loop.create_task(begin()))
+    try:
+        await serve(client.app, sio, '0.0.0.0', port)
+    finally:
+        for task in tasks:
+            task.cancel()
+        stop()
+        client.settings.stop()
+        client.emitter.stop()
+        client.emitter.socketio = client.socketio
@@ -0,0 +1,54 @@
+import threading
+import time
+
+class ChangeFilter:
+    """
+    Decides whether a value is worth publishing again, for publish-on-change topics.
+    Attributes:
+        deadband (float): Numeric values within this distance of the last published value are suppressed.
+            None (or 0) suppresses only identical values, e.g. a repeated "ON".
+        heartbeat (float): Seconds after which an unchanged value is published anyway, so subscribers that
+            missed it or joined late still converge; 0 never re-sends an unchanged value.
+        suppressed (int): Values check() rejected.
+    Keys are whatever identifies one stream of values, e.g. a sensor topic or a room.
+    """
+    def __init__(self, deadband=None, heartbeat=0):
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.suppressed = 0
+        self._last = {}  # key -> (value, monotonic time published)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_data, deadband_key=None):
+        """Returns None when mqtt.publish.on_change is off, meaning every value is published."""
+        settings = config_data['mqtt'].get('publish', {})
+        if not settings.get('on_change', False):
+            return None
+        return cls(settings.get(deadband_key) if deadband_key else None, settings.get('heartbeat', 0))
+
+    def _unchanged(self, last, value):
+        if self.deadband:
+            return abs(value - last) <= self.deadband
+        return value == last
+
+    def check(self, key, value, now=None):
+        """Returns True if value should be published, and records it as published."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and self._unchanged(last[0], value) and \
+                    not (self.heartbeat and now - last[1] >= self.heartbeat):
+                self.suppressed += 1
+                return False
+            self._last[key] = (value, now)
+            return True
+
+    def mark(self, key, value, now=None):
+        """Records a value that was published regardless of the filter."""
+        with self._lock:
+            self._last[key] = (value, time.monotonic() if now is None else now)
+
+    def forget(self):
+        with self._lock:
+            self._last.clear()
@@ -0,0 +1,208 @@
+"""
+Clustered cooling controller: several Client2 processes split the temperature stream.
+
+Every node subscribes to temperatures through an MQTT v5 shared subscription
+($share/<group>/<filter>), so the broker delivers each reading to one node of the group instead
+of to all of them. Each room has exactly one owner, chosen by rendezvous hashing over the live
+members: the node with the highest hash of (node, room) owns it. Nodes agree on the owner without
+talking to each other as long as they agree on the membership, and when a node joins or leaves
+only the rooms it gains or loses move.
+
+A reading delivered to a node that doesn't own its room is forwarded, still encrypted, to the
+owner on <cluster topic>/nodes/<owner>/<original topic>. So a room's cooling state (hysteresis,
+averages, publish-on-change) lives on one node only and commands are never published twice.
+
+Membership is kept with retained heartbeats on <cluster topic>/members/<node>. A node that stops
+is removed by its empty retained message (published on a clean shutdown, or as its last will by the
+broker), and one that goes quiet is expired after timeout seconds.
+"""
+from utils.topics import load_topics
+import asyncio
+import hashlib
+import os
+import socket
+import threading
+import time
+
+def _weight(node, room):
+    # Stable across processes, unlike hash(), which is randomized per interpreter
+    return int.from_bytes(hashlib.blake2b(f"{node}/{room}".encode(), digest_size=8).digest(), 'big')
+
+class Cluster:
+    """
+    Membership and room ownership for one controller node.
+    Attributes:
+        node_id (str): This node's name; defaults to <hostname>-<pid>.
+        group (str): Shared subscription group name; every node of a cluster uses the same one.
+        topic (str): Base topic for heartbeats, forwarded readings and overrides.
+        heartbeat (float): Seconds between heartbeats.
+        timeout (float): Members not heard from for this long are dropped.
+        on_rebalance (callable): Called with the sorted member list whenever membership changes.
+    """
+    def __init__(self, topic, group='controllers', node_id=None, heartbeat=2.0, timeout=None):
+        self.topic = topic
+        self.group = group
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat = heartbeat
+        self.timeout = timeout or heartbeat * 3
+        self.on_rebalance = None
+        self.forwarded = 0
+        self.rebalances = 0
+        self._seen = {}  # other node -> monotonic time of its last heartbeat
+        # (members, room -> owner cache), swapped as one tuple so owner() needs no lock
+        self._view = ((self.node_id,), {})
+        self._lock = threading.Lock()
+        self._send = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config_data):
+        """Returns None unless cluster.enabled is set, meaning this node owns every room."""
+        settings = config_data.get('cluster', {})
+        if not settings.get('enabled', False):
+            return None
+        return cls(
+            load_topics(config_data)['cluster'].topic,
+            group=settings.get('group', 'controllers'),
+            node_id=settings.get('node_id'),
+            heartbeat=settings.get('heartbeat', 2.0),
+            timeout=settings.get('timeout'),
+        )
+
+    # Topics
+    def shared(self, topic_filter):
+        return f"$share/{self.group}/{topic_filter}"
+
+    @property
+    def members_filter(self):
+        return f"{self.topic}/members/+"
+
+    def member_topic(self, node=None):
+        return f"{self.topic}/members/{node or self.node_id}"
+
+    @property
+    def override_topic(self):
+        return f"{self.topic}/override"
+
+    def forward_topic(self, node, topic):
+        return f"{self.topic}/nodes/{node}/{topic}"
+
+    @property
+    def inbox_filter(self):
+        return f"{self.topic}/nodes/{self.node_id}/#"
+
+    def forwarded_topic(self, topic):
+        """Returns the original topic of a reading forwarded to this node, or None."""
+        prefix = f"{self.topic}/nodes/{self.node_id}/"
+        return topic[len(prefix):] if topic.startswith(prefix) else None
+
+    def member_of(self, topic):
+        """Returns the node a heartbeat topic belongs to, or None for other topics."""
+        prefix = f"{self.topic}/members/"
+        return topic[len(prefix):] if topic.startswith(prefix) else None
+
+    # Ownership
+    @property
+    def members(self):
+        return self._view[0]
+
+    def owner(self, room):
+        members, owners = self._view
+        node = owners.get(room)
+        if node is None:
+            node = owners[room] = max(members, key=lambda member: _weight(member, room))
+        return node
+
+    def owns(self, room):
+        return self.owner(room) == self.node_id
+
+    def _rebuild(self):
+        # Called with the lock held
+        members = tuple(sorted({self.node_id, *self._seen}))
+        if members == self._view[0]:
+            return False
+        self._view = (members, {})
+        self.rebalances += 1
+        print(f"Cluster members: {', '.join(members)}")
+        return True
+
+    def _changed(self):
+        if self.on_rebalance:
+            self.on_rebalance(list(self.members))
+
+    def on_heartbeat(self, node, alive):
+        """Records a heartbeat (alive) or a departure (empty payload) from another node."""
+        if node == self.node_id:
+            return
+        with self._lock:
+            joined = alive and node not in self._seen
+            if alive:
+                self._seen[node] = time.monotonic()
+            else:
+                self._seen.pop(node, None)
+            changed = self._rebuild()
+        if joined:
+            # Answer straight away so the new node learns the membership without waiting a full interval
+            self.send_heartbeat()
+        if changed:
+            self._changed()
+
+    def expire(self):
+        now = time.monotonic()
+        with self._lock:
+            for node in [node for node, seen in self._seen.items() if now - seen > self.timeout]:
+                print(f"Cluster member {node} timed out")
+                del self._seen[node]
+            changed = self._rebuild()
+        if changed:
+            self._changed()
+
+    # Heartbeats; send(topic, payload) publishes a retained message ('' to clear it)
+    def send_heartbeat(self):
+        if self._send:
+            self._send(self.member_topic(), self.node_id)
+
+    def leave(self):
+        if self._send:
+            self._send(self.member_topic(), '')
+
+    def _tick(self):
+        self.send_heartbeat()
+        self.expire()
+
+    def _run(self):
+        while not self._stop.wait(self.heartbeat):
+            self._tick()
+
+    async def run_async(self, send):
+        self._send = send
+        self._stop.clear()
+        while not self._stop.is_set():
+            await asyncio.sleep(self.heartbeat)
+            self._tick()
+
+    def start(self, send):
+        self._send = send
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="cluster-heartbeat")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        self.leave()
+
+    def stats(self):
+        return {
+            'node': self.node_id,
+            'member_count': len(self.members),
+            'rooms_known': len(self._view[1]),
+            'rooms_owned': sum(1 for node in list(self._view[1].values()) if node == self.node_id),
+            'forwarded': self.forwarded,
+            'rebalances': self.rebalances,
+        }
@@ -0,0 +1,406 @@
+from collections import deque
+import queue
+import random
+import socket
+import threading
+import time
+
+from paho.mqtt.client import MQTT_ERR_NO_CONN
+
+class Broker:
+    __slots__ = ('host', 'port', 'failures', 'next_attempt')
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.failures = 0
+        self.next_attempt = 0.0
+
+    def __repr__(self):
+        return f"{self.host}:{self.port}"
+
+class ConnectionManager:
+    """
+    Keeps one paho client connected to the best available broker.
+    Attributes:
+        brokers (list[Broker]): Brokers in order of preference; the first is the primary.
+        client (mqtt.Client): The paho client, created once by client_factory and reused across brokers.
+        broker (Broker): The broker currently connected to, or None once the connection is lost.
+        on_connect, on_disconnect, on_message: Application callbacks, forwarded from paho.
+    Behaviour:
+        - Brokers are health-checked in parallel with a quick TCP connect, and the most preferred
+          one that answers is used. A less preferred broker is only taken once every broker ahead of
+          it has failed or probe_grace seconds have passed, so an unreachable primary costs
+          probe_grace rather than health_timeout. A broker that fails is skipped until its own
+          exponential backoff (with jitter) expires.
+        - While on a fallback broker, the primary is probed every failback_interval seconds and the
+          connection moves back as soon as it is healthy. The probe runs on its own thread (or an
+          executor in the asyncio runtime), never on the thread reading the socket.
+        - Connected means a CONNACK has arrived and on_disconnect hasn't fired since; paho's own
+          is_connected() stays True after the broker drops the link.
+        - publish() while offline buffers up to buffer_size messages, dropping the oldest, and the
+          buffer is flushed on reconnect.
+        - Reconnect latency (disconnect to CONNACK) is recorded for stats().
+        - QoS 1/2 publishes are tracked until acknowledged, for ack latency, in-flight count and
+          redeliveries (unacknowledged messages paho re-sends after a reconnect). Incoming messages
+          flagged as duplicates are counted too.
+    start() runs the network loop and supervision on a background thread. In the asyncio runtime,
+    connect() and check_failback() are called from an executor instead and the socket is driven by
+    utils.aio.AsyncMQTTHelper.
+    """
+    def __init__(self, brokers, port, client_factory, username=None, password=None, keepalive=60,
+                 backoff_initial=1.0, backoff_max=60.0, failback_interval=30.0, buffer_size=1000,
+                 health_timeout=2.0, probe_grace=0.25, max_inflight_messages=20, max_queued_messages=0):
+        self.brokers = [Broker(host, port) for host in brokers if host]
+        self.keepalive = keepalive
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.failback_interval = failback_interval
+        self.health_timeout = health_timeout
+        self.probe_grace = probe_grace
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.broker = None
+        self._connected = False
+
+        self.client = client_factory()
+        if username:
+            self.client.username_pw_set(username, password)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+        # QoS 1/2 messages awaiting their ack, and how many paho queues before publish() fails (0: no limit)
+        self.client.max_inflight_messages_set(max_inflight_messages)
+        self.client.max_queued_messages_set(max_queued_messages)
+
+        self._buffer = deque(maxlen=buffer_size)
+        self._buffer_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._previous = None
+        self._disconnected_at = time.monotonic()
+        self._last_failback_check = time.monotonic()
+        self._failback_probe = None
+        self._failback_ready = threading.Event()  # Set by the failback probe thread when the primary answered
+
+        self.connects = 0
+        self.disconnects = 0
+        self.failovers = 0
+        self.buffered = 0
+        self.buffer_dropped = 0
+        self.last_reconnect_latency = None
+        self.max_reconnect_latency = 0.0
+        self._total_reconnect_latency = 0.0
+
+        self.published = [0, 0, 0]  # by QoS
+        self.publish_errors = 0
+        self.acked = 0
+        self.redelivered = 0
+        self.duplicates_received = 0
+        self.max_ack_latency = 0.0
+        self._total_ack_latency = 0.0
+        self._unacked = {}  # mid -> monotonic time published, for QoS 1/2
+        self._early_acks = {}  # mid -> time its ack arrived before publish() returned
+        self._ack_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_data, client_factory):
+        mqtt_settings = config_data['mqtt']
+        settings = mqtt_settings.get('connection', {})
+        return cls(
+            [mqtt_settings['primary_broker'], mqtt_settings.get('fallback_broker')],
+            mqtt_settings['port'],
+            client_factory,
+            username=mqtt_settings.get('username'),
+            password=mqtt_settings.get('password'),
+            keepalive=settings.get('keepalive', 60),
+            backoff_initial=settings.get('backoff_initial', 1.0),
+            backoff_max=settings.get('backoff_max', 60.0),
+            failback_interval=settings.get('failback_interval', 30.0),
+            buffer_size=settings.get('offline_buffer_size', 1000),
+            health_timeout=settings.get('health_timeout', 2.0),
+            probe_grace=settings.get('probe_grace', 0.25),
+            max_inflight_messages=settings.get('max_inflight_messages', 20),
+            max_queued_messages=settings.get('max_queued_messages', 0),
+        )
+
+    # paho callbacks; *args absorbs the extra 'properties' argument MQTT v5 clients receive
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        if rc == 0:
+            self._connected = True
+            self.connects += 1
+            latency = time.monotonic() - self._disconnected_at
+            self.last_reconnect_latency = latency
+            self.max_reconnect_latency = max(self.max_reconnect_latency, latency)
+            self._total_reconnect_latency += latency
+            with self._ack_lock:
+                # paho re-sends these with the DUP flag on the new connection
+                self.redelivered += len(self._unacked)
+                self._early_acks.clear()
+            self._flush_buffer()
+        elif self.broker is not None:
+            # Refused (e.g. bad credentials): back off from this broker like any other failure
+            self.broker.failures += 1
+            self.broker.next_attempt = time.monotonic() + self._backoff(self.broker.failures)
+        if self.on_connect:
+            self.on_connect(client, userdata, flags, rc, *args)
+
+    def _on_disconnect(self, client, userdata, rc, *args):
+        self._connected = False
+        self.disconnects += 1
+        self._disconnected_at = time.monotonic()
+        if self.on_disconnect:
+            self.on_disconnect(client, userdata, rc, *args)
+
+    def _on_message(self, client, userdata, msg):
+        if msg.dup:
+            self.duplicates_received += 1
+        if self.on_message:
+            self.on_message(client, userdata, msg)
+
+    def _on_publish(self, client, userdata, mid):
+        # Called when a QoS 0 message is written, or a QoS 1/2 message is acknowledged
+        now = time.monotonic()
+        with self._ack_lock:
+            sent = self._unacked.pop(mid, None)
+            if sent is None:
+                # Sent inline by publish() (QoS 0), or acked before _track() ran
+                self._early_acks[mid] = now
+                if len(self._early_acks) > 1024:
+                    # QoS 0 messages written later by the network loop are never claimed
+                    self._early_acks = {m: t for m, t in self._early_acks.items() if now - t < 10}
+                return
+        self._acked(now - sent)
+
+    def _acked(self, latency):
+        self.acked += 1
+        self._total_ack_latency += latency
+        self.max_ack_latency = max(self.max_ack_latency, latency)
+
+    def _track(self, info, qos):
+        # Without a connection paho keeps QoS 1/2 messages and sends them once reconnected
+        if info.rc != 0 and not (qos and info.rc == MQTT_ERR_NO_CONN):
+            self.publish_errors += 1
+            return
+        self.published[qos] += 1
+        now = time.monotonic()
+        with self._ack_lock:
+            early = self._early_acks.pop(info.mid, None)
+            if qos and early is None:
+                self._unacked[info.mid] = now
+                return
+        if qos:
+            self._acked(0.0)
+
+    def _backoff(self, failures):
+        delay = min(self.backoff_max, self.backoff_initial * (2 ** (failures - 1)))
+        # Equal jitter: never less than half the delay, so many clients spread out without hammering
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _healthy(self, broker):
+        try:
+            socket.create_connection((broker.host, broker.port), timeout=self.health_timeout).close()
+            return True
+        except OSError:
+            return False
+
+    def _probe(self, brokers):
+        """
+        Health-checks brokers in parallel. Returns (the most preferred healthy broker or None, the
+        brokers that failed); checks still running when a broker is chosen are left to finish.
+        """
+        results = queue.Queue()
+        for broker in brokers:
+            threading.Thread(target=lambda broker=broker: results.put((broker, self._healthy(broker))),
+                             name=f"mqtt-probe-{broker}", daemon=True).start()
+        healthy, failed = [], []
+        deadline = None
+        while len(healthy) + len(failed) < len(brokers):
+            try:
+                broker, ok = results.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break  # probe_grace is over: settle for the best healthy broker so far
+            (healthy if ok else failed).append(broker)
+            best = next((broker for broker in brokers if broker not in failed), None)
+            if best is not None and best in healthy:
+                return best, failed
+            if deadline is None and healthy:
+                deadline = time.monotonic() + self.probe_grace
+        return next((broker for broker in brokers if broker in healthy), None), failed
+
+    def _failed(self, broker, error):
+        broker.failures += 1
+        broker.next_attempt = time.monotonic() + self._backoff(broker.failures)
+        print(f"Failed to connect to broker {broker}: {error}")
+
+    def _try_broker(self, broker, checked=False):
+        try:
+            if not checked and not self._healthy(broker):
+                raise OSError("health check failed")
+            self.client.connect(broker.host, broker.port, self.keepalive)
+        except Exception as e:
+            self._failed(broker, e)
+            return False
+        broker.failures = 0
+        if self._previous is not None and broker is not self._previous:
+            self.failovers += 1
+        self.broker = self._previous = broker
+        print(f"Connected to broker {broker}")
+        return True
+
+    def connect(self):
+        """Blocks until connected to some broker (or stop() is called); returns True when connected."""
+        while not self._stop.is_set():
+            now = time.monotonic()
+            due = [broker for broker in self.brokers if broker.next_attempt <= now]
+            if due:
+                broker, failed = self._probe(due)
+                for other in failed:
+                    self._failed(other, "health check failed")
+                if broker is not None and self._try_broker(broker, checked=True):
+                    self._last_failback_check = time.monotonic()
+                    return True
+            # Every broker is backing off; wait for the earliest retry time
+            wait = min(broker.next_attempt for broker in self.brokers) - time.monotonic()
+            self._stop.wait(max(0.05, wait))
+        return False
+
+    def _failback_due(self):
+        """Returns the primary broker if connected elsewhere and failback_interval has passed, else None."""
+        primary = self.brokers[0]
+        if self.broker is primary or self.broker is None:
+            return None
+        if time.monotonic() - self._last_failback_check < self.failback_interval:
+            return None
+        self._last_failback_check = time.monotonic()
+        return primary
+
+    def _fail_back(self, primary):
+        print(f"Primary broker {primary} is healthy again, failing back")
+        self.client.disconnect()
+        self.broker = None
+        primary.next_attempt = 0.0
+        return self._try_broker(primary, checked=True) or self.connect()
+
+    def check_failback(self):
+        """
+        Moves back to the primary broker if connected elsewhere and the primary is healthy again.
+        Blocks for up to health_timeout while probing, so the asyncio runtime calls it from an executor.
+        """
+        primary = self._failback_due()
+        if primary is None or not self._healthy(primary):
+            return False
+        return self._fail_back(primary)
+
+    def _probe_failback(self):
+        """
+        Threaded runtime: probes the primary on its own thread when failback is due, so a slow
+        health check never holds up client.loop(); _supervise fails back once it has answered.
+        """
+        if self._failback_probe is not None and self._failback_probe.is_alive():
+            return
+        primary = self._failback_due()
+        if primary is None:
+            return
+
+        def probe():
+            if self._healthy(primary):
+                self._failback_ready.set()
+
+        self._failback_probe = threading.Thread(target=probe, name="mqtt-failback-probe", daemon=True)
+        self._failback_probe.start()
+
+    def _supervise(self):
+        while not self._stop.is_set():
+            if self.broker is None:
+                if not self.connect():
+                    break
+            rc = self.client.loop(timeout=1.0)
+            if rc != 0:
+                # Lost the connection: start again from the most preferred broker
+                self.broker = None
+                continue
+            if self._failback_ready.is_set():
+                self._failback_ready.clear()
+                if self.broker is not None and self.broker is not self.brokers[0]:
+                    self._fail_back(self.brokers[0])
+            else:
+                self._probe_failback()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._supervise, name="mqtt-connection")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+
+    def is_connected(self):
+        return self._connected
+
+    def publish(self, topic, payload=None, qos=0, retain=False, buffer=True):
+        """
+        Publishes through paho while connected and returns its MQTTMessageInfo. Offline, the message
+        goes to the in-memory buffer (or is refused, with buffer=False) and None is returned.
+        A QoS 0 message paho refuses with MQTT_ERR_NO_CONN (the link dropped before on_disconnect
+        ran) is buffered the same way; paho keeps QoS 1/2 messages itself and re-sends them.
+        """
+        if self._connected:
+            info = self.client.publish(topic, payload, qos, retain)
+            if info.rc != MQTT_ERR_NO_CONN or qos or not buffer:
+                self._track(info, qos)
+                return info
+        elif not buffer:
+            return None
+        with self._buffer_lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.buffer_dropped += 1
+            self._buffer.append((topic, payload, qos, retain))
+            self.buffered += 1
+        return None
+
+    def _flush_buffer(self):
+        with self._buffer_lock:
+            pending = list(self._buffer)
+            self._buffer.clear()
+        for topic, payload, qos, retain in pending:
+            self._track(self.client.publish(topic, payload, qos, retain), qos)
+
+    def subscribe(self, *args, **kwargs):
+        return self.client.subscribe(*args, **kwargs)
+
+    def stats(self):
+        return {
+            'broker': str(self.broker) if self.broker else None,
+            'connected': self._connected,
+            'connects': self.connects,
+            'disconnects': self.disconnects,
+            'failovers': self.failovers,
+            'buffered': self.buffered,
+            'buffer_depth': len(self._buffer),
+            'buffer_dropped': self.buffer_dropped,
+            'last_reconnect_latency': self.last_reconnect_latency,
+            'max_reconnect_latency': self.max_reconnect_latency,
+            'avg_reconnect_latency': self._total_reconnect_latency / self.connects if self.connects else None,
+            'published_qos0': self.published[0],
+            'published_qos1': self.published[1],
+            'published_qos2': self.published[2],
+            'publish_errors': self.publish_errors,
+            'acked': self.acked,
+            'inflight': len(self._unacked),
+            'redelivered': self.redelivered,
+            'duplicates_received': self.duplicates_received,
+            'avg_ack_latency': self._total_ack_latency / self.acked if self.acked else None,
+            'max_ack_latency': self.max_ack_latency,
+        }
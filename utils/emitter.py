@@ -0,0 +1,117 @@
+from collections import deque
+import asyncio
+import threading
+
+class EmitAggregator:
+    """
+    Buffers socket.io events and flushes them to browsers at a fixed frame rate as batched payloads.
+    Attributes:
+        socketio (SocketIO): The Flask-SocketIO server used to emit and to run the flush task.
+        interval (float): Seconds between flushes; 0 disables buffering and emits immediately.
+        coalesce (set[str]): Events for which only the latest value per key is kept (gauges).
+            Every other event is delivered in order.
+        max_batch (int): Most events of one name sent per flush; older ones beyond it are dropped
+            and the batch carries 'dropped': n. 0 sends everything.
+        emitted (int): Events handed to emit().
+        sent (int): socket.io emits actually performed.
+        dropped (int): Events dropped by max_batch.
+        event_counter (Counter): Optional utils.metrics counter labelled by event name, incremented per event.
+    Each flush sends at most one emit per event name, shaped as {'batch': [payload, ...]}.
+    """
+    def __init__(self, socketio, rate_hz=10, coalesce=('temperature', 'cooling_command'), max_batch=0):
+        self.socketio = socketio
+        self.interval = 1.0 / rate_hz if rate_hz else 0
+        self.coalesce = set(coalesce)
+        self.max_batch = max_batch
+        self.emitted = 0
+        self.sent = 0
+        self.dropped = 0
+        self.event_counter = None
+        self._latest = {}  # event -> {key: payload}
+        self._queued = {}  # event -> deque of payloads, at most max_batch long
+        self._skipped = {}  # event -> payloads dropped since the last flush
+        self._lock = threading.Lock()
+        self._running = False
+        self._task = None
+
+    @classmethod
+    def from_config(cls, socketio, config_data):
+        settings = config_data.get('socketio', {})
+        return cls(socketio, rate_hz=settings.get('emit_rate_hz', 10), max_batch=settings.get('max_batch', 0))
+
+    def emit(self, event, data, key=None):
+        self.emitted += 1
+        if self.event_counter is not None:
+            self.event_counter.inc(event)
+        if not self.interval:
+            self.socketio.emit(event, data)
+            self.sent += 1
+            return
+        with self._lock:
+            if event in self.coalesce:
+                latest = self._latest.setdefault(event, {})
+                # Re-insert so the most recently updated key is last in the batch
+                latest.pop(key, None)
+                latest[key] = data
+            else:
+                queue = self._queued.get(event)
+                if queue is None:
+                    queue = self._queued[event] = deque(maxlen=self.max_batch or None)
+                elif len(queue) == queue.maxlen:
+                    # A burst larger than a dashboard can show: keep the newest
+                    self._skipped[event] = self._skipped.get(event, 0) + 1
+                    self.dropped += 1
+                queue.append(data)
+
+    def emit_now(self, event, data):
+        """Emits immediately, bypassing the buffer; for low-rate status and control events."""
+        if self.event_counter is not None:
+            self.event_counter.inc(event)
+        self.socketio.emit(event, data)
+        self.sent += 1
+
+    def flush(self):
+        with self._lock:
+            latest, self._latest = self._latest, {}
+            queued, self._queued = self._queued, {}
+            skipped, self._skipped = self._skipped, {}
+        for event, payloads in latest.items():
+            self.socketio.emit(event, {'batch': list(payloads.values())})
+            self.sent += 1
+        for event, payloads in queued.items():
+            batch = {'batch': list(payloads)}
+            if event in skipped:
+                batch['dropped'] = skipped[event]
+            self.socketio.emit(event, batch)
+            self.sent += 1
+
+    def _run(self):
+        while self._running:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing socket.io batch: {e}")
+
+    async def run_async(self):
+        """Flush loop for the asyncio runtime, where socketio is an AsyncSocketBridge."""
+        self._running = True
+        while self._running:
+            await asyncio.sleep(self.interval or 0.1)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing socket.io batch: {e}")
+
+    def start(self):
+        if self._task is None and self.interval:
+            self._running = True
+            self._task = self.socketio.start_background_task(self._run)
+
+    def stats(self):
+        return {'emitted': self.emitted, 'sent': self.sent, 'dropped': self.dropped}
+
+    def stop(self):
+        self._running = False
+        self._task = None
+        self.flush()
@@ -1,39 +1,103 @@
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from collections import OrderedDict
+import base64
 import os
+import threading
+import time
+
+# First byte of an AEAD token identifies the cipher. Fernet tokens always start with b'g'
+# (base64 of version byte 0x80), so both formats can be told apart on the wire.
+AEAD_MODES = {
+    'aesgcm': (0xA1, AESGCM),
+    'chacha20': (0xC2, ChaCha20Poly1305),
+}
+AEAD_MODE_IDS = {mode_id: mode for mode, (mode_id, _) in AEAD_MODES.items()}
+MODES = ('fernet',) + tuple(AEAD_MODES)
+NONCE_SIZE = 12
+HEADER_SIZE = 2 + NONCE_SIZE  # mode id, key version, nonce
+MAX_KEY_VERSION = 255  # The key version is one byte of the AEAD header
 
 class EncryptionManager:
     """
-    EncryptionManager provides symmetric encryption and decryption functionality using Fernet.
+    EncryptionManager provides symmetric encryption and decryption functionality using Fernet or an AEAD cipher.
     Attributes:
-        key (bytes): The encryption key used for encrypting and decrypting messages.
-        cipher_suite (Fernet): The Fernet cipher suite initialized with the encryption key.
+        mode (str): 'fernet' (default, base64 tokens), 'aesgcm' or 'chacha20' (raw bytes).
+        key_version (int): Version of the key used for encrypting, 1 to 255; older versions found on disk are still accepted for decrypting.
+        key (bytes): The current version's encryption key.
+        cipher_suite (Fernet): The Fernet cipher suite initialized with the current key.
+        cache_ttl (float): Seconds a decrypted token stays cached; 0 disables the cache.
+        cache_size (int): Maximum number of cached tokens.
+        cache_hits (int): Number of decrypt calls answered from the cache.
+        timings (Histogram): Optional utils.metrics histogram labelled by operation; when set, encrypt and
+            decrypt latencies are observed into it.
     Methods:
-        __init__():
-            Initializes the EncryptionManager by generating or loading an encryption key and setting up the cipher suite.
-        _get_or_create_key():
+        __init__(mode='fernet', key_version=1, cache_ttl=0, cache_size=4096, key_dir=None):
+            Initializes the EncryptionManager by generating or loading the encryption key and setting up the ciphers.
+        from_config(config_data) -> EncryptionManager:
+            Builds an EncryptionManager from the 'encryption' section of config.json; key_dir defaults
+            to the repository root.
+        _get_or_create_key(version):
             Generates a new encryption key and saves it to a file if it does not exist, or loads the existing key from file.
+            Version 1 uses encryption.key, later versions use encryption.v<version>.key.
             Returns:
                 bytes: The encryption key.
-        encrypt(message: str) -> bytes:
-            Encrypts a plaintext string message.
-            Args:
-                message (str): The plaintext message to encrypt.
-            Returns:
-                bytes: The encrypted message as bytes.
+        encrypt(message: str | bytes) -> bytes:
+            Encrypts a plaintext string (or raw bytes, e.g. a binary payload) with the configured mode and current key version.
         decrypt(encrypted_message: bytes) -> str:
-            Decrypts an encrypted message.
-            Args:
-                encrypted_message (bytes): The encrypted message to decrypt.
-            Returns:
-                str: The decrypted plaintext message.
+            Decrypts a Fernet or AEAD token, detecting the format from the token itself.
+        decrypt_bytes(encrypted_message: bytes) -> bytes:
+            Like decrypt, but returns the raw plaintext for binary payloads.
+        encrypt_many(messages) -> list[bytes]:
+            Encrypts a batch of messages.
+        decrypt_many(encrypted_messages, ignore_errors=False) -> list[str]:
+            Decrypts a batch of tokens; with ignore_errors, invalid tokens yield None instead of raising.
     """
-    def __init__(self):
+    def __init__(self, mode='fernet', key_version=1, cache_ttl=0, cache_size=4096, key_dir=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown encryption mode '{mode}', expected one of {MODES}")
+        if isinstance(key_version, bool) or not isinstance(key_version, int) or not 1 <= key_version <= MAX_KEY_VERSION:
+            raise ValueError(f"encryption.key_version must be an integer from 1 to {MAX_KEY_VERSION}, got {key_version!r}")
+        self.mode = mode
+        self.key_version = key_version
+        self.key_dir = key_dir or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.timings = None
+        self._cache = OrderedDict()  # token -> (expiry, plaintext)
+        self._cache_lock = threading.Lock()
+
         # Generate or load key
-        self.key = self._get_or_create_key()
+        self.key = self._get_or_create_key(key_version)
+        self._keys = {key_version: self.key}
+        for version in range(1, key_version):
+            if os.path.exists(self._key_file(version)):
+                self._keys[version] = self._get_or_create_key(version)
         self.cipher_suite = Fernet(self.key)
+        # MultiFernet encrypts with the first key and decrypts with any of them
+        self._fernet = MultiFernet([Fernet(key) for _, key in sorted(self._keys.items(), reverse=True)])
+        self._aead = {}  # (mode, version) -> cipher
 
-    def _get_or_create_key(self):
-        key_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), "encryption.key")
+    @classmethod
+    def from_config(cls, config_data):
+        settings = config_data.get('encryption', {})
+        return cls(
+            mode=settings.get('mode', 'fernet'),
+            key_version=settings.get('key_version', 1),
+            cache_ttl=settings.get('cache_ttl', 0),
+            cache_size=settings.get('cache_size', 4096),
+            key_dir=settings.get('key_dir'),
+        )
+
+    def _key_file(self, version):
+        name = "encryption.key" if version == 1 else f"encryption.v{version}.key"
+        return os.path.join(self.key_dir, name)
+
+    def _get_or_create_key(self, version=1):
+        key_file = self._key_file(version)
         if os.path.exists(key_file):
             with open(key_file, "rb") as f:
                 return f.read()
@@ -43,8 +107,115 @@ class EncryptionManager:
                 f.write(key)
             return key
 
+    def _aead_cipher(self, mode, version):
+        cipher = self._aead.get((mode, version))
+        if cipher is None:
+            if version not in self._keys:
+                raise InvalidToken(f"Unknown key version {version}")
+            # Derive a separate key per cipher so the same secret is never used by two algorithms
+            derived = HKDF(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=None,
+                info=f"mqtt-monitor {mode} v{version}".encode(),
+            ).derive(base64.urlsafe_b64decode(self._keys[version]))
+            cipher = self._aead[(mode, version)] = AEAD_MODES[mode][1](derived)
+        return cipher
+
+    def _encrypt_aead(self, data, nonce):
+        mode_id = AEAD_MODES[self.mode][0]
+        cipher = self._aead_cipher(self.mode, self.key_version)
+        return bytes((mode_id, self.key_version)) + nonce + cipher.encrypt(nonce, data, None)
+
+    def _decrypt_token(self, encrypted_message):
+        if isinstance(encrypted_message, str):
+            encrypted_message = encrypted_message.encode()
+        mode = AEAD_MODE_IDS.get(encrypted_message[0]) if encrypted_message else None
+        if mode is None:
+            return self._fernet.decrypt(encrypted_message)
+        if len(encrypted_message) < HEADER_SIZE:
+            raise InvalidToken("Truncated token")
+        cipher = self._aead_cipher(mode, encrypted_message[1])
+        try:
+            return cipher.decrypt(encrypted_message[2:HEADER_SIZE], encrypted_message[HEADER_SIZE:], None)
+        except Exception as e:
+            raise InvalidToken(str(e)) from e
+
+    def _encrypt(self, message):
+        data = message.encode() if isinstance(message, str) else message
+        if self.mode == 'fernet':
+            return self._fernet.encrypt(data)
+        return self._encrypt_aead(data, os.urandom(NONCE_SIZE))
+
     def encrypt(self, message: str) -> bytes:
-        return self.cipher_suite.encrypt(message.encode())
+        timings = self.timings
+        if timings is None:
+            return self._encrypt(message)
+        start = time.perf_counter()
+        token = self._encrypt(message)
+        timings.observe(time.perf_counter() - start, 'encrypt')
+        return token
 
     def decrypt(self, encrypted_message: bytes) -> str:
-        return self.cipher_suite.decrypt(encrypted_message).decode()
+        return self.decrypt_bytes(encrypted_message).decode()
+
+    def decrypt_bytes(self, encrypted_message: bytes) -> bytes:
+        timings = self.timings
+        if timings is None:
+            return self._decrypt(encrypted_message)
+        start = time.perf_counter()
+        message = self._decrypt(encrypted_message)
+        timings.observe(time.perf_counter() - start, 'decrypt')
+        return message
+
+    def _decrypt(self, encrypted_message):
+        if not self.cache_ttl:
+            return self._decrypt_token(encrypted_message)
+
+        # Retained and re-delivered messages carry the identical token, so decrypt them once
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._cache.get(encrypted_message)
+            if cached is not None and cached[0] > now:
+                self._cache.move_to_end(encrypted_message)
+                self.cache_hits += 1
+                return cached[1]
+        message = self._decrypt_token(encrypted_message)
+        with self._cache_lock:
+            self._cache[encrypted_message] = (now + self.cache_ttl, message)
+            self._cache.move_to_end(encrypted_message)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return message
+
+    def encrypt_many(self, messages):
+        timings = self.timings
+        if timings is None or not messages:
+            return self._encrypt_many(messages)
+        start = time.perf_counter()
+        tokens = self._encrypt_many(messages)
+        # One observation per message at the batch average, without timing each one
+        timings.observe((time.perf_counter() - start) / len(messages), 'encrypt', count=len(messages))
+        return tokens
+
+    def _encrypt_many(self, messages):
+        data = [message.encode() if isinstance(message, str) else message for message in messages]
+        if self.mode == 'fernet':
+            return [self._fernet.encrypt(item) for item in data]
+        # One urandom call for all nonces instead of one per message
+        nonces = os.urandom(NONCE_SIZE * len(data))
+        return [
+            self._encrypt_aead(item, nonces[i * NONCE_SIZE:(i + 1) * NONCE_SIZE])
+            for i, item in enumerate(data)
+        ]
+
+    def decrypt_many(self, encrypted_messages, ignore_errors=False):
+        results = []
+        for encrypted_message in encrypted_messages:
+            try:
+                results.append(self.decrypt(encrypted_message))
+            except Exception:
+                if not ignore_errors:
+                    raise
+                results.append(None)
+        return results
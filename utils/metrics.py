@@ -0,0 +1,135 @@
+from bisect import bisect_left
+import time
+
+# Latency buckets in seconds, from 10 µs (a cached decrypt) up to 10 s (a stalled pipeline)
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    """Monotonic counter; inc('a', 'b') increments the child with those label values."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        # Deliberately lock-free: a lost increment under a thread race is cheaper than a lock per message
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Gauge(Counter):
+    """Value that can go up and down; set() replaces it."""
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels, count=1):
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        child[bisect_left(self.buckets, value)] += count
+        child[-1] += value * count
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        for labels, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                yield self.name + "_bucket", _format_labels(self.labelnames + ('le',), labels + (le,)), cumulative
+            yield self.name + "_sum", _format_labels(self.labelnames, labels), child[-1]
+            yield self.name + "_count", _format_labels(self.labelnames, labels), cumulative
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+class MetricsRegistry:
+    """
+    Holds a process's metrics and renders them for GET /metrics.
+    Hot paths only touch counters and histograms (a dict lookup and an add). Values that components
+    already track, such as queue depth or reconnect counts, are read by collectors at scrape time
+    instead of being updated per message.
+    """
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(self.prefix + name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(self.prefix + name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help_text, labelnames, buckets))
+
+    def collector(self, name, stats_fn):
+        """Exports every numeric value of stats_fn() as gauge <prefix><name>_<key> at scrape time."""
+        self._collectors.append((self.prefix + name, stats_fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        for name, stats_fn in self._collectors:
+            try:
+                stats = stats_fn() or {}
+            except Exception as e:
+                print(f"Error collecting {name} metrics: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {name}_{key} gauge")
+                    lines.append(f"{name}_{key} {value}")
+        return "\n".join(lines) + "\n"
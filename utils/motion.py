@@ -0,0 +1,166 @@
+"""
+Motion event aggregation and alert debouncing.
+
+A busy motion sensor reports every tick. Instead of one MQTT message, dashboard event and alert
+per detection, motion is merged into a window per sensor that opens with the first detection and
+closes window seconds later. A closed window is published once as a summary (first seen, last
+seen, count, detections during alarm hours).
+
+Alerts are raised from the detections as they arrive, so they are not delayed by the window, but:
+- a room's alert waits until its open windows hold alert_min_events alarm-hours detections, so a
+  single spurious trigger doesn't raise one, and
+- after an alert a room stays quiet for alert_cooldown seconds; the detections it would have
+  alerted on are counted and reported with the next alert.
+"""
+import asyncio
+import json
+import threading
+import time
+
+class MotionWindow:
+    __slots__ = ('room', 'sensor_id', 'topic', 'first', 'last', 'count', 'alarms')
+
+    def __init__(self, room, sensor_id, topic, timestamp):
+        self.room = room
+        self.sensor_id = sensor_id
+        self.topic = topic
+        self.first = self.last = timestamp
+        self.count = 0
+        self.alarms = 0
+
+    def summary(self):
+        return {'room': self.room, 'sensor': self.sensor_id, 'first': self.first, 'last': self.last,
+                'count': self.count, 'alarms': self.alarms}
+
+    def to_json(self):
+        return json.dumps(self.summary())
+
+def parse_summary(text):
+    """Returns the summary dict of a motion summary payload, or None for a single-detection payload."""
+    if not text.startswith('{'):
+        return None
+    return json.loads(text)
+
+class MotionAggregator:
+    """
+    Attributes:
+        on_close (callable): Called with a list of closed MotionWindows, from the aggregator's tick.
+        window (float): Seconds a sensor's window stays open after its first detection.
+        alert_cooldown (float): Minimum seconds between alerts for one room.
+        alert_min_events (int): Alarm-hours detections a room needs in its open windows before it alerts.
+        interval (float): Seconds between checks for windows to close.
+        suppressed_alerts (int): Alerts not raised because of the cooldown.
+    """
+    def __init__(self, on_close, window=10.0, alert_cooldown=60.0, alert_min_events=1, interval=1.0):
+        self.on_close = on_close
+        self.window = window
+        self.alert_cooldown = alert_cooldown
+        self.alert_min_events = max(1, int(alert_min_events))
+        self.interval = interval
+        self.events = 0
+        self.windows = 0
+        self.alerts = 0
+        self.suppressed_alerts = 0
+        self._open = {}  # sensor topic -> MotionWindow
+        self._room_alarms = {}  # room -> alarm-hours detections not yet covered by an alert
+        self._last_alert = {}  # room -> timestamp of its last alert
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config_data, on_close):
+        """Returns None when rules.motion.window is 0 or missing, meaning every detection is sent on its own."""
+        settings = config_data.get('rules', {}).get('motion', {})
+        if not settings.get('window'):
+            return None
+        return cls(
+            on_close,
+            window=settings['window'],
+            alert_cooldown=settings.get('alert_cooldown', 60.0),
+            alert_min_events=settings.get('alert_min_events', 1),
+            interval=min(1.0, settings['window']),
+        )
+
+    def add(self, room, sensor_id, topic, timestamp, alarm):
+        """
+        Records one detection. Returns (opened, alert): whether it opened a new window (the first
+        detection since the sensor's last window closed), and 0 or the number of alarm-hours
+        detections the alert raised now should report.
+        """
+        with self._lock:
+            self.events += 1
+            window = self._open.get(topic)
+            opened = window is None
+            if opened:
+                window = self._open[topic] = MotionWindow(room, sensor_id, topic, timestamp)
+                self.windows += 1
+            window.count += 1
+            window.last = max(window.last, timestamp)
+            if not alarm:
+                return opened, 0
+            window.alarms += 1
+            pending = self._room_alarms[room] = self._room_alarms.get(room, 0) + 1
+            if pending < self.alert_min_events:
+                return opened, 0
+            last_alert = self._last_alert.get(room)
+            if last_alert is not None and timestamp - last_alert < self.alert_cooldown:
+                self.suppressed_alerts += 1
+                return opened, 0
+            self._last_alert[room] = timestamp
+            self._room_alarms[room] = 0
+            self.alerts += 1
+            return opened, pending
+
+    def close_expired(self, now=None):
+        """Closes the windows that have been open for window seconds and hands them to on_close."""
+        now = time.time() if now is None else now
+        with self._lock:
+            closed = [window for window in self._open.values() if now - window.first >= self.window]
+            for window in closed:
+                del self._open[window.topic]
+            if closed:
+                # Detections below alert_min_events only count while the room has an open window
+                open_rooms = {window.room for window in self._open.values()}
+                for room in {window.room for window in closed} - open_rooms:
+                    self._room_alarms.pop(room, None)
+        if closed:
+            try:
+                self.on_close(closed)
+            except Exception as e:
+                print(f"Error publishing {len(closed)} motion summaries: {e}")
+        return closed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.close_expired()
+
+    async def run_async(self):
+        self._stop.clear()
+        while not self._stop.is_set():
+            await asyncio.sleep(self.interval)
+            self.close_expired()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="motion-aggregator")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stops the tick and publishes every window still open."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        self.close_expired(float('inf'))
+
+    def stats(self):
+        return {
+            'events': self.events,
+            'windows': self.windows,
+            'open_windows': len(self._open),
+            'alerts': self.alerts,
+            'suppressed_alerts': self.suppressed_alerts,
+        }
@@ -0,0 +1,307 @@
+"""
+Durable outbox for messages produced while the broker is unreachable.
+
+Messages (topic and encrypted payload, which carries the reading's original timestamp) are
+appended to memory-mapped segment files of a fixed size under one directory. A new segment is
+started when the current one is full. Each record is framed as
+    mark (0xA5), CRC-32 of topic + payload, payload length (uint32), topic length (uint16), topic, payload
+so after a crash the readable data ends at the first record whose mark or CRC doesn't match.
+
+Once connected, the backlog is drained oldest first, in batches paced to drain_rate messages per
+second, while new readings are published directly. A batch stops at the first message the client
+did not accept (e.g. the connection dropped mid-batch), and only the messages before it are
+committed: the position reached is saved to a cursor file, and segments that have been fully
+drained are deleted. A crash between publishing a batch and saving the cursor re-sends that batch
+(at-least-once).
+"""
+import asyncio
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+MARK = 0xA5
+RECORD = struct.Struct('>BIIH')
+CURSOR = 'cursor'
+
+def _segment_name(number):
+    return f"segment-{number:08d}.log"
+
+class _Segment:
+    def __init__(self, path, number, size=None):
+        if size is not None:
+            # New segment: preallocate so appends are plain memory writes
+            self.file = open(path, 'w+b')
+            self.file.truncate(size)
+        else:
+            self.file = open(path, 'r+b')
+        self.path = path
+        self.number = number
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.size = len(self.map)
+
+    def read(self, offset):
+        """Returns (topic, payload, next offset), or None at the end of the written data."""
+        if offset + RECORD.size > self.size:
+            return None
+        mark, crc, length, topic_length = RECORD.unpack_from(self.map, offset)
+        start = offset + RECORD.size
+        end = start + topic_length + length
+        if mark != MARK or end > self.size:
+            return None
+        body = self.map[start:end]
+        if zlib.crc32(body) != crc:
+            return None
+        return body[:topic_length].decode(), body[topic_length:], end
+
+    def count(self, offset=0):
+        """Returns (records from offset to the end of the written data, end offset)."""
+        records = 0
+        while True:
+            record = self.read(offset)
+            if record is None:
+                return records, offset
+            records += 1
+            offset = record[2]
+
+    def close(self, remove=False):
+        self.map.close()
+        self.file.close()
+        if remove:
+            os.remove(self.path)
+
+class Outbox:
+    """
+    Attributes:
+        directory (str): Where segment files and the cursor are kept.
+        segment_size (int): Bytes per segment file; also the largest message that fits.
+        max_bytes (int): Disk budget. When a new segment would exceed it, the oldest segment is
+            discarded and its undrained messages are counted in dropped.
+        drain_rate (float): Messages per second published from the backlog once connected.
+        drain_batch (int): Messages read, published and committed together.
+        sync_interval (float): Seconds between flushes of the current segment to disk.
+        pending (int): Messages waiting to be drained.
+    """
+    def __init__(self, directory, segment_size=4 * 1024 * 1024, max_bytes=256 * 1024 * 1024,
+                 drain_rate=500, drain_batch=100, sync_interval=1.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max(max_bytes, segment_size)
+        self.drain_rate = drain_rate
+        self.drain_batch = drain_batch
+        self.sync_interval = sync_interval
+        self.appended = 0
+        self.drained = 0
+        self.dropped = 0
+        self.pending = 0
+        self._segments = {}  # number -> _Segment, oldest first
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    @classmethod
+    def from_config(cls, config_data):
+        """Returns None unless outbox.enabled is set, meaning messages published offline are only buffered in memory."""
+        settings = config_data.get('outbox', {})
+        if not settings.get('enabled', False):
+            return None
+        return cls(
+            settings.get('directory', 'data/outbox'),
+            segment_size=settings.get('segment_size', 4 * 1024 * 1024),
+            max_bytes=settings.get('max_bytes', 256 * 1024 * 1024),
+            drain_rate=settings.get('drain_rate', 500),
+            drain_batch=settings.get('drain_batch', 100),
+            sync_interval=settings.get('sync_interval', 1.0),
+        )
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _recover(self):
+        numbers = sorted(
+            int(name[len('segment-'):-len('.log')]) for name in os.listdir(self.directory)
+            if name.startswith('segment-') and name.endswith('.log')
+        )
+        read_number, read_offset = numbers[0] if numbers else 1, 0
+        try:
+            with open(self._path(CURSOR)) as f:
+                read_number, read_offset = (int(part) for part in f.read().split())
+        except (OSError, ValueError):
+            pass
+        for number in numbers:
+            path = self._path(_segment_name(number))
+            if number < read_number:
+                os.remove(path)  # drained before the last shutdown
+            else:
+                self._segments[number] = _Segment(path, number)
+        if read_number not in self._segments:
+            # The cursor's segment is gone: start from the oldest one left
+            read_number, read_offset = (next(iter(self._segments)) if self._segments else read_number), 0
+        self._read = (read_number, read_offset)
+        if not self._segments:
+            self._open_segment(read_number)
+            self._write_offset = 0
+        else:
+            for number, segment in self._segments.items():
+                self.pending += segment.count(read_offset if number == read_number else 0)[0]
+            # Appends continue after the last intact record of the newest segment
+            self._write_offset = self._writer.count()[1]
+        if self.pending:
+            print(f"Outbox: {self.pending} messages waiting from a previous run")
+
+    @property
+    def _writer(self):
+        return self._segments[next(reversed(self._segments))]
+
+    def _open_segment(self, number):
+        self._segments[number] = _Segment(self._path(_segment_name(number)), number, self.segment_size)
+
+    def _rotate(self):
+        self._writer.map.flush()
+        self._open_segment(self._writer.number + 1)
+        self._write_offset = 0
+        while len(self._segments) * self.segment_size > self.max_bytes:
+            # Every segment left is at or after the cursor, since drained ones are deleted
+            oldest = self._segments.pop(next(iter(self._segments)))
+            read_number, read_offset = self._read
+            lost = oldest.count(read_offset if oldest.number == read_number else 0)[0]
+            self.dropped += lost
+            self.pending -= lost
+            oldest.close(remove=True)
+            if oldest.number == read_number:
+                self._read = (next(iter(self._segments)), 0)
+                self._save_cursor()
+            print(f"Outbox full: discarded {lost} oldest messages")
+
+    def append(self, topic, payload):
+        """Stores one message; raises ValueError if it is larger than a segment."""
+        topic = topic.encode()
+        body = topic + payload
+        size = RECORD.size + len(body)
+        if size > self.segment_size:
+            raise ValueError(f"Message of {size} bytes does not fit in a {self.segment_size} byte outbox segment")
+        with self._lock:
+            if self._write_offset + size > self._writer.size:
+                self._rotate()
+            segment, offset = self._writer, self._write_offset
+            # Body before header, so a record is only readable once it is complete
+            segment.map[offset + RECORD.size:offset + size] = body
+            RECORD.pack_into(segment.map, offset, MARK, zlib.crc32(body), len(payload), len(topic))
+            self._write_offset = offset + size
+            self.appended += 1
+            self.pending += 1
+
+    def _read_batch(self, limit):
+        """Returns up to limit (topic, payload, position after the message) from the oldest undrained message."""
+        batch = []
+        number, offset = self._read
+        while len(batch) < limit:
+            record = self._segments[number].read(offset)
+            if record is None:
+                later = [n for n in self._segments if n > number]
+                if not later:
+                    break
+                number, offset = later[0], 0
+                continue
+            topic, payload, offset = record
+            batch.append((topic, payload, (number, offset)))
+        return batch
+
+    def _save_cursor(self):
+        temporary = self._path(CURSOR + '.tmp')
+        with open(temporary, 'w') as f:
+            f.write(f"{self._read[0]} {self._read[1]}")
+        os.replace(temporary, self._path(CURSOR))
+
+    def drain(self, publish):
+        """
+        Publishes one batch of the backlog with publish(topic, payload), which returns True once the
+        message is handed to the client. Stops at the first message that isn't, so it stays in the
+        outbox; returns how many were sent.
+        """
+        with self._lock:
+            start = self._read
+            batch = self._read_batch(self.drain_batch)
+        sent, position = 0, start
+        for topic, payload, after in batch:
+            if not publish(topic, payload):
+                break
+            sent, position = sent + 1, after
+        if not sent:
+            return 0
+        with self._lock:
+            if self._read != start:
+                # The batch's segment was discarded for space while publishing; it is already counted as dropped
+                return sent
+            self._read = position
+            self.pending -= sent
+            self.drained += sent
+            for number in [n for n in self._segments if n < position[0]]:
+                self._segments.pop(number).close(remove=True)
+            self._save_cursor()
+        return sent
+
+    def sync(self):
+        with self._lock:
+            self._writer.map.flush()
+
+    def _step(self, publish, connected):
+        """Drains one batch if possible; returns the seconds to wait before the next step."""
+        sent = self.drain(publish) if self.pending and connected() else 0
+        now = time.monotonic()
+        if now - self._last_sync >= self.sync_interval:
+            self.sync()
+            self._last_sync = now
+        # Pace the backlog to drain_rate; poll slowly while idle or offline
+        return sent / self.drain_rate if sent else min(0.5, self.sync_interval)
+
+    def _run(self, publish, connected):
+        self._last_sync = time.monotonic()
+        wait = 0
+        while not self._stop.wait(wait):
+            try:
+                wait = self._step(publish, connected)
+            except Exception as e:
+                print(f"Error draining outbox: {e}")
+                wait = 1.0
+
+    async def run_async(self, publish, connected):
+        self._last_sync = time.monotonic()
+        self._stop.clear()
+        while not self._stop.is_set():
+            try:
+                wait = self._step(publish, connected)
+            except Exception as e:
+                print(f"Error draining outbox: {e}")
+                wait = 1.0
+            await asyncio.sleep(wait)
+
+    def start(self, publish, connected):
+        """Drains on a background thread: publish(topic, payload) -> bool while connected() is true."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(publish, connected), name="outbox-drain")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        with self._lock:
+            for segment in self._segments.values():
+                segment.map.flush()
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'appended': self.appended,
+            'drained': self.drained,
+            'dropped': self.dropped,
+            'segments': len(self._segments),
+        }
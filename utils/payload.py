@@ -0,0 +1,97 @@
+"""
+Plaintext formats of sensor readings inside the encrypted MQTT payload.
+
+Text (the original format): one reading per message, its value optionally followed by '@' and the
+wall-clock time it was produced, e.g. "24.53@1700000000.123456". Receivers use the timestamp for
+end-to-end latency; payloads without one (older publishers) still decode, with a timestamp of None.
+
+Binary envelope (mqtt.payload.format "binary"): many readings per message, published to the
+room-level topic <base>/<room>. Layout, big-endian:
+    header   magic 0x00, version, base timestamp (float64), sensor name count (uint16)
+    names    per sensor: length (uint8) + UTF-8 sensor id
+    records  per reading: sensor index (uint16), milliseconds after the base timestamp (uint32),
+             value (float32), kind and flags (uint8)
+Text payloads never start with a NUL byte, so receivers tell the formats apart from the first
+byte and accept both.
+"""
+from collections import namedtuple
+import struct
+
+SEPARATOR = '@'
+
+MAGIC = 0x00
+VERSION = 1
+HEADER = struct.Struct('>BBdH')
+RECORD = struct.Struct('>HIfB')
+
+KIND_TEMPERATURE = 0
+KIND_MOTION = 1
+KIND_MASK = 0x0F
+FLAG_ALARM = 0x10
+
+# value is a float; flags holds the FLAG_* bits without the kind
+Record = namedtuple('Record', ['sensor_id', 'kind', 'value', 'timestamp', 'flags'])
+
+def encode_reading(value, timestamp=None):
+    if timestamp is None:
+        return f"{value}"
+    return f"{value}{SEPARATOR}{timestamp:.6f}"
+
+def decode_reading(text):
+    """Returns (value text, timestamp or None)."""
+    value, sep, timestamp = text.partition(SEPARATOR)
+    return value, float(timestamp) if sep else None
+
+def is_envelope(data):
+    return bool(data) and data[0] == MAGIC
+
+def encode_envelope(records):
+    """Packs Records (at most 65535 distinct sensors, spanning under 49 days) into one envelope."""
+    base = min(record.timestamp for record in records)
+    names = {}
+    packed = []
+    for record in records:
+        index = names.setdefault(record.sensor_id, len(names))
+        packed.append(RECORD.pack(index, int((record.timestamp - base) * 1000), record.value,
+                                  (record.kind & KIND_MASK) | record.flags))
+    parts = [HEADER.pack(MAGIC, VERSION, base, len(names))]
+    for name in names:
+        encoded = name.encode()
+        if len(encoded) > 255:
+            raise ValueError(f"Sensor id longer than 255 bytes: {name[:32]}...")
+        parts.append(bytes((len(encoded),)) + encoded)
+    parts.extend(packed)
+    return b''.join(parts)
+
+def decode_envelope(data):
+    """Returns the list of Records in an envelope; raises ValueError if it is malformed."""
+    try:
+        magic, version, base, name_count = HEADER.unpack_from(data)
+    except struct.error as e:
+        raise ValueError(f"Truncated envelope: {e}") from e
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported envelope version {version}")
+    offset = HEADER.size
+    names = []
+    for _ in range(name_count):
+        if offset >= len(data):
+            raise ValueError("Truncated envelope names")
+        length = data[offset]
+        end = offset + 1 + length
+        if end > len(data):
+            raise ValueError("Truncated envelope names")
+        try:
+            names.append(bytes(data[offset + 1:end]).decode())
+        except UnicodeDecodeError as e:
+            raise ValueError(f"Invalid envelope sensor name: {e}") from e
+        offset = end
+    body = memoryview(data)[offset:]
+    if len(body) % RECORD.size:
+        raise ValueError("Truncated envelope records")
+    records = []
+    for index, millis, value, flags in RECORD.iter_unpack(body):
+        if index >= name_count:
+            raise ValueError(f"Envelope record refers to sensor {index} of {name_count}")
+        # float32 turns 24.53 into 24.530000686...; rounding restores what was sent
+        records.append(Record(names[index], flags & KIND_MASK, round(value, 4), base + millis / 1000, flags & ~KIND_MASK))
+    return records
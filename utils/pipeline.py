@@ -0,0 +1,155 @@
+from collections import deque
+import threading
+
+POLICIES = ('drop_oldest', 'block')
+
+class MessagePipeline:
+    """
+    Bounded queue between the MQTT network thread and a pool of worker threads.
+    Attributes:
+        handler (callable): Called as handler(topic, payload) on a worker thread.
+        key (callable): Maps a topic to its partition, e.g. the room of a per-sensor topic;
+            None partitions by topic.
+        workers (int): Number of worker threads; 0 runs the handler inline in submit(), e.g. on
+            the event loop in the asyncio runtime.
+        max_queue (int): Maximum number of messages waiting across all partitions.
+        policy (str): What submit() does when the queue is full:
+            'drop_oldest' discards the oldest waiting message of the same partition (or the oldest
+            waiting message overall if that partition has none queued); 'block' waits for space,
+            or drops the new message while the workers aren't running (before start() or after
+            stop()), since nothing would make space.
+    Messages of one partition are never handled by two workers at once, so with a partition per
+    room a room's readings are processed in the order they were received, whichever sensor sent
+    them, while different rooms run in parallel.
+    """
+    def __init__(self, handler, workers=4, max_queue=10000, policy='drop_oldest', key=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}', expected one of {POLICIES}")
+        if max_queue < 1:
+            raise ValueError(f"pipeline.max_queue must be at least 1, got {max_queue}")
+        self.handler = handler
+        self.key = key
+        self.workers = workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._queues = {}  # partition -> deque of (topic, payload)
+        self._ready = deque()  # partitions with queued messages that no worker is handling
+        self._busy = set()
+        self._depth = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._threads = []
+        self._running = False
+
+    def _drop_oldest(self, partition):
+        victim = partition if self._queues.get(partition) else None
+        if victim is None:
+            if self._ready:
+                victim = self._ready[0]
+            else:
+                # Everything queued belongs to partitions that are currently being processed
+                victim = next(p for p, queue in self._queues.items() if queue)
+        queue = self._queues[victim]
+        queue.popleft()
+        self._depth -= 1
+        self.dropped += 1
+        if not queue and victim not in self._busy:
+            self._ready.remove(victim)
+
+    def submit(self, topic, payload):
+        """Queues a raw message; called from the MQTT on_message callback."""
+        if not self.workers:
+            self.enqueued += 1
+            try:
+                self.handler(topic, payload)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error processing message on {topic}: {e}")
+            self.processed += 1
+            return
+        partition = self.key(topic) if self.key else topic
+        with self._lock:
+            if self._depth >= self.max_queue:
+                if self.policy == 'block':
+                    while self._running and self._depth >= self.max_queue:
+                        self._not_full.wait()
+                    if self._depth >= self.max_queue:
+                        self.dropped += 1
+                        return
+                else:
+                    self._drop_oldest(partition)
+            queue = self._queues.get(partition)
+            if queue is None:
+                queue = self._queues[partition] = deque()
+            if not queue and partition not in self._busy:
+                self._ready.append(partition)
+            queue.append((topic, payload))
+            self._depth += 1
+            self.enqueued += 1
+            if self._depth > self.max_depth:
+                self.max_depth = self._depth
+            self._not_empty.notify()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while self._running and not self._ready:
+                    self._not_empty.wait()
+                if not self._running:
+                    return
+                partition = self._ready.popleft()
+                topic, payload = self._queues[partition].popleft()
+                self._busy.add(partition)
+                self._depth -= 1
+                self._not_full.notify()
+            try:
+                self.handler(topic, payload)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"Error processing message on {topic}: {e}")
+            with self._lock:
+                self._busy.discard(partition)
+                self.processed += 1
+                if self._queues[partition]:
+                    self._ready.append(partition)
+                    self._not_empty.notify()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"pipeline-worker-{i}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=2):
+        with self._lock:
+            self._running = False
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'policy': self.policy,
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'depth': self._depth,
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'errors': self.errors,
+            }
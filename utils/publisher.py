@@ -0,0 +1,170 @@
+from collections import namedtuple
+from utils.topics import load_topics, sensor_topic
+import asyncio
+import heapq
+import random
+import threading
+import time
+
+# A single simulated sample; timestamp is wall-clock seconds taken when the batch was generated
+Reading = namedtuple('Reading', ['sensor', 'value', 'timestamp'])
+
+class Sensor:
+    __slots__ = ('sensor_id', 'room', 'type', 'interval', 'topic', 'params')
+
+    def __init__(self, sensor_id, room, sensor_type, interval, topic, params=None):
+        self.sensor_id = sensor_id
+        self.room = room
+        self.type = sensor_type
+        self.interval = interval
+        self.topic = topic
+        self.params = params or {}
+
+    def __repr__(self):
+        return f"Sensor({self.room}/{self.sensor_id}, {self.type}, every {self.interval}s)"
+
+def simulate_temperature(sensor):
+    return round(random.uniform(sensor.params.get('min', 20), sensor.params.get('max', 30)), 2)
+
+def simulate_motion(sensor):
+    # None means "nothing to report" for this tick
+    return True if random.random() < sensor.params.get('probability', 0.5) else None
+
+SIMULATORS = {
+    'temperature': simulate_temperature,
+    'motion': simulate_motion,
+}
+
+def load_sensors(config_data):
+    """
+    Builds the sensor inventory from the 'sensors' section of config.json.
+    - 'rooms' lists rooms explicitly, each with its own sensors (id, type, interval and simulator params).
+    - 'simulate' optionally expands into generated rooms with N sensors of each type, for load testing.
+    Each sensor publishes to <base topic for its type>/<room>/<sensor id>.
+    """
+    inventory = config_data.get('sensors', {})
+    topics = load_topics(config_data)
+    default_interval = float(inventory.get('default_interval', 5))
+    entries = []
+
+    for room in inventory.get('rooms', []):
+        for entry in room.get('sensors', []):
+            entries.append((room['name'], entry))
+
+    simulate = inventory.get('simulate', {})
+    for r in range(int(simulate.get('rooms', 0))):
+        room_name = f"sim-room-{r + 1}"
+        for sensor_type in SIMULATORS:
+            for n in range(int(simulate.get(f'{sensor_type}_per_room', 0))):
+                entries.append((room_name, {
+                    'id': f"{sensor_type}-{n + 1}",
+                    'type': sensor_type,
+                    'interval': simulate.get('interval', default_interval),
+                }))
+
+    sensors = []
+    for room_name, entry in entries:
+        sensor_type = entry['type']
+        if sensor_type not in SIMULATORS:
+            raise ValueError(f"Unknown sensor type '{sensor_type}' for sensor {entry.get('id')}")
+        interval = float(entry.get('interval', default_interval))
+        if interval <= 0:
+            raise ValueError(f"Sensor {entry.get('id')} must have a positive interval")
+        params = {k: v for k, v in entry.items() if k not in ('id', 'type', 'interval')}
+        sensors.append(Sensor(
+            entry['id'],
+            room_name,
+            sensor_type,
+            interval,
+            sensor_topic(topics[sensor_type].topic, room_name, entry['id']),
+            params,
+        ))
+    return sensors
+
+class SensorPublisher:
+    """
+    Deadline-based scheduler that generates readings for many sensors and hands them to a publish
+    callback in batches.
+    Attributes:
+        sensors (list[Sensor]): The sensor inventory being simulated.
+        publish_batch (callable): Called with a list of Reading tuples that are due.
+        batch_size (int): Maximum number of readings handed to publish_batch at once.
+        published (int): Total readings handed to publish_batch successfully.
+        skipped_deadlines (int): Times a sensor fell a full interval behind and was rescheduled.
+    Each sensor keeps an absolute deadline which advances by its interval, so publishing time does
+    not accumulate into drift the way a fixed sleep between iterations does.
+    """
+    def __init__(self, sensors, publish_batch, batch_size=500):
+        self.sensors = sensors
+        self.publish_batch = publish_batch
+        self.batch_size = batch_size
+        self.published = 0
+        self.errors = 0
+        self.skipped_deadlines = 0
+        self._schedule = []
+        self._stop = threading.Event()
+
+    def _build_schedule(self, now):
+        # Stagger first deadlines across each interval so large inventories don't all fire at once
+        count = len(self.sensors)
+        self._schedule = [
+            (now + sensor.interval * seq / count, seq, sensor)
+            for seq, sensor in enumerate(self.sensors)
+        ]
+        heapq.heapify(self._schedule)
+
+    def _flush(self, batch):
+        try:
+            self.publish_batch(batch)
+            self.published += len(batch)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error publishing batch of {len(batch)} readings: {e}")
+
+    def run_once(self, now=None):
+        """Publishes every reading due at 'now'; returns the monotonic time of the next deadline."""
+        now = time.monotonic() if now is None else now
+        timestamp = time.time()
+        schedule = self._schedule
+        batch = []
+        while schedule and schedule[0][0] <= now:
+            deadline, seq, sensor = schedule[0]
+            value = SIMULATORS[sensor.type](sensor)
+            if value is not None:
+                batch.append(Reading(sensor, value, timestamp))
+            deadline += sensor.interval
+            if deadline <= now:
+                # More than a whole interval behind: skip ahead rather than bursting to catch up
+                self.skipped_deadlines += 1
+                deadline = now + sensor.interval
+            heapq.heapreplace(schedule, (deadline, seq, sensor))
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        return schedule[0][0] if schedule else None
+
+    def run(self):
+        if not self.sensors:
+            print("No sensors configured, publisher idle")
+            return
+        self._stop.clear()
+        self._build_schedule(time.monotonic())
+        while not self._stop.is_set():
+            next_deadline = self.run_once()
+            self._stop.wait(max(0.0, next_deadline - time.monotonic()))
+
+    async def run_async(self):
+        """Same schedule as run(), sleeping on the event loop instead of a thread."""
+        if not self.sensors:
+            print("No sensors configured, publisher idle")
+            return
+        self._stop.clear()
+        self._build_schedule(time.monotonic())
+        while not self._stop.is_set():
+            next_deadline = self.run_once()
+            await asyncio.sleep(max(0.0, next_deadline - time.monotonic()))
+
+    def stop(self):
+        self._stop.set()
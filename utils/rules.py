@@ -0,0 +1,405 @@
+"""
+Cooling and alarm rules, compiled from config.json into NumPy arrays and evaluated in batch.
+
+Rules are compiled when the configuration changes (per-room thresholds, schedules and alarm
+windows become arrays indexed by room), so evaluating a batch of readings is a handful of array
+operations however many sensors it covers, instead of parsing times and branching per message.
+"""
+from datetime import time as dt_time
+import asyncio
+import math
+import numpy as np
+import threading
+import time
+
+def seconds_of_day(value):
+    """'HH:MM' or 'HH:MM:SS' -> seconds since midnight."""
+    parsed = dt_time.fromisoformat(value)
+    return parsed.hour * 3600 + parsed.minute * 60 + parsed.second
+
+def local_seconds_of_day(timestamps):
+    # One UTC offset per batch; a batch spanning a DST change is off by the change for one tick
+    timestamps = np.asarray(timestamps, dtype=float)
+    offset = time.localtime(float(timestamps[0])).tm_gmtoff if timestamps.size else 0
+    return np.floor(timestamps + offset) % 86400
+
+def in_window(seconds, start, end):
+    """Vectorized start <= t <= end, where windows with start > end wrap past midnight."""
+    return np.where(start <= end, (seconds >= start) & (seconds <= end), (seconds >= start) | (seconds <= end))
+
+class _RoomIndex:
+    """Maps room names (or other keys, e.g. (room, sensor) pairs) to array rows; rows are added the first time a key is seen."""
+    def __init__(self):
+        self.rows = {}
+
+    def lookup(self, rooms):
+        rows = self.rows
+        new = [room for room in rooms if room not in rows]
+        for room in new:
+            rows.setdefault(room, len(rows))
+        return np.fromiter((rows[room] for room in rooms), dtype=np.intp, count=len(rooms)), bool(new)
+
+def _grown(array, capacity, fill):
+    new = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+    new[:len(array)] = array
+    return new
+
+class CoolingRules:
+    """
+    Decides cooling ON/OFF per room from temperature readings.
+    Attributes:
+        threshold (float): Default threshold, e.g. temp_threshold from the config topic.
+        hysteresis (float): Once ON, cooling stays on until the temperature drops below threshold - hysteresis.
+        rate_per_minute (float): Turn cooling on when a sensor warms faster than this (°C per minute); 0 disables.
+        moving_average (int): Number of samples per sensor averaged before comparing to the threshold; 1 uses the raw reading.
+        rooms (dict): Per-room overrides, {room: {'threshold': ...}}.
+        schedules (list): Time-of-day thresholds, [{'start': 'HH:MM', 'end': 'HH:MM', 'threshold': ..., 'rooms': [...]}];
+            without 'rooms' a schedule applies to every room. Later entries win.
+    Thresholds and the ON state (hysteresis) are per room; the rate of change and moving average are
+    per sensor, since readings of different sensors in one room can't be compared as a series.
+    Each sensor keeps its latest level, and a room is compared against its threshold using its
+    warmest sensor (and is ON if any of its sensors is warming too fast), so a hot and a cool sensor
+    in one room don't toggle cooling on every reading.
+    Room and sensor state survives configure(), so changing the threshold doesn't reset cooling
+    that is already on.
+    """
+    SETTINGS = ('threshold', 'hysteresis', 'rate_per_minute', 'rooms', 'schedules')  # What configure() accepts
+
+    def __init__(self, threshold, hysteresis=0.0, rate_per_minute=0.0, moving_average=1, rooms=None, schedules=None):
+        self._lock = threading.Lock()
+        self._index = _RoomIndex()
+        self._sensor_index = _RoomIndex()  # (room, sensor id) -> row of the per-sensor arrays
+        self.moving_average = max(1, int(moving_average))
+        self._on = np.zeros(0, dtype=bool)
+        self._base = np.zeros(0)
+        self._capacity = 0
+        self._last_value = np.zeros(0)
+        self._last_ts = np.zeros(0)
+        self._level = np.zeros(0)  # latest (averaged) temperature per sensor
+        self._rising = np.zeros(0, dtype=bool)  # per sensor: warming faster than rate_per_minute
+        self._sensor_room = np.zeros(0, dtype=np.intp)  # sensor row -> room row
+        self._room_sensors = {}  # room row -> list of its sensor rows, for single readings
+        self._window = np.zeros((0, self.moving_average))
+        self._filled = np.zeros(0, dtype=np.intp)
+        self._sensor_capacity = 0
+        self.configure(threshold=threshold, hysteresis=hysteresis, rate_per_minute=rate_per_minute,
+                       rooms=rooms or {}, schedules=schedules or [])
+
+    @classmethod
+    def from_config(cls, config_data):
+        settings = config_data.get('rules', {}).get('cooling', {})
+        return cls(
+            config_data['default_settings']['temp_threshold'],
+            hysteresis=settings.get('hysteresis', 0.0),
+            rate_per_minute=settings.get('rate_per_minute', 0.0),
+            moving_average=settings.get('moving_average', 1),
+            rooms=settings.get('rooms'),
+            schedules=settings.get('schedules'),
+        )
+
+    def _grow(self, capacity):
+        self._on = _grown(self._on, capacity, False)
+        self._capacity = capacity
+
+    def _grow_sensors(self, capacity):
+        self._last_value = _grown(self._last_value, capacity, np.nan)
+        self._last_ts = _grown(self._last_ts, capacity, np.nan)
+        self._level = _grown(self._level, capacity, -np.inf)
+        self._rising = _grown(self._rising, capacity, False)
+        self._sensor_room = _grown(self._sensor_room, capacity, 0)
+        self._window = _grown(self._window, capacity, 0.0)
+        self._filled = _grown(self._filled, capacity, 0)
+        self._sensor_capacity = capacity
+
+    def configure(self, **settings):
+        """
+        Recompiles the rules; accepts any constructor argument except moving_average. Invalid
+        settings raise (e.g. ValueError for a bad time) and leave the current rules in place.
+        """
+        unknown = set(settings) - set(self.SETTINGS)
+        if unknown:
+            raise TypeError(f"Unknown cooling settings: {', '.join(sorted(unknown))}")
+        with self._lock:
+            merged = {key: getattr(self, key, None) for key in self.SETTINGS}
+            merged.update(settings)
+            merged['threshold'] = float(merged['threshold'])
+            merged['hysteresis'] = float(merged['hysteresis'])
+            merged['rate_per_minute'] = float(merged['rate_per_minute'])
+            # New rooms only add rows; their state stays at the defaults until a reading arrives
+            for room in merged['rooms']:
+                self._index.lookup([room])
+            for schedule in merged['schedules']:
+                self._index.lookup(schedule.get('rooms', []))
+            self._base, self._schedules = self._compiled(merged['threshold'], merged['rooms'], merged['schedules'])
+            for key, value in merged.items():
+                setattr(self, key, value)
+
+    def _compiled(self, threshold, rooms, schedules):
+        """Builds the threshold arrays for the given settings without installing them."""
+        if len(self._index.rows) > self._capacity:
+            self._grow(max(len(self._index.rows), self._capacity * 2))
+        base = np.full(self._capacity, threshold)
+        for room, overrides in rooms.items():
+            if 'threshold' in overrides:
+                base[self._index.rows[room]] = float(overrides['threshold'])
+        compiled = [
+            (
+                seconds_of_day(schedule['start']),
+                seconds_of_day(schedule['end']),
+                float(schedule['threshold']),
+                np.array([self._index.rows[room] for room in schedule['rooms']], dtype=np.intp)
+                if 'rooms' in schedule else None,
+                frozenset(self._index.rows[room] for room in schedule['rooms']) if 'rooms' in schedule else None,
+            )
+            for schedule in schedules
+        ]
+        return base, compiled
+
+    def _compile(self):
+        self._base, self._schedules = self._compiled(self.threshold, self.rooms, self.schedules)
+
+    def _thresholds(self, rows, seconds):
+        thresholds = self._base[rows]
+        for start, end, threshold, schedule_rows, _ in self._schedules:
+            active = in_window(seconds, start, end)
+            if schedule_rows is not None:
+                active &= np.isin(rows, schedule_rows)
+            thresholds = np.where(active, threshold, thresholds)
+        return thresholds
+
+    def _step(self, rows, sensor_rows, values, timestamps, seconds):
+        # rows are unique rooms here, so sensor_rows are unique too and fancy-indexed writes don't collide
+        if self.moving_average > 1:
+            position = self._filled[sensor_rows] % self.moving_average
+            self._window[sensor_rows, position] = values
+            self._filled[sensor_rows] += 1
+            samples = np.minimum(self._filled[sensor_rows], self.moving_average)
+            level = self._window[sensor_rows].sum(axis=1) / samples
+        else:
+            level = values
+        self._level[sensor_rows] = level
+        if self.rate_per_minute:
+            elapsed = timestamps - self._last_ts[sensor_rows]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rate = (values - self._last_value[sensor_rows]) / elapsed * 60.0
+            self._rising[sensor_rows] = np.nan_to_num(rate, nan=0.0, posinf=0.0, neginf=0.0) >= self.rate_per_minute
+        # Combine every sensor of these rooms: the warmest level, and whether any is rising
+        count = len(self._sensor_index.rows)
+        in_rooms = np.isin(self._sensor_room[:count], rows)
+        sensor_room = self._sensor_room[:count][in_rooms]
+        room_level = np.full(self._capacity, -np.inf)
+        np.maximum.at(room_level, sensor_room, self._level[:count][in_rooms])
+        level = room_level[rows]
+        thresholds = self._thresholds(rows, seconds)
+        on = np.where(self._on[rows], level > thresholds - self.hysteresis, level > thresholds)
+        if self.rate_per_minute:
+            rising = np.zeros(self._capacity, dtype=bool)
+            rising[sensor_room[self._rising[:count][in_rooms]]] = True
+            on |= rising[rows]
+        self._on[rows] = on
+        self._last_value[sensor_rows] = values
+        self._last_ts[sensor_rows] = timestamps
+        return on
+
+    def _threshold(self, row, seconds):
+        threshold = self._base[row]
+        for start, end, schedule_threshold, _, schedule_rows in self._schedules:
+            if schedule_rows is not None and row not in schedule_rows:
+                continue
+            if start <= seconds <= end if start <= end else seconds >= start or seconds <= end:
+                threshold = schedule_threshold
+        return threshold
+
+    def _step_one(self, row, sensor_row, value, timestamp):
+        """_step() for a single reading with Python scalars, which is several times faster than NumPy for one element."""
+        if self.moving_average > 1:
+            filled = int(self._filled[sensor_row])
+            self._window[sensor_row, filled % self.moving_average] = value
+            self._filled[sensor_row] = filled + 1
+            level = float(self._window[sensor_row].sum()) / min(filled + 1, self.moving_average)
+        else:
+            level = value
+        self._level[sensor_row] = level
+        room_sensors = self._room_sensors[row]
+        if self.rate_per_minute:
+            elapsed = timestamp - self._last_ts[sensor_row]
+            rate = (value - self._last_value[sensor_row]) / elapsed * 60.0 if elapsed else 0.0
+            self._rising[sensor_row] = (rate if math.isfinite(rate) else 0.0) >= self.rate_per_minute
+        level = max(self._level[sensor] for sensor in room_sensors)
+        offset = time.localtime(timestamp).tm_gmtoff
+        threshold = self._threshold(row, math.floor(timestamp + offset) % 86400)
+        on = bool(level > threshold - self.hysteresis if self._on[row] else level > threshold)
+        if self.rate_per_minute and not on:
+            on = any(self._rising[sensor] for sensor in room_sensors)
+        self._on[row] = on
+        self._last_value[sensor_row] = value
+        self._last_ts[sensor_row] = timestamp
+        return on
+
+    def _add_sensors(self, rows, sensor_rows):
+        self._sensor_room[sensor_rows] = rows
+        for row, sensor_row in zip(rows.tolist(), sensor_rows.tolist()):
+            sensors = self._room_sensors.setdefault(row, [])
+            if sensor_row not in sensors:
+                sensors.append(sensor_row)
+
+    def evaluate(self, rooms, values, timestamps, sensors=None):
+        """
+        Returns a boolean array, True where cooling should be ON after each reading.
+        sensors gives each reading's sensor id; without it every reading of a room counts as the
+        same sensor. Readings for the same room are applied in order; each pass handles at most one
+        reading per room, so a batch with one reading per room is a single vectorized pass. A single
+        reading (decision_interval 0) takes a scalar path with the same result.
+        """
+        if len(values) == 1:
+            return np.array([self.decide(rooms[0], values[0], timestamps[0], sensors[0] if sensors is not None else None)])
+        values = np.asarray(values, dtype=float)
+        timestamps = np.asarray(timestamps, dtype=float)
+        decisions = np.zeros(len(values), dtype=bool)
+        if not len(values):
+            return decisions
+        if sensors is None:
+            sensors = [None] * len(values)
+        with self._lock:
+            rows, added = self._index.lookup(rooms)
+            if added:
+                self._compile()
+            sensor_rows, new_sensors = self._sensor_index.lookup(list(zip(rooms, sensors)))
+            if len(self._sensor_index.rows) > self._sensor_capacity:
+                self._grow_sensors(max(len(self._sensor_index.rows), self._sensor_capacity * 2))
+            if new_sensors:
+                self._add_sensors(rows, sensor_rows)
+            seconds = local_seconds_of_day(timestamps)
+            remaining = np.arange(len(rows))
+            while remaining.size:
+                _, first = np.unique(rows[remaining], return_index=True)
+                take = remaining[first]
+                decisions[take] = self._step(rows[take], sensor_rows[take], values[take], timestamps[take], seconds[take])
+                remaining = np.delete(remaining, first)
+        return decisions
+
+    def decide(self, room, value, timestamp, sensor=None):
+        value, timestamp = float(value), float(timestamp)
+        with self._lock:
+            row = self._index.rows.get(room)
+            sensor_row = self._sensor_index.rows.get((room, sensor))
+            if row is None or sensor_row is None:
+                rows, added = self._index.lookup([room])
+                if added:
+                    self._compile()
+                sensor_rows, _ = self._sensor_index.lookup([(room, sensor)])
+                if len(self._sensor_index.rows) > self._sensor_capacity:
+                    self._grow_sensors(max(len(self._sensor_index.rows), self._sensor_capacity * 2))
+                self._add_sensors(rows, sensor_rows)
+                row, sensor_row = int(rows[0]), int(sensor_rows[0])
+            return self._step_one(row, sensor_row, value, timestamp)
+
+class AlarmRules:
+    """
+    Decides whether motion in a room falls within its alarm hours.
+    The default window comes from alarm_start/alarm_end/alarm_enabled in default_settings; rooms can
+    override it with {room: {'start': 'HH:MM', 'end': 'HH:MM', 'enabled': bool}}.
+    """
+    def __init__(self, enabled, start, end, rooms=None):
+        self._lock = threading.Lock()
+        self._index = _RoomIndex()
+        self.rooms = rooms or {}
+        self.configure(enabled, start, end)
+
+    @classmethod
+    def from_config(cls, config_data, settings=None):
+        settings = settings or config_data['default_settings']
+        return cls(settings['alarm_enabled'], settings['alarm_start'], settings['alarm_end'],
+                   rooms=config_data.get('rules', {}).get('alarm', {}).get('rooms'))
+
+    def configure(self, enabled, start, end, rooms=None):
+        """Recompiles the alarm windows; an invalid time raises and leaves the current ones in place."""
+        with self._lock:
+            enabled = bool(enabled)
+            rooms = self.rooms if rooms is None else rooms
+            self._index.lookup(list(rooms))
+            self._start, self._end, self._enabled = self._compiled(enabled, start, end, rooms)
+            self.enabled, self.start, self.end, self.rooms = enabled, start, end, rooms
+
+    def _compiled(self, enabled, start, end, rooms):
+        """Builds the per-room window arrays for the given settings without installing them."""
+        count = len(self._index.rows)
+        starts = np.full(count, seconds_of_day(start), dtype=float)
+        ends = np.full(count, seconds_of_day(end), dtype=float)
+        enabled_rows = np.full(count, enabled, dtype=bool)
+        for room, overrides in rooms.items():
+            row = self._index.rows[room]
+            if 'start' in overrides:
+                starts[row] = seconds_of_day(overrides['start'])
+            if 'end' in overrides:
+                ends[row] = seconds_of_day(overrides['end'])
+            if 'enabled' in overrides:
+                enabled_rows[row] = bool(overrides['enabled'])
+        return starts, ends, enabled_rows
+
+    def _compile(self):
+        self._start, self._end, self._enabled = self._compiled(self.enabled, self.start, self.end, self.rooms)
+
+    def evaluate(self, rooms, timestamps):
+        """Returns a boolean array, True where the motion at that time and room should raise an alert."""
+        if not len(rooms):
+            return np.zeros(0, dtype=bool)
+        with self._lock:
+            rows, added = self._index.lookup(rooms)
+            if added:
+                self._compile()
+            seconds = local_seconds_of_day(timestamps)
+            return self._enabled[rows] & in_window(seconds, self._start[rows], self._end[rows])
+
+class DecisionBatcher:
+    """
+    Collects readings from pipeline workers and evaluates them together every interval seconds.
+    Attributes:
+        decide (callable): Called with (rooms, values, timestamps, extras, sensors) lists for each non-empty batch.
+        interval (float): Seconds between batches.
+    """
+    def __init__(self, decide, interval=0.1):
+        self.decide = decide
+        self.interval = interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def submit(self, room, value, timestamp, extra=None, sensor=None):
+        with self._lock:
+            self._pending.append((room, value, timestamp, extra, sensor))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            rooms, values, timestamps, extras, sensors = (list(column) for column in zip(*pending))
+            try:
+                self.decide(rooms, values, timestamps, extras, sensors)
+            except Exception as e:
+                print(f"Error evaluating batch of {len(pending)} readings: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    async def run_async(self):
+        self._stop.clear()
+        while not self._stop.is_set():
+            await asyncio.sleep(self.interval)
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="rule-batcher")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        self.flush()
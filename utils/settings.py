@@ -0,0 +1,194 @@
+from datetime import time as dt_time
+from types import MappingProxyType
+import json
+import math
+import os
+import threading
+
+def _number(value):
+    if isinstance(value, bool):
+        raise ValueError(f"expected a number, got {value!r}")
+    try:
+        number = float(value)
+    except TypeError:
+        raise ValueError(f"expected a number, got {value!r}") from None
+    if not math.isfinite(number):
+        raise ValueError(f"expected a finite number, got {value!r}")
+    return number
+
+def _flag(value):
+    if not isinstance(value, bool):
+        raise ValueError(f"expected true or false, got {value!r}")
+    return value
+
+def _time_of_day(value):
+    if not isinstance(value, str):
+        raise ValueError(f"expected a time like 'HH:MM', got {value!r}")
+    dt_time.fromisoformat(value)
+    return value
+
+# Checks and coerces each setting; raises ValueError for values the rules couldn't compile
+VALIDATORS = {
+    'temp_threshold': _number,
+    'alert_enabled': _flag,
+    'alarm_enabled': _flag,
+    'alarm_start': _time_of_day,
+    'alarm_end': _time_of_day,
+}
+
+class ConfigStore:
+    """
+    Versioned store for the runtime settings ('default_settings' in config.json).
+    Attributes:
+        snapshot (Mapping): Current settings, read-only. Every change swaps in a new snapshot
+            (copy-on-write), so readers take store.snapshot without locking and never see a half-applied update.
+        version (int): Lamport-style clock, incremented on every local change and carried by
+            published updates.
+        origin (str): Identifies this process in published updates, e.g. 'user1'.
+        validators (dict): key -> function returning the coerced value or raising ValueError.
+    Changes come from three places, which all end up in update() and the same listeners:
+        - local edits (Flask routes), source 'local'
+        - config.json being edited on disk (watch()), source 'file'
+        - versioned updates from the other client over MQTT (apply_remote()), source 'mqtt'
+    Each key remembers the (version, origin) of the change that set it. A remote key is only taken
+    if its stamp is newer. So a delayed or re-delivered update can't roll a setting back, and two
+    clients that change different settings at the same time keep both changes.
+    Every change is validated first, whichever way it came in; one invalid value rejects the whole
+    change with ValueError and the snapshot is left as it was.
+    """
+    def __init__(self, settings, origin, validators=VALIDATORS):
+        self.validators = validators
+        self.snapshot = MappingProxyType(self._validated(settings))
+        self.version = 0
+        self.origin = origin
+        self._stamps = {}  # key -> (version, origin) of the change that set it
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._watch_stop = threading.Event()
+        self._watch_thread = None
+
+    def get(self, key, default=None):
+        return self.snapshot.get(key, default)
+
+    def subscribe(self, listener):
+        """listener(snapshot, changed_keys, source) is called after every change, in order."""
+        self._listeners.append(listener)
+
+    def _validated(self, changes):
+        validated = {}
+        for key, value in changes.items():
+            validate = self.validators.get(key)
+            try:
+                validated[key] = validate(value) if validate else value
+            except ValueError as e:
+                raise ValueError(f"Invalid setting '{key}': {e}") from None
+        return validated
+
+    def update(self, changes, source='local', stamps=None):
+        """
+        Applies changes to known keys and notifies listeners; returns the changed keys.
+        stamps maps keys to the (version, origin) of a remote change; a key is only taken if its
+        stamp is newer than the one that set the local value.
+        Raises ValueError, without applying anything, if a value fails validation.
+        """
+        with self._lock:
+            current = self.snapshot
+            changes = self._validated({key: value for key, value in changes.items() if key in current})
+            changed = []
+            for key, value in changes.items():
+                if key not in current:
+                    continue
+                if stamps is not None:
+                    stamp = tuple(stamps.get(key, (0, '')))
+                    if stamp <= self._stamps.get(key, (0, '')):
+                        continue
+                    self._stamps[key] = stamp
+                    self.version = max(self.version, stamp[0])
+                if current[key] != value:
+                    changed.append(key)
+            if not changed:
+                return []
+            if stamps is None:
+                self.version += 1
+                for key in changed:
+                    self._stamps[key] = (self.version, self.origin)
+            new = dict(current)
+            for key in changed:
+                new[key] = changes[key]
+            self.snapshot = MappingProxyType(new)
+            # Listeners run under the lock so notifications go out in version order
+            for listener in self._listeners:
+                try:
+                    listener(self.snapshot, changed, source)
+                except Exception as e:
+                    print(f"Error applying configuration change: {e}")
+            return changed
+
+    def message(self):
+        """The versioned update published on the config topic: all settings with their stamps."""
+        with self._lock:
+            return json.dumps({
+                'version': self.version,
+                'origin': self.origin,
+                'settings': dict(self.snapshot),
+                'stamps': {key: list(stamp) for key, stamp in self._stamps.items()},
+            })
+
+    def apply_remote(self, text):
+        """
+        Applies an update received on the config topic. Unversioned messages from older clients
+        (a bare settings object) are applied as they arrive. Raises ValueError for malformed JSON or
+        invalid settings.
+        """
+        message = json.loads(text)
+        if 'stamps' not in message:
+            return self.update(message, source='mqtt')
+        with self._lock:
+            self.version = max(self.version, message['version'])
+            return self.update(message['settings'], source='mqtt', stamps=message['stamps'])
+
+    def _watch(self, path, interval):
+        def read():
+            with open(path, 'r') as f:
+                return json.load(f).get('default_settings', {})
+        try:
+            mtime = os.stat(path).st_mtime
+            on_disk = read()
+        except (OSError, ValueError) as e:
+            print(f"Not watching {path}: {e}")
+            return
+        while not self._watch_stop.wait(interval):
+            try:
+                current_mtime = os.stat(path).st_mtime
+                if current_mtime == mtime:
+                    continue
+                mtime = current_mtime
+                loaded = read()
+            except (OSError, ValueError) as e:
+                # Editors often write in several steps; try again on the next tick
+                print(f"Could not reload {path}: {e}")
+                continue
+            # Only keys edited in the file are applied, so earlier changes made at runtime survive
+            edited = {key: value for key, value in loaded.items() if on_disk.get(key) != value}
+            on_disk = loaded
+            if edited:
+                try:
+                    changed = self.update(edited, source='file')
+                except ValueError as e:
+                    print(f"Not reloading {path}: {e}")
+                    continue
+                print(f"Reloaded {path}: {', '.join(changed) or 'no changes'}")
+
+    def watch(self, path, interval=2.0):
+        """Polls path for changes to default_settings on a background thread."""
+        if self._watch_thread is None:
+            self._watch_stop.clear()
+            self._watch_thread = threading.Thread(target=self._watch, args=(path, interval), name="config-watch")
+            self._watch_thread.daemon = True
+            self._watch_thread.start()
+
+    def stop(self):
+        self._watch_stop.set()
+        if self._watch_thread:
+            self._watch_thread.join(2)
+            self._watch_thread = None
@@ -0,0 +1,92 @@
+"""
+Startup tracking for the web clients.
+
+create_app() only reads config.json and builds the Flask app and the cheap in-memory components,
+so a process answers HTTP as soon as its web server is listening. Everything with slow imports or
+I/O (NumPy rules, cryptography and key files, SQLite history, outbox recovery, the broker
+connection) is started afterwards on a background thread or executor. /ready answers 503 until
+that has finished and the broker is connected, so a rolling deploy only sends traffic to a
+process that can do its job.
+"""
+import socket
+import threading
+import time
+
+class Startup:
+    """
+    Attributes:
+        started (float): perf_counter() when the client module was loaded.
+        stages (dict): Stage name -> seconds after started when it was first reached.
+        error (str): Why initialization failed, or None.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.error = None
+        self.begun = False
+        self._done = threading.Event()
+        self._thread = None
+
+    def mark(self, stage):
+        """Records the first time a stage is reached; later calls are ignored."""
+        self.stages.setdefault(stage, round(time.perf_counter() - self.started, 4))
+
+    @property
+    def initialized(self):
+        return self._done.is_set() and self.error is None
+
+    def wait_listening(self, port, timeout=10.0):
+        """
+        Waits until the web server accepts connections on port, so the slow imports that follow
+        don't compete with the server's own startup for the GIL.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                self.mark('listening')
+                return True
+            except OSError:
+                time.sleep(0.005)
+        return False
+
+    def call(self, init, port=None):
+        """
+        Runs init() and marks 'initialized', or records the error it raised. With port, waits for
+        the web server to listen first.
+        """
+        self.begun = True
+        try:
+            if port is not None:
+                self.wait_listening(port)
+            init()
+            self.mark('initialized')
+        except Exception as e:
+            self.error = str(e)
+            print(f"Error during startup: {e}")
+        finally:
+            self._done.set()
+
+    def run(self, init, port=None):
+        """Runs call(init, port) on a background thread."""
+        if self._thread is None:
+            self.begun = True
+            self._thread = threading.Thread(target=self.call, args=(init, port), name="startup")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until an initialization that has begun has finished, successfully or not; returns
+        False on timeout.
+        """
+        return not self.begun or self._done.wait(timeout)
+
+    def status(self, connected):
+        return {
+            'ready': self.initialized and connected,
+            'initialized': self.initialized,
+            'mqtt_connected': connected,
+            'stages': dict(self.stages),
+            'error': self.error,
+        }
@@ -0,0 +1,71 @@
+from collections import deque
+import json
+import threading
+import uuid
+
+class StateCache:
+    """
+    In-memory cache of the latest dashboard state, sent to browsers as one snapshot.
+    Attributes:
+        version (int): Incremented on every change; with instance_id, the ETag of the JSON snapshot.
+        instance_id (str): Random per cache, so versions counted by an earlier process (which also
+            start at 0) never match an ETag a browser kept from before a restart.
+    Values are plain top-level keys (set), per-room maps (set_room) or bounded event lists (add_event).
+    The serialized snapshot is cached until the next change, so many readers of the same version
+    share one json.dumps.
+    """
+    def __init__(self, event_size=50, **initial):
+        self.version = 0
+        self.instance_id = uuid.uuid4().hex[:12]
+        self.event_size = event_size
+        self._values = dict(initial)
+        self._rooms = {}  # key -> {room: value}
+        self._events = {}  # key -> deque of events
+        self._lock = threading.Lock()
+        self._cached = None  # (version, etag, body)
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+            self.version += 1
+
+    def set_room(self, key, room, value):
+        """Stores value for room under key and also as the latest value of key."""
+        with self._lock:
+            self._rooms.setdefault(key, {})[room] = value
+            self._values[key] = value
+            self.version += 1
+
+    def add_event(self, key, event):
+        with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                events = self._events[key] = deque(maxlen=self.event_size)
+            events.append(event)
+            self.version += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._values.get(key, default)
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = dict(self._values)
+            for key, rooms in self._rooms.items():
+                snapshot[f"{key}_by_room"] = dict(rooms)
+            for key, events in self._events.items():
+                snapshot[key + '_events'] = list(events)
+            snapshot['version'] = self.version
+            return snapshot
+
+    def to_json(self):
+        """Returns (etag, body) for the current version, serializing at most once per version."""
+        cached = self._cached
+        if cached is not None and cached[0] == self.version:
+            return cached[1], cached[2]
+        snapshot = self.snapshot()
+        version = snapshot['version']
+        etag = f"{self.instance_id}-{version}"
+        body = json.dumps(snapshot)
+        self._cached = (version, etag, body)
+        return etag, body
@@ -0,0 +1,221 @@
+from collections import deque
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    series TEXT NOT NULL,
+    ts REAL NOT NULL,
+    value REAL,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS readings_series_ts ON readings (series, ts);
+"""
+
+def bucketize(rows, start, resolution):
+    """Aggregates (ts, value) rows into min/max/avg/sum/count buckets of 'resolution' seconds."""
+    buckets = {}
+    for ts, value in rows:
+        index = int((ts - start) // resolution)
+        bucket = buckets.get(index)
+        if bucket is None:
+            buckets[index] = [value, value, value, 1]
+        else:
+            if value < bucket[0]:
+                bucket[0] = value
+            if value > bucket[1]:
+                bucket[1] = value
+            bucket[2] += value
+            bucket[3] += 1
+    return [
+        {'t': start + index * resolution, 'min': b[0], 'max': b[1], 'avg': b[2] / b[3], 'sum': b[2], 'count': b[3]}
+        for index, b in sorted(buckets.items())
+    ]
+
+class TimeSeriesStore:
+    """
+    Persistent store for sensor history: an in-memory ring buffer per series in front of SQLite.
+    Attributes:
+        path (str): SQLite database file.
+        ring_size (int): Number of recent points kept in memory per series.
+        flush_interval (float): Seconds between background batch writes.
+        flush_size (int): Pending rows that trigger an early write.
+        retention (float): Seconds of history kept on disk; older rows are pruned.
+        written (int): Rows written to SQLite so far.
+    Series names look like 'temperature/<room>/<sensor>'. Numeric readings store a value; events
+    such as motion store the number of detections they stand for (1.0 for one detection, the
+    detection count for a motion window summary) plus their message, so a bucket's sum counts
+    detections and its count counts log entries.
+    """
+    def __init__(self, path, ring_size=3600, flush_interval=1.0, flush_size=1000, retention=7 * 86400):
+        self.path = path
+        self.ring_size = ring_size
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.retention = retention
+        self.written = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._pending = []
+        self._rings = {}  # series -> deque of (ts, value, message)
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+        self._last_prune = 0
+
+    @classmethod
+    def from_config(cls, config_data, user):
+        settings = config_data.get('history', {})
+        if not settings.get('enabled', True):
+            return None
+        return cls(
+            settings.get('paths', {}).get(user, f"data/{user}_history.db"),
+            ring_size=settings.get('ring_size', 3600),
+            flush_interval=settings.get('flush_interval', 1.0),
+            flush_size=settings.get('flush_size', 1000),
+            retention=settings.get('retention_days', 7) * 86400,
+        )
+
+    def record(self, series, ts, value, message=None):
+        with self._lock:
+            self._pending.append((series, ts, value, message))
+            ring = self._rings.get(series)
+            if ring is None:
+                ring = self._rings[series] = deque(maxlen=self.ring_size)
+            ring.append((ts, value, message))
+            if len(self._pending) >= self.flush_size:
+                self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        with self._db_lock, self._conn:
+            self._conn.executemany("INSERT INTO readings (series, ts, value, message) VALUES (?, ?, ?, ?)", rows)
+        self.written += len(rows)
+        return len(rows)
+
+    def prune(self, now=None):
+        cutoff = (now or time.time()) - self.retention
+        with self._db_lock, self._conn:
+            self._conn.execute("DELETE FROM readings WHERE ts < ?", (cutoff,))
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.time() - self._last_prune > 3600:
+                    self._last_prune = time.time()
+                    self.prune()
+            except Exception as e:
+                print(f"Error writing history: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="history-writer")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        self.flush()
+
+    def series(self):
+        with self._db_lock:
+            stored = {row[0] for row in self._conn.execute("SELECT DISTINCT series FROM readings")}
+        with self._lock:
+            stored.update(self._rings)
+        return sorted(stored)
+
+    def query(self, series, start, end, resolution):
+        """Returns min/max/avg/sum/count buckets for series between start and end (epoch seconds)."""
+        with self._lock:
+            ring = self._rings.get(series)
+            # Serve from memory when the ring buffer covers the whole window
+            if ring and ring[0][0] <= start:
+                rows = [(ts, value) for ts, value, _ in ring if start <= ts <= end]
+                return bucketize(rows, start, resolution)
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT CAST((ts - ?) / ? AS INTEGER) AS bucket, MIN(value), MAX(value), AVG(value), SUM(value), COUNT(*) "
+                "FROM readings WHERE series = ? AND ts BETWEEN ? AND ? GROUP BY bucket ORDER BY bucket",
+                (start, resolution, series, start, end),
+            ).fetchall()
+        return [
+            {'t': start + bucket * resolution, 'min': low, 'max': high, 'avg': avg, 'sum': total, 'count': count}
+            for bucket, low, high, avg, total, count in rows
+        ]
+
+    def events(self, prefix, limit=50):
+        """Returns the most recent events (rows with a message) whose series starts with prefix, newest first."""
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT series, ts, message FROM readings WHERE series >= ? AND series < ? AND message IS NOT NULL "
+                "ORDER BY ts DESC LIMIT ?",
+                (prefix, prefix + '\uffff', limit),
+            ).fetchall()
+        return [{'series': series, 't': ts, 'message': message} for series, ts, message in rows]
+
+def history_request(store, args, max_points=500):
+    """
+    Parses /history query arguments and runs the query.
+    - series: required series name (see /history/series).
+    - start, end: epoch seconds; defaults to the last hour.
+    - resolution: bucket width in seconds; defaults to (end - start) / points.
+    - points: target number of buckets when resolution is omitted (default max_points).
+    Raises ValueError for invalid arguments.
+    """
+    series = args.get('series')
+    if not series:
+        raise ValueError("Missing 'series' parameter")
+    end = float(args.get('end', time.time()))
+    start = float(args.get('start', end - 3600))
+    if start >= end:
+        raise ValueError("'start' must be before 'end'")
+    points = min(int(args.get('points', max_points)), max_points * 10)
+    if points <= 0:
+        raise ValueError("'points' must be positive")
+    resolution = float(args.get('resolution', 0)) or (end - start) / points
+    if resolution <= 0 or (end - start) / resolution > max_points * 10:
+        raise ValueError(f"'resolution' must be positive and yield at most {max_points * 10} buckets")
+    return {
+        'series': series,
+        'start': start,
+        'end': end,
+        'resolution': resolution,
+        'buckets': store.query(series, start, end, resolution),
+    }
+
+def events_request(store, args, max_events=1000):
+    """
+    Parses /history/events query arguments and runs the query.
+    - prefix: series prefix; defaults to 'motion/'.
+    - limit: number of events, newest first (default 50, at most max_events).
+    Raises ValueError for invalid arguments.
+    """
+    try:
+        limit = int(args.get('limit', 50))
+    except ValueError:
+        raise ValueError("'limit' must be an integer") from None
+    if not 0 < limit <= max_events:
+        raise ValueError(f"'limit' must be between 1 and {max_events}")
+    return store.events(args.get('prefix', 'motion/'), limit)
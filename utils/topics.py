@@ -0,0 +1,42 @@
+from collections import namedtuple
+
+# Delivery settings of one entry in mqtt.topics
+TopicOptions = namedtuple('TopicOptions', ['topic', 'qos', 'retain'])
+
+def load_topics(config_data):
+    """
+    Reads mqtt.topics from config.json. Each entry is either a topic string (QoS 0, not retained)
+    or {"topic": ..., "qos": 0-2, "retain": true/false}; returns {name: TopicOptions}.
+    """
+    topics = {}
+    for name, entry in config_data['mqtt']['topics'].items():
+        if isinstance(entry, str):
+            entry = {'topic': entry}
+        qos = int(entry.get('qos', 0))
+        if qos not in (0, 1, 2):
+            raise ValueError(f"mqtt.topics.{name}: qos must be 0, 1 or 2, got {qos}")
+        topics[name] = TopicOptions(entry['topic'], qos, bool(entry.get('retain', False)))
+    return topics
+
+def sensor_topic(base_topic, room, sensor_id):
+    """Builds the per-sensor topic, e.g. public/server-room/temp/<room>/<sensor_id>."""
+    return f"{base_topic}/{room}/{sensor_id}"
+
+def topic_filter(base_topic):
+    # 'base/#' also matches 'base' itself, so legacy single-topic publishers keep working
+    return f"{base_topic}/#"
+
+def matches(base_topic, topic):
+    return topic == base_topic or topic.startswith(base_topic + '/')
+
+def parse_sensor_topic(base_topic, topic):
+    """
+    Splits a topic published under base_topic into (room, sensor_id).
+    Returns (None, None) for the bare base topic and (room, None) for a room-level topic.
+    """
+    if topic == base_topic:
+        return None, None
+    parts = topic[len(base_topic) + 1:].split('/', 1)
+    if len(parts) == 1:
+        return parts[0], None
+    return parts[0], parts[1]
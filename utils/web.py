@@ -0,0 +1,83 @@
+"""
+Routes shared by both web clients.
+
+Each client module keeps its components in module globals, most of which are only set once
+create_app() and init_components() have run, so the shared routes are given the module itself and
+read its globals (startup, state, history, mqtt_client, metrics, metrics_settings) on every request.
+"""
+from flask import Blueprint, current_app, jsonify, render_template, request
+from utils.timeseries import events_request, history_request
+
+# Read (GET) while init_components() is still running; everything else answers 503 until it is done
+STARTUP_ENDPOINTS = ('index', 'ready', 'state_snapshot', 'metrics_endpoint')
+
+def create_blueprint(name, client, template, startup_endpoints=()):
+    """
+    Returns a Blueprint with the routes every client serves: the dashboard page, /ready, /state,
+    /history, /connection and /metrics, plus the 503 guard used during startup. The client adds its
+    own routes to it. startup_endpoints names further endpoints of the client whose GETs only need
+    what create_app() builds, so they are served during startup too.
+    """
+    routes = Blueprint(name, client.__name__)
+    served = {f"{name}.{endpoint}" for endpoint in STARTUP_ENDPOINTS + tuple(startup_endpoints)} | {'static'}
+
+    @routes.before_app_request
+    def require_initialized():
+        if not client.startup.initialized and (request.endpoint not in served or request.method not in ('GET', 'HEAD')):
+            return jsonify({'error': 'Starting up', 'stages': client.startup.stages}), 503, {'Retry-After': '1'}
+
+    @routes.route('/')
+    def index():
+        return render_template(template)
+
+    @routes.route('/ready')
+    def ready():
+        # For rolling deploys: 200 once the components are up and the broker is connected
+        mqtt_client = client.mqtt_client
+        status = client.startup.status(mqtt_client is not None and mqtt_client.is_connected())
+        return jsonify(status), 200 if status['ready'] else 503
+
+    @routes.route('/state')
+    def state_snapshot():
+        # Cached snapshot with ETag so reloads that already have this version get a 304
+        etag, body = client.state.to_json()
+        response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    @routes.route('/history')
+    def history_query():
+        if client.history is None:
+            return jsonify({'error': 'History is disabled'}), 404
+        try:
+            return jsonify(history_request(client.history, request.args))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    @routes.route('/history/series')
+    def history_series():
+        if client.history is None:
+            return jsonify({'error': 'History is disabled'}), 404
+        return jsonify(client.history.series())
+
+    @routes.route('/history/events')
+    def history_events():
+        if client.history is None:
+            return jsonify({'error': 'History is disabled'}), 404
+        try:
+            return jsonify(events_request(client.history, request.args))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    @routes.route('/connection')
+    def connection_stats():
+        return jsonify(client.mqtt_client.stats() if client.mqtt_client else {'connected': False})
+
+    @routes.route('/metrics')
+    def metrics_endpoint():
+        if not client.metrics_settings.get('enabled', True):
+            return jsonify({'error': 'Metrics are disabled'}), 404
+        return current_app.response_class(client.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return routes